@@ -0,0 +1,199 @@
+"""
+Compact binary format for node logs and snapshots, the alternative to JSON lines.
+
+Every record is framed as
+    uint32      length of payload
+    uint32      crc32 of payload
+    bytes       payload
+
+and the payload starts with a record type:
+    0x10 message:  id, float64 timestamp, uint8 status, uint16/uint16/uint32/uint16
+                   lengths, then sender, recipient, content and custom status bytes
+    0x11 delete:   uint32 count, ids, then optionally count float64 deletion times
+    0x12 read:     uint32 count, ids
+    0x13 watermark: uint16 length + origin, uint16 length + epoch, uint64 seq
+
+ids are stored as 0x00 + 16 raw bytes when they are canonical UUID strings,
+otherwise as 0x01 + uint16 length + utf-8. The status is one byte from
+STATUS_CODES, or 0xff followed by the status text at the end of the record.
+"""
+import mmap
+import os
+import struct
+import zlib
+from common.message import Chatmsg, STATUS_CODES, STATUS_NAMES
+
+REC_MESSAGE = 0x10
+REC_DELETE = 0x11
+REC_READ = 0x12
+REC_WATERMARK = 0x13
+
+ID_UUID = 0x00
+ID_STR = 0x01
+STATUS_CUSTOM = 0xff
+
+FRAME_HEADER = struct.Struct('!II')
+# timestamp, status code, then the byte lengths of sender, recipient, content and custom status
+MESSAGE_FIXED = struct.Struct('!dBHHIH')
+BINARY_EXTENSION = '.binlog'
+
+_REC_MESSAGE = bytes((REC_MESSAGE,))
+_ID_UUID = bytes((ID_UUID,))
+_ID_STR = bytes((ID_STR,))
+
+
+def is_binary_log(filename):
+    return filename.endswith(BINARY_EXTENSION)
+
+
+def _pack_id(msg_id):
+    # canonical uuid4 strings, as generated by Chatmsg: 8-4-4-4-12 lowercase hex digits
+    if len(msg_id) == 36 and msg_id[8] == msg_id[13] == msg_id[18] == msg_id[23] == '-':
+        hex_digits = msg_id.replace('-', '')
+        if len(hex_digits) == 32 and hex_digits == hex_digits.lower():
+            try:
+                return _ID_UUID + bytes.fromhex(hex_digits)
+            except ValueError:
+                pass
+    data = msg_id.encode('utf-8')
+    return _ID_STR + struct.pack('!H', len(data)) + data
+
+
+def _unpack_id(payload, offset):
+    if payload[offset] == ID_UUID:
+        h = payload[offset + 1:offset + 17].hex()
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}", offset + 17
+    (length,) = struct.unpack_from('!H', payload, offset + 1)
+    offset += 3
+    return str(payload[offset:offset + length], 'utf-8'), offset + length
+
+
+def encode_entry(entry):
+    """Encode one log entry (message dict or operation dict) into a framed record"""
+    if entry.get("operation") == "watermark":
+        origin = entry["origin"].encode('utf-8')
+        epoch = entry["epoch"].encode('utf-8')
+        payload = b''.join((
+            bytes((REC_WATERMARK,)),
+            struct.pack('!H', len(origin)), origin,
+            struct.pack('!H', len(epoch)), epoch,
+            struct.pack('!Q', entry["seq"]),
+        ))
+    elif "operation" in entry:
+        kind = REC_DELETE if entry["operation"] == "delete" else REC_READ
+        parts = [bytes((kind,)), struct.pack('!I', len(entry["ids"]))]
+        parts.extend(_pack_id(msg_id) for msg_id in entry["ids"])
+        if kind == REC_DELETE and "deleted_at" in entry:
+            parts.append(struct.pack(f'!{len(entry["deleted_at"])}d', *entry["deleted_at"]))
+        payload = b''.join(parts)
+    else:
+        payload = _REC_MESSAGE + encode_message(
+            entry["id"], entry["timestamp"], entry["status"], entry["sender"], entry["recipient"], entry["content"]
+        )
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_message(msg_id, timestamp, status, sender, recipient, content):
+    """Fixed-layout encoding of a message, the body of a 0x10 record and of the 0x06 wire type of Protocol"""
+    status_code = STATUS_CODES.get(status, STATUS_CUSTOM)
+    custom = status.encode('utf-8') if status_code == STATUS_CUSTOM else b''
+    sender = sender.encode('utf-8')
+    recipient = recipient.encode('utf-8')
+    content = content.encode('utf-8')
+    return b''.join((
+        _pack_id(msg_id),
+        MESSAGE_FIXED.pack(timestamp, status_code, len(sender), len(recipient), len(content), len(custom)),
+        sender, recipient, content, custom,
+    ))
+
+
+def decode_message(payload, offset):
+    """
+    Decode an encode_message body starting at offset, payload may be bytes or a memoryview
+    :return: (Chatmsg, offset after it)
+    """
+    if payload[offset] == ID_UUID:
+        h = payload[offset + 1:offset + 17].hex()
+        msg_id = f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+        offset += 17
+    else:
+        msg_id, offset = _unpack_id(payload, offset)
+    timestamp, status_code, n_sender, n_recipient, n_content, n_custom = MESSAGE_FIXED.unpack_from(payload, offset)
+    offset += MESSAGE_FIXED.size
+    end = offset + n_sender
+    sender = str(payload[offset:end], 'utf-8')
+    offset, end = end, end + n_recipient
+    recipient = str(payload[offset:end], 'utf-8')
+    offset, end = end, end + n_content
+    content = str(payload[offset:end], 'utf-8')
+    offset, end = end, end + n_custom
+    if status_code == STATUS_CUSTOM:
+        status = str(payload[offset:end], 'utf-8')
+    else:
+        status = STATUS_NAMES[status_code]
+    return Chatmsg(sender, recipient, content, msg_id=msg_id, timestamp=timestamp, status=status), end
+
+
+def decode_payload(payload):
+    """Decode a record payload into a Chatmsg, or an operation dict like the JSON log uses"""
+    kind = payload[0]
+    if kind == REC_MESSAGE:
+        msg, _ = decode_message(payload, 1)
+        return msg
+
+    if kind in (REC_DELETE, REC_READ):
+        (count,) = struct.unpack_from('!I', payload, 1)
+        offset = 5
+        ids = []
+        for _ in range(count):
+            msg_id, offset = _unpack_id(payload, offset)
+            ids.append(msg_id)
+        if kind == REC_READ:
+            return {"operation": "read", "ids": ids}
+        record = {"operation": "delete", "ids": ids}
+        # records written before deletion times were logged end after the ids
+        if offset < len(payload):
+            record["deleted_at"] = list(struct.unpack_from(f'!{count}d', payload, offset))
+        return record
+
+    if kind == REC_WATERMARK:
+        (length,) = struct.unpack_from('!H', payload, 1)
+        offset = 3
+        origin = payload[offset:offset + length].decode()
+        offset += length
+        (length,) = struct.unpack_from('!H', payload, offset)
+        offset += 2
+        epoch = payload[offset:offset + length].decode()
+        (seq,) = struct.unpack_from('!Q', payload, offset + length)
+        return {"operation": "watermark", "origin": origin, "epoch": epoch, "seq": seq}
+
+    raise ValueError(f"Unknown record type: {kind}")
+
+
+def iter_records(f):
+    """
+    Yield the decoded records of a binary log opened in 'rb' mode.
+    Stops at a torn or corrupted last record, as left by a crash in the middle of a write;
+    a corrupted record followed by others raises ValueError instead of dropping them.
+    """
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return
+    # map the file instead of issuing two reads per record
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = 0
+        header_size = FRAME_HEADER.size
+        while offset < size:
+            if size - offset < header_size:
+                print(f"⚠️ Ignoring truncated record header at the end of {f.name}")
+                return
+            length, crc = FRAME_HEADER.unpack_from(mm, offset)
+            offset += header_size
+            payload = mm[offset:offset + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                if offset + length < size:
+                    raise ValueError(f"Corrupted record at offset {offset - header_size} of {f.name}")
+                print(f"⚠️ Ignoring torn or corrupted record at the end of {f.name}")
+                return
+            offset += length
+            yield decode_payload(payload)
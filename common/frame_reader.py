@@ -0,0 +1,111 @@
+import struct
+from common.protocol import Protocol
+
+HEADER_SIZE = 12
+# a v2 header sets this bit in msg_type and carries a 4-byte request id after the length,
+# the response to a v2 request echoes its id so pipelined requests can be answered in any order
+HEADER_V2_FLAG = 1 << 63
+HEADER_V2_SIZE = HEADER_SIZE + 4
+# reject frames larger than this so a single peer cannot make us buffer unbounded data
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+# initial size of a connection's receive buffer, it grows for larger frames
+RECV_BUFFER_SIZE = 64 * 1024
+
+_header = struct.Struct("!QI")
+_request_id = struct.Struct("!I")
+
+
+def split_header(msg_type):
+    """:return: (msg_type without the version flag, size of the header)"""
+    if msg_type & HEADER_V2_FLAG:
+        return msg_type & ~HEADER_V2_FLAG, HEADER_V2_SIZE
+    return msg_type, HEADER_SIZE
+
+
+def recv_exactly(sock, size):
+    """
+    Read exactly size bytes with recv_into on a preallocated buffer.
+    :return: the bytearray, None when the peer closed the connection first
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return buf
+
+
+class FrameReader:
+    """
+    Reads the frames of one connection through a reusable receive buffer.
+
+    Each recv_into fills the free end of the buffer, so one read may bring several
+    frames (or a part of one); complete frames are decoded in place through a
+    memoryview and the unread tail is moved to the front before the next read.
+    """
+    def __init__(self, sock, buffer_size=RECV_BUFFER_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # first unread byte
+        self._end = 0  # end of the received bytes
+
+    def read_frame(self):
+        """
+        Read the next frame and decode its payload.
+        :return: (msg_type, obj), (None, None) when the peer closed the connection
+        """
+        msg_type, obj, _ = self.read_request()
+        return msg_type, obj
+
+    def read_request(self):
+        """
+        Read the next frame, in either header version.
+        :return: (msg_type, obj, request_id), request_id is None for v1 frames;
+                 (None, None, None) when the peer closed the connection
+        """
+        while True:
+            available = self._end - self._start
+            if available >= HEADER_SIZE:
+                msg_type, data_len = _header.unpack_from(self._buf, self._start)
+                msg_type, header_size = split_header(msg_type)
+                if data_len > self.max_frame_size:
+                    raise ValueError(f"Frame of {data_len} bytes exceeds limit of {self.max_frame_size}")
+                frame_size = header_size + data_len
+                if available >= frame_size:
+                    request_id = None
+                    if header_size == HEADER_V2_SIZE:
+                        request_id, = _request_id.unpack_from(self._buf, self._start + HEADER_SIZE)
+                    payload_start = self._start + header_size
+                    self._start += frame_size
+                    if data_len == 0:
+                        return msg_type, None, request_id
+                    obj, _ = Protocol.decode_obj(self._view[payload_start:payload_start + data_len])
+                    return msg_type, obj, request_id
+                self._make_room(frame_size)
+            else:
+                self._make_room(HEADER_SIZE)
+            n = self.sock.recv_into(self._view[self._end:])
+            if n == 0:
+                return None, None, None
+            self._end += n
+
+    def _make_room(self, frame_size):
+        """Make sure a frame_size frame starting at the first unread byte fits in the buffer"""
+        if self._start + frame_size <= len(self._buf):
+            return
+        remaining = self._end - self._start
+        if frame_size > len(self._buf):
+            buf = bytearray(max(frame_size, 2 * len(self._buf)))
+            buf[:remaining] = self._view[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        else:
+            # the tail may overlap the front, copy it out first
+            self._buf[:remaining] = bytes(self._view[self._start:self._end])
+        self._start = 0
+        self._end = remaining
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from collections import deque
+from common.binlog import is_binary_log
+from common.utils import to_log_entries, serialize_entries, move_records
+
+
+class LogWriter:
+    """
+    Long-lived, group-commit writer for a node's append-only log,
+    in JSON lines or in the binary format when the filename ends with .binlog.
+
+    Handlers enqueue records with append(); one background thread writes
+    everything queued since its last round with a single write() call, so
+    concurrent handlers share the cost of the syscalls (and of the fsync).
+
+    fsync policies:
+        always   - fsync after every batch, wait() returns once the record is on disk
+        interval - write and fsync the accumulated batch every interval_ms
+        os       - write every batch immediately and leave flushing to the OS
+    """
+    POLICIES = ("always", "interval", "os")
+
+    def __init__(self, filename, policy="interval", interval_ms=50, stats_window=1024):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Invalid fsync policy: {policy}")
+        self.filename = filename
+        self.binary = is_binary_log(filename)
+        self.policy = policy
+        self.interval = interval_ms / 1000.0
+
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()  # guards the file object
+        self._pending = []  # serialized entries not yet written
+        self._oldest_pending = None  # when the first of _pending was queued
+        self._enqueued = 0  # number of records handed to append()
+        self._committed = 0  # number of records written (and synced, unless policy is os)
+        self._flush_requested = False
+        self._closed = False
+        self._error = None  # raised by the writer thread, it stopped writing
+
+        # (batch size, flush latency in ms, queue wait of its oldest record in ms) of the most recent batches
+        self._batches = deque(maxlen=stats_window)
+        self._total_batches = 0
+        self._total_records = 0
+
+        self._file = open(filename, 'ab')
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, data, mode='append'):
+        """
+        Queue records, accepts the same data / mode as save_to_file (except overwrite).
+        :return: ticket to pass to wait()
+        """
+        if mode == 'overwrite':
+            raise ValueError("Use rewrite() to overwrite the log")
+        entries = to_log_entries(data, mode)
+        chunk = serialize_entries(entries, self.binary)
+        with self._cond:
+            self._raise_error()
+            if self._closed:
+                raise ValueError("LogWriter is closed")
+            if not self._pending:
+                self._oldest_pending = time.perf_counter()
+            self._pending.append(chunk)
+            self._enqueued += len(entries)
+            ticket = self._enqueued
+            if self.policy != "interval":
+                self._cond.notify_all()
+        return ticket
+
+    def wait(self, ticket):
+        """
+        Block until the records of the ticket are committed.
+        Only the always policy makes callers wait, otherwise it returns immediately.
+        Raises the error that stopped the writer thread, if any.
+        """
+        if self.policy != "always":
+            return
+        with self._cond:
+            while self._committed < ticket and not self._closed and self._error is None:
+                self._cond.wait()
+            self._raise_error()
+
+    def flush(self):
+        """Block until everything queued so far is written (and synced, unless policy is os)"""
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._committed < target and not self._closed and self._error is None:
+                self._cond.wait()
+            self._raise_error()
+
+    def rewrite(self, message_store):
+        """Replace the whole log with the given dataset, as save_to_file(..., 'overwrite')"""
+        self.rewrite_entries(to_log_entries(message_store, 'overwrite'))
+
+    def rewrite_entries(self, entries):
+        """Replace the whole log with the given log records"""
+        self.flush()
+        with self._io_lock:
+            self._file.close()
+            with open(self.filename, 'wb') as f:
+                f.write(serialize_entries(entries, self.binary))
+            self._file = open(self.filename, 'ab')
+
+    def rotate(self, target):
+        """Move the records written so far to target (see move_records), later ones go to an empty log"""
+        self.flush()
+        with self._io_lock:
+            self._file.close()
+            try:
+                move_records(self.filename, target)
+            finally:
+                self._file = open(self.filename, 'ab')
+
+    def truncate(self):
+        """Empty the log once its records are covered by a snapshot"""
+        self.rewrite({})
+
+    @property
+    def appended(self):
+        """Number of records appended since the writer was created"""
+        with self._cond:
+            return self._enqueued
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            self._thread.join()
+            with self._io_lock:
+                self._file.close()
+
+    def stats(self):
+        """Batch sizes, flush latency and queue wait of the recent batches"""
+        with self._cond:
+            batches = list(self._batches)
+            total_batches = self._total_batches
+            total_records = self._total_records
+        sizes = [size for size, _, _ in batches]
+        latencies = [latency for _, latency, _ in batches]
+        waits = [wait for _, _, wait in batches]
+        return {
+            "policy": self.policy,
+            "batches": total_batches,
+            "records": total_records,
+            "recent_batches": batches,
+            "avg_batch_size": sum(sizes) / len(sizes) if sizes else 0,
+            "max_batch_size": max(sizes, default=0),
+            "avg_flush_ms": sum(latencies) / len(latencies) if latencies else 0,
+            "max_flush_ms": max(latencies, default=0),
+            "avg_queue_wait_ms": sum(waits) / len(waits) if waits else 0,
+            "max_queue_wait_ms": max(waits, default=0),
+        }
+
+    def _raise_error(self):
+        # called with _cond held
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        next_round = time.monotonic() + self.interval
+        while True:
+            with self._cond:
+                while not self._closed and not self._flush_requested:
+                    if self.policy == "interval":
+                        timeout = next_round - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self._cond.wait(timeout)
+                    elif self._pending:
+                        break
+                    else:
+                        self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+                batch = self._pending
+                self._pending = []
+                oldest = self._oldest_pending
+                batch_size = self._enqueued - self._committed
+                target = self._enqueued
+                self._flush_requested = False
+
+            if batch:
+                start = time.perf_counter()
+                queue_wait = (start - oldest) * 1000
+                try:
+                    with self._io_lock:
+                        self._file.write(b''.join(batch))
+                        self._file.flush()
+                        if self.policy != "os":
+                            os.fsync(self._file.fileno())
+                except OSError as e:
+                    # e.g. ENOSPC or EIO: stop here, waiters and later appends get the error
+                    print(f"⛔ Log writer failed on {self.filename}: {e}")
+                    with self._cond:
+                        self._error = e
+                        self._cond.notify_all()
+                    return
+                latency = (time.perf_counter() - start) * 1000
+            next_round = time.monotonic() + self.interval
+
+            with self._cond:
+                if batch:
+                    self._batches.append((batch_size, latency, queue_wait))
+                    self._total_batches += 1
+                    self._total_records += batch_size
+                self._committed = target
+                self._cond.notify_all()
@@ -1,16 +1,47 @@
+import sys
 import time
 import uuid
 
+# compact codes of the well-known statuses, used by the binary encodings
+STATUS_CODES = {"unread": 0, "read": 1}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
 
 class Chatmsg:
+    # millions of messages stay resident in message_store: no per-instance __dict__,
+    # usernames are interned so every message of a user shares one string,
+    # and a well-known status is kept as its code instead of a string decoded per message.
+    # content may be a reference to bytes kept elsewhere (anything with a load() method),
+    # decoded only when it is read
+    __slots__ = ("id", "timestamp", "sender", "recipient", "_content", "_status")
+
     def __init__(self, sender, recipient, content, msg_id=None, timestamp=None, status="unread"):
         self.id = msg_id if msg_id else str(uuid.uuid4()) 
         self.timestamp = timestamp if timestamp else time.time()  # float timestamp
-        self.sender = sender
-        self.recipient = recipient
+        self.sender = sys.intern(sender)
+        self.recipient = sys.intern(recipient)
         self.content = content
         self.status = status  
 
+    @property
+    def content(self):
+        content = self._content
+        return content if content.__class__ is str else content.load()
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    @property
+    def status(self):
+        status = self._status
+        return STATUS_NAMES[status] if status.__class__ is int else status
+
+    @status.setter
+    def status(self, status):
+        code = STATUS_CODES.get(status)
+        self._status = sys.intern(status) if code is None else code
+
     def __eq__(self, other):
         if isinstance(other, Chatmsg):
             return self.sender == other.sender and self.recipient == other.recipient and self.content == other.content and self.status == other.status  
@@ -1,5 +1,6 @@
 import struct
 from common.message import Chatmsg
+from common.binlog import encode_message, decode_message
 
 class Protocol:
     # constant for message type
@@ -13,6 +14,13 @@ class Protocol:
     REQ_DELETE_MESSAGE = 7
     REQ_DELETE_ACCOUNT = 8
     REQ_PING = 9
+    # payload: {"friend": str, "limit": int, optional "before"/"after": float timestamp,
+    #           optional "before_id"/"after_id": msg id to break timestamp ties}
+    REQ_LIST_MESSAGES_PAGE = 10
+    # payload: session token (str) of a previous login, answered like REQ_LOGIN_2
+    REQ_RESUME_SESSION = 11
+    # payload: list of wire features (str) the client understands, answered with RESP_HELLO
+    REQ_HELLO = 12
 
     # response
     RESP_USER_EXISTING = 101
@@ -21,47 +29,115 @@ class Protocol:
     RESP_LOGIN_FAILED = 104
     RESP_LIST_MESSAGES = 105
     RESP_LIST_USERS = 106
+    # payload: {"messages": [Chatmsg, ...] oldest first, "has_more": 0 | 1}
+    RESP_LIST_MESSAGES_PAGE = 107
+    # the server is overloaded and did not handle the request (e.g. too many logins pending), retry later
+    RESP_SERVER_BUSY = 108
+    # payload: session token (str) for REQ_RESUME_SESSION, sent right after every RESP_LOGIN_SUCCESS
+    # to clients that negotiated FEATURE_SESSION_TOKENS
+    RESP_SESSION_TOKEN = 109
+    # payload: the features of REQ_HELLO the server will use on this connection
+    RESP_HELLO = 110
+    # payload: {"id": msg id, "delivery": DELIVERY_*}, answers REQ_SEND_MSG of clients that negotiated
+    # FEATURE_SEND_RECEIPTS
+    RESP_MESSAGE_SENT = 111
+
+    # server push, sent at any time to a logged-in connection that negotiated FEATURE_PUSH (v1 header)
+    # payload: [Chatmsg, ...] new messages for the user
+    PUSH_NEW_MESSAGES = 201
+
+    # wire features negotiated with REQ_HELLO
+    # Chatmsg encoded as a fixed-layout record (type 0x06) instead of a dict (type 0x05)
+    FEATURE_COMPACT_CHATMSG = "compact_chatmsg"
+    # frames may carry a request id (v2 header, see common.frame_reader), responses echo it
+    # so the client can have several requests outstanding
+    FEATURE_REQUEST_IDS = "request_ids"
+    # a RESP_SESSION_TOKEN follows every RESP_LOGIN_SUCCESS
+    FEATURE_SESSION_TOKENS = "session_tokens"
+    # the connection receives PUSH_NEW_MESSAGES once logged in
+    FEATURE_PUSH = "push"
+    # REQ_SEND_MSG is answered with RESP_MESSAGE_SENT
+    FEATURE_SEND_RECEIPTS = "send_receipts"
+    FEATURES = (FEATURE_COMPACT_CHATMSG, FEATURE_REQUEST_IDS, FEATURE_SESSION_TOKENS, FEATURE_PUSH,
+                FEATURE_SEND_RECEIPTS)
+
+    # RESP_MESSAGE_SENT delivery
+    # pushed to a connection of the recipient on the sender's node, the message counts as read
+    DELIVERY_PUSHED = "pushed"
+    # the recipient is logged in on this node or, as last gossiped, on a peer: it gets the message
+    # with its next push or poll
+    DELIVERY_ONLINE = "online"
+    # the recipient is logged in nowhere, the message waits for its next login
+    DELIVERY_STORED = "stored"
 
     @staticmethod
-    def encode_obj(obj):
+    def encode_obj(obj, compact=False):
         """
         Serialize Python objects to binary format.
+        :param compact: encode Chatmsg as type 0x06, only for peers that negotiated FEATURE_COMPACT_CHATMSG
         """
-        if isinstance(obj, int):
-            return b'\x00' + struct.pack('!q', obj)
-
-        elif isinstance(obj, float):
-            return b'\x01' + struct.pack('!d', obj)  # 8-byte float
-
-        elif isinstance(obj, str):
-            data = obj.encode('utf-8')
-            length = len(data)
-            return b'\x02' + struct.pack('!I', length) + data
-
-        elif isinstance(obj, list):
-            encoded_items = [Protocol.encode_obj(item) for item in obj]
-            return b'\x03' + struct.pack('!I', len(obj)) + b''.join(encoded_items)
-
-        elif isinstance(obj, dict):
-            encoded_items = []
-            for k, v in obj.items():
-                encoded_key = Protocol.encode_obj(str(k))
-                encoded_value = Protocol.encode_obj(v)
-                encoded_items.append(encoded_key + encoded_value)
-            return b'\x04' + struct.pack('!I', len(obj)) + b''.join(encoded_items)
-
-        elif isinstance(obj, Chatmsg):
-            # Define Chatmsg as type 0x04, then encode it as a dictionary
-            encoded_chatmsg = Protocol.encode_obj(obj.to_dict())
-            return b'\x05' + encoded_chatmsg
+        return bytes(Protocol.encode_into(obj, bytearray(), compact))
 
-        else:
-            raise TypeError(f"Unsupported type: {type(obj)}")
+    @staticmethod
+    def encode_into(obj, buf, compact=False):
+        """
+        Append the encoding of obj to the bytearray buf and return it.
+        Nested lists and dicts are walked with an explicit stack instead of recursion,
+        every item is written straight into buf.
+        """
+        stack = [obj]
+        while stack:
+            item = stack.pop()
+            if type(item) is _Raw:
+                buf += item
+
+            elif isinstance(item, int):
+                buf += _INT.pack(0x00, item)
+
+            elif isinstance(item, float):
+                buf += _FLOAT.pack(0x01, item)  # 8-byte float
+
+            elif isinstance(item, str):
+                data = item.encode('utf-8')
+                buf += _SIZED.pack(0x02, len(data))
+                buf += data
+
+            elif isinstance(item, list):
+                buf += _SIZED.pack(0x03, len(item))
+                stack.extend(reversed(item))
+
+            elif isinstance(item, dict):
+                buf += _SIZED.pack(0x04, len(item))
+                for k, v in reversed(list(item.items())):
+                    stack.append(v)
+                    stack.append(str(k))
+
+            elif isinstance(item, Chatmsg) and compact:
+                # type 0x06: binary uuid, float64 timestamp, status byte and length-prefixed strings
+                buf += _CHATMSG_COMPACT
+                buf += encode_message(item.id, item.timestamp, item.status, item.sender, item.recipient, item.content)
+
+            elif isinstance(item, Chatmsg):
+                # type 0x05 wrapping the dictionary of to_dict(), whose keys are encoded once for all
+                buf += _CHATMSG_HEAD
+                stack += (
+                    item.status, _CHATMSG_KEYS[5],
+                    item.content, _CHATMSG_KEYS[4],
+                    item.recipient, _CHATMSG_KEYS[3],
+                    item.sender, _CHATMSG_KEYS[2],
+                    item.timestamp, _CHATMSG_KEYS[1],
+                    item.id, _CHATMSG_KEYS[0],
+                )
+
+            else:
+                raise TypeError(f"Unsupported type: {type(item)}")
+        return buf
 
     @staticmethod
     def decode_obj(data, offset=0):
         """
         Deserialize binary data back to Python objects.
+        data may be bytes, a bytearray or a memoryview, strings are decoded straight from it.
         """
         type_code = data[offset]
         offset += 1
@@ -79,7 +155,7 @@ class Protocol:
         elif type_code == 0x02:
             (str_len,) = struct.unpack_from('!I', data, offset)
             offset += 4
-            s = data[offset:offset + str_len].decode('utf-8')
+            s = str(data[offset:offset + str_len], 'utf-8')
             offset += str_len
             return s, offset
 
@@ -107,6 +183,21 @@ class Protocol:
             chatmsg_dict, offset = Protocol.decode_obj(data, offset)
             return Chatmsg.from_dict(chatmsg_dict), offset
 
+        elif type_code == 0x06:
+            return decode_message(data, offset)
+
         else:
             raise ValueError(f"Unknown type code: {type_code}")
 
+
+class _Raw(bytes):
+    """Already encoded bytes on the encoder stack"""
+
+
+_INT = struct.Struct('!Bq')
+_FLOAT = struct.Struct('!Bd')
+_SIZED = struct.Struct('!BI')  # type code and length of a str, list or dict
+_CHATMSG_COMPACT = bytes([0x06])
+_CHATMSG_FIELDS = ("id", "timestamp", "sender", "recipient", "content", "status")
+_CHATMSG_HEAD = bytes([0x05]) + _SIZED.pack(0x04, len(_CHATMSG_FIELDS))
+_CHATMSG_KEYS = tuple(_Raw(Protocol.encode_obj(field)) for field in _CHATMSG_FIELDS)
@@ -0,0 +1,41 @@
+import base64
+import hashlib
+import hmac
+import time
+
+# how long a session token stays valid, a day
+DEFAULT_SESSION_TTL_S = 24 * 3600
+
+
+def _sign(secret, payload):
+    return hmac.new(secret, payload.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_token(username, secret, ttl_s=DEFAULT_SESSION_TTL_S, now=None):
+    """
+    Signed session token of a logged in user: "<base64 username>.<expiry>.<hmac>".
+    Any node holding the same secret can check it without bcrypt.
+    :param secret: bytes shared by the nodes of the cluster
+    """
+    expires = int((time.time() if now is None else now) + ttl_s)
+    name = base64.urlsafe_b64encode(username.encode()).decode()
+    payload = f"{name}.{expires}"
+    return f"{payload}.{_sign(secret, payload)}"
+
+
+def verify_token(token, secret, now=None):
+    """
+    :return: the username of a valid token, None when it is malformed, forged or expired
+    """
+    if not isinstance(token, str):
+        return None
+    payload, _, signature = token.rpartition(".")
+    name, _, expires = payload.partition(".")
+    if not hmac.compare_digest(_sign(secret, payload), signature):
+        return None
+    try:
+        if int(expires) < (time.time() if now is None else now):
+            return None
+        return base64.urlsafe_b64decode(name.encode()).decode()
+    except ValueError:
+        return None
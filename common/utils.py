@@ -1,41 +1,81 @@
 from collections import defaultdict, deque
+from collections.abc import Mapping
+from itertools import islice
 import json
+import os
+import shutil
 import struct
+import time
 import bcrypt
 from common.protocol import Protocol
 from common.message import Chatmsg
+from common.binlog import encode_entry, iter_records, is_binary_log
+from common.frame_reader import recv_exactly, split_header, HEADER_SIZE, HEADER_V2_SIZE, HEADER_V2_FLAG, MAX_FRAME_SIZE
+
+# messages serialized at a time while a snapshot is written
+SNAPSHOT_BATCH_SIZE = 1000
 
 def recv_data(sock):
+    """
+    Read one frame. Only its bytes are consumed, use common.frame_reader.FrameReader
+    to read a connection's frames through one buffer.
+    """
+    msg_type, obj, _ = recv_request(sock)
+    return msg_type, obj
+
+def recv_request(sock):
+    """
+    Read one frame in either header version.
+    :return: (msg_type, obj, request_id), request_id is None for v1 frames
+    """
     # receive 12 bytes header
-    header = sock.recv(12)
-    if len(header) < 12:
-        return None, None
+    header = recv_exactly(sock, HEADER_SIZE)
+    if header is None:
+        return None, None, None
 
     # parse header
     msg_type, data_len = struct.unpack("!QI", header)
+    msg_type, header_size = split_header(msg_type)
+    request_id = None
+    if header_size == HEADER_V2_SIZE:
+        extra = recv_exactly(sock, HEADER_V2_SIZE - HEADER_SIZE)
+        if extra is None:
+            return None, None, None
+        request_id, = struct.unpack("!I", extra)
 
     if data_len == 0:
-        return msg_type, None
+        return msg_type, None, request_id
+    # the payload buffer is allocated up front, do not let a bad header ask for gigabytes
+    if data_len > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {data_len} bytes exceeds limit of {MAX_FRAME_SIZE}")
     
     # read payload
-    payload = b""
-    while len(payload) < data_len:
-        chunk = sock.recv(data_len - len(payload))
-        if not chunk:
-            return None, None 
-        payload += chunk
+    payload = recv_exactly(sock, data_len)
+    if payload is None:
+        return None, None, None
 
     obj, _ = Protocol.decode_obj(payload)
-    return msg_type, obj
+    return msg_type, obj, request_id
 
-def send_data(sock, msg_type, data):
-    if data is None:
-        payload = b""
+def send_data(sock, msg_type, data, compact=False, request_id=None):
+    """
+    :param request_id: sends a v2 header carrying this id, only to peers that negotiated FEATURE_REQUEST_IDS
+                       or in answer to a v2 request
+    """
+    sock.sendall(encode_frame(msg_type, data, compact, request_id))
+
+def encode_frame(msg_type, data, compact=False, request_id=None):
+    """The frame send_data writes, as a bytearray"""
+    # header and payload share one buffer, the header is filled in once the payload size is known
+    header_size = HEADER_SIZE if request_id is None else HEADER_V2_SIZE
+    frame = bytearray(header_size)
+    if data is not None:
+        Protocol.encode_into(data, frame, compact)
+    if request_id is None:
+        struct.pack_into('!QI', frame, 0, msg_type, len(frame) - header_size)
     else:
-        payload = Protocol.encode_obj(data)
-    data_len = len(payload)
-    header = struct.pack('!QI', msg_type, data_len)
-    sock.sendall(header + payload)    
+        struct.pack_into('!QII', frame, 0, msg_type | HEADER_V2_FLAG, len(frame) - header_size, request_id)
+    return frame
 
 def hash_pwd(password):
     salt = bcrypt.gensalt()
@@ -48,7 +88,7 @@ def check_pwd(password, hashed_password):
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Chatmsg):
-            return obj.__dict__
+            return obj.to_dict()
         return super().default(obj)
 
 def send_data_json(sock, msg_type, data):
@@ -93,6 +133,34 @@ def recv_data_json(sock):
 
     return msg_type, obj
 
+def to_log_entries(data, mode):
+    """
+    Standardize the data accepted by save_to_file into a list of log records
+    :param data: Full dataset (dict), single Chatmsg, list of message IDs or, in entries mode, ready-made log records
+    :param mode: Storage mode - overwrite | append | delete| read | entries
+    """
+    if mode not in ('overwrite', 'append', 'delete', 'read', 'entries'):
+        raise ValueError(f"Invalid mode: {mode}")
+    if mode == 'entries':
+        return list(data)
+
+    if isinstance(data, Mapping):  # Full dataset, a dict or the MessageStore
+        return [v.to_dict() for v in data.values()]
+    elif isinstance(data, Chatmsg):  # Single message
+        return [data.to_dict()]
+    elif isinstance(data, list):  # Batch operation
+        if mode == 'delete':
+            return [{"operation": "delete", "ids": data}]
+        elif mode == 'read':
+            return [{"operation": "read", "ids": data}]
+    raise TypeError("Unsupported data type")
+
+def serialize_entries(entries, binary=False):
+    """Serialize log entries as JSON lines, or as binary records (see common.binlog)"""
+    if binary:
+        return b''.join(encode_entry(entry) for entry in entries)
+    return ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8')
+
 def save_to_file(data, filename, mode='overwrite'):
     """
     Universal storage function with multiple modes
@@ -100,71 +168,145 @@ def save_to_file(data, filename, mode='overwrite'):
         1. Full dataset (dictionary format)
         2. Single Chatmsg object
         3. List of message IDs (for batch operations)
-    :param filename: Target storage filename
+    :param filename: Target storage filename, files ending with .binlog use the binary format
     :param mode: Storage mode - overwrite | append | delete| read
     """
-    def _write_entries(f, entries):
-        """Helper function to write JSON entries"""
-        for entry in entries:
-            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
-
-    # Mode preprocessing
-    if mode == 'overwrite':
-        file_mode = 'w'
-    elif mode in ('append', 'delete', 'read'):
-        file_mode = 'a' 
-    else:
-        raise ValueError(f"Invalid mode: {mode}")
-
-    # Data standardization
-    if isinstance(data, dict):  # Full dataset
-        entries = [v.to_dict() for v in data.values()]
-    elif isinstance(data, Chatmsg):  # Single message
-        entries = [data.to_dict()]
-    elif isinstance(data, list):  # Batch operation
-        if mode == 'delete':
-            entries = [{"operation": "delete", "ids": data}]
-        elif mode == 'read':
-            entries = [{"operation": "read", "ids": data}]
-    else:
-        raise TypeError("Unsupported data type")
+    entries = to_log_entries(data, mode)
+    file_mode = 'wb' if mode == 'overwrite' else 'ab'
 
     # Execute storage operation
     with open(filename, file_mode) as f:
-        _write_entries(f, entries)
+        f.write(serialize_entries(entries, is_binary_log(filename)))
+
 
 
 
+def snapshot_filename(log_filename):
+    """Snapshot kept next to a node log, e.g. node1.json -> node1.snapshot.json"""
+    root, ext = os.path.splitext(log_filename)
+    return f"{root}.snapshot{ext}"
 
-def load_from_file(message_store, messages, filename):
+def previous_log_filename(log_filename):
     """
-    Load chat data from file and populate both data structures
-    :param filename: JSON file path to load
-    :param message_store: Dict to store messages {msg_id: Chatmsg}
-    :param messages: Nested defaultdict for message relationships {recipient: {sender: deque(msg_ids)}}
+    Log records cut over by a snapshot that is still being written, e.g. node1.json -> node1.previous.json.
+    It only outlives the snapshot when the node stops in between, the records are then replayed again.
     """
-    try:
-        with open(filename, 'r') as f:
+    root, ext = os.path.splitext(log_filename)
+    return f"{root}.previous{ext}"
+
+def move_records(filename, target):
+    """Move the records of a log to target, appended to it if it exists, and leave the log empty"""
+    if not os.path.exists(filename):
+        open(filename, 'ab').close()
+    if not os.path.exists(target):
+        os.replace(filename, target)
+        return
+    # an earlier snapshot did not complete, target still holds records it did not cover
+    with open(filename, 'rb') as src, open(target, 'ab') as dst:
+        shutil.copyfileobj(src, dst)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.truncate(filename, 0)
+
+def watermark_entries(watermarks):
+    """Log records of the peer watermarks {origin: (epoch, seq)}"""
+    return [{"operation": "watermark", "origin": origin, "epoch": epoch, "seq": seq}
+            for origin, (epoch, seq) in watermarks.items()]
+
+def save_snapshot(message_store, filename, watermarks=None, tombstones=None):
+    """
+    Atomically replace the snapshot file with the full dataset:
+    write a temporary file, fsync it, then rename it over the old snapshot.
+    :param message_store: {msg_id: Chatmsg} or an iterable of Chatmsg, serialized SNAPSHOT_BATCH_SIZE at a time
+    :param watermarks: Optional peer watermarks {origin: (epoch, seq)} stored along with the messages
+    :param tombstones: Optional {msg_id: time of deletion} of deleted messages, stored as a delete record
+    """
+    root, ext = os.path.splitext(filename)
+    # keep the extension, it selects the format
+    tmp_filename = f"{root}.tmp{ext}"
+    binary = is_binary_log(tmp_filename)
+    msgs = iter(message_store.values() if isinstance(message_store, Mapping) else message_store)
+    entries = watermark_entries(watermarks or {})
+    if tombstones:
+        entries.append({"operation": "delete", "ids": list(tombstones), "deleted_at": list(tombstones.values())})
+    with open(tmp_filename, 'wb') as f:
+        while batch := list(islice(msgs, SNAPSHOT_BATCH_SIZE)):
+            f.write(serialize_entries([msg.to_dict() for msg in batch], binary))
+        f.write(serialize_entries(entries, binary))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+def read_records(filename):
+    """
+    Yield the records of a log (or snapshot) file in either format:
+    Chatmsg objects or message dicts, and {"operation": ..., "ids": [...]} dicts.
+    """
+    if is_binary_log(filename):
+        with open(filename, 'rb') as f:
+            yield from iter_records(f)
+    else:
+        with open(filename, 'r', encoding='utf-8') as f:
             for line in f:
-                record = json.loads(line)
-                if "operation" in record:
-                    if record["operation"] == "delete":
-                        for msg_id in record["ids"]:
-                            message_store.pop(msg_id, None)
-                    if record["operation"] == "read":
-                        for msg_id in record["ids"]:
+                yield json.loads(line)
+
+def replay_file(message_store, filename, watermarks=None, tombstones=None):
+    """
+    Apply every record of a log (or snapshot) file to message_store, missing files are skipped
+    :param watermarks: Optional dict filled with the peer watermarks {origin: (epoch, seq)} found in the file
+    :param tombstones: Optional dict filled with the deleted ids {msg_id: time of deletion},
+                       the load time for records written without deletion times
+    """
+    now = time.time()
+    try:
+        for record in read_records(filename):
+            if isinstance(record, Chatmsg):
+                message_store[record.id] = record
+                continue
+            if "operation" in record:
+                if record["operation"] == "delete":
+                    for msg_id in record["ids"]:
+                        message_store.pop(msg_id, None)
+                    if tombstones is not None:
+                        deleted_at = record.get("deleted_at") or [now] * len(record["ids"])
+                        for msg_id, when in zip(record["ids"], deleted_at):
+                            tombstones[msg_id] = when
+                if record["operation"] == "read":
+                    for msg_id in record["ids"]:
+                        # the message may have been deleted before the latest snapshot
+                        if msg_id in message_store:
                             message_store[msg_id].status = 'read'
-                    continue
-                
-                msg = Chatmsg.from_dict(record)
-                message_store[msg.id] = msg
+                if record["operation"] == "watermark" and watermarks is not None:
+                    watermarks[record["origin"]] = (record["epoch"], record["seq"])
+                continue
             
-            for msg in message_store.values():
-                messages[msg.recipient][msg.sender].append(msg.id)
-                
+            msg = Chatmsg.from_dict(record)
+            message_store[msg.id] = msg
     except FileNotFoundError:
         pass
 
+def load_from_file(message_store, messages, filename, indexes=(), snapshot=None, watermarks=None, tombstones=None):
+    """
+    Load chat data from file and populate both data structures
+    :param filename: JSON file path to load
+    :param message_store: Dict to store messages {msg_id: Chatmsg}
+    :param messages: Nested defaultdict for message relationships {recipient: {sender: deque(msg_ids)}}
+    :param indexes: Secondary indexes (e.g. ConversationIndex) to populate with the loaded messages
+    :param snapshot: Optional snapshot file loaded before the log, the log then only holds later records
+    :param watermarks: Optional dict filled with the peer watermarks {origin: (epoch, seq)}
+    :param tombstones: Optional dict filled with the ids of deleted messages
+    """
+    if snapshot is not None:
+        replay_file(message_store, snapshot, watermarks, tombstones)
+        # records of a snapshot the node did not finish writing
+        replay_file(message_store, previous_log_filename(filename), watermarks, tombstones)
+    replay_file(message_store, filename, watermarks, tombstones)
+
+    for msg in message_store.values():
+        messages[msg.recipient][msg.sender].append(msg.id)
+        for index in indexes:
+            index.add(msg)
+
 def save_user_accounts_to_json(user_accounts, filename='user_accounts.json'):
     with open(filename, 'w', encoding='utf-8') as f:
         json.dump(user_accounts, f, ensure_ascii=False, indent=4)
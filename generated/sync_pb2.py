@@ -24,21 +24,41 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nsync.proto\"T\n\x0b\x44\x61taPackage\x12\x1e\n\x08messages\x18\x01 \x03(\x0b\x32\x0c.MessageData\x12\x13\n\x0b\x64\x65leted_ids\x18\x02 \x03(\t\x12\x10\n\x08read_ids\x18\x03 \x03(\t\"p\n\x0bMessageData\x12\n\n\x02id\x18\x01 \x01(\t\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x11\n\trecipient\x18\x03 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x04 \x01(\t\x12\x0e\n\x06status\x18\x05 \x01(\t\x12\x11\n\ttimestamp\x18\x06 \x01(\x01\"6\n\x0cSyncResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x15\n\rerror_message\x18\x02 \x01(\t\"\x07\n\x05\x45mpty2\x88\x01\n\x08\x44\x61taSync\x12\'\n\x08\x46ullSync\x12\x0c.DataPackage\x1a\r.SyncResponse\x12.\n\x0fIncrementalSync\x12\x0c.DataPackage\x1a\r.SyncResponse\x12#\n\x0bGetFullData\x12\x06.Empty\x1a\x0c.DataPackageb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nsync.proto\"\xc9\x01\n\x0b\x44\x61taPackage\x12\x1e\n\x08messages\x18\x01 \x03(\x0b\x32\x0c.MessageData\x12\x13\n\x0b\x64\x65leted_ids\x18\x02 \x03(\t\x12\x10\n\x08read_ids\x18\x03 \x03(\t\x12\x0e\n\x06origin\x18\x04 \x01(\t\x12\r\n\x05\x65poch\x18\x05 \x01(\t\x12\x10\n\x08\x66rom_seq\x18\x06 \x01(\x04\x12\x0e\n\x06to_seq\x18\x07 \x01(\x04\x12\x1e\n\x08\x61\x63\x63ounts\x18\x08 \x03(\x0b\x32\x0c.AccountData\x12\x12\n\ndeleted_at\x18\t \x03(\x01\"I\n\x0b\x41\x63\x63ountData\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x15\n\rpassword_hash\x18\x02 \x01(\t\x12\x11\n\ttimestamp\x18\x03 \x01(\x01\"p\n\x0bMessageData\x12\n\n\x02id\x18\x01 \x01(\t\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x11\n\trecipient\x18\x03 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x04 \x01(\t\x12\x0e\n\x06status\x18\x05 \x01(\t\x12\x11\n\ttimestamp\x18\x06 \x01(\x01\"6\n\x0cSyncResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x15\n\rerror_message\x18\x02 \x01(\t\"\x07\n\x05\x45mpty\"%\n\x0f\x46ullDataRequest\x12\x12\n\nchunk_size\x18\x01 \x01(\r\"7\n\tWatermark\x12\x0e\n\x06origin\x18\x01 \x01(\t\x12\r\n\x05\x65poch\x18\x02 \x01(\t\x12\x0b\n\x03seq\x18\x03 \x01(\x04\"D\n\x0e\x43hangesRequest\x12\x1e\n\nwatermarks\x18\x01 \x03(\x0b\x32\n.Watermark\x12\x12\n\nchunk_size\x18\x02 \x01(\r\"2\n\x10TreeNodesRequest\x12\x0f\n\x07\x62uckets\x18\x01 \x01(\r\x12\r\n\x05nodes\x18\x02 \x03(\r\"\x1b\n\tTreeNodes\x12\x0e\n\x06hashes\x18\x01 \x03(\x0c\".\n\x0e\x42ucketsRequest\x12\x0f\n\x07\x62uckets\x18\x01 \x01(\r\x12\x0b\n\x03ids\x18\x02 \x03(\r\"+\n\x08Presence\x12\x0c\n\x04node\x18\x01 \x01(\t\x12\x11\n\tusernames\x18\x02 \x03(\t2\xa1\x02\n\x08\x44\x61taSync\x12\'\n\x08\x46ullSync\x12\x0c.DataPackage\x1a\r.SyncResponse\x12.\n\x0fIncrementalSync\x12\x0c.DataPackage\x1a\r.SyncResponse\x12#\n\x0bGetFullData\x12\x06.Empty\x1a\x0c.DataPackage\x12\x32\n\x0eStreamFullData\x12\x10.FullDataRequest\x1a\x0c.DataPackage0\x01\x12/\n\x0eStreamFullSync\x12\x0c.DataPackage\x1a\r.SyncResponse(\x01\x12\x32\n\x0fGetChangesSince\x12\x0f.ChangesRequest\x1a\x0c.DataPackage0\x01\x32k\n\x0b\x41ntiEntropy\x12-\n\x0cGetTreeNodes\x12\x11.TreeNodesRequest\x1a\n.TreeNodes\x12-\n\nGetBuckets\x12\x0f.BucketsRequest\x1a\x0c.DataPackage0\x01\x32\x32\n\x0ePresenceGossip\x12 \n\x08\x45xchange\x12\t.Presence\x1a\t.Presenceb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'sync_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_DATAPACKAGE']._serialized_start=14
-  _globals['_DATAPACKAGE']._serialized_end=98
-  _globals['_MESSAGEDATA']._serialized_start=100
-  _globals['_MESSAGEDATA']._serialized_end=212
-  _globals['_SYNCRESPONSE']._serialized_start=214
-  _globals['_SYNCRESPONSE']._serialized_end=268
-  _globals['_EMPTY']._serialized_start=270
-  _globals['_EMPTY']._serialized_end=277
-  _globals['_DATASYNC']._serialized_start=280
-  _globals['_DATASYNC']._serialized_end=416
+  _globals['_DATAPACKAGE']._serialized_start=15
+  _globals['_DATAPACKAGE']._serialized_end=216
+  _globals['_ACCOUNTDATA']._serialized_start=218
+  _globals['_ACCOUNTDATA']._serialized_end=291
+  _globals['_MESSAGEDATA']._serialized_start=293
+  _globals['_MESSAGEDATA']._serialized_end=405
+  _globals['_SYNCRESPONSE']._serialized_start=407
+  _globals['_SYNCRESPONSE']._serialized_end=461
+  _globals['_EMPTY']._serialized_start=463
+  _globals['_EMPTY']._serialized_end=470
+  _globals['_FULLDATAREQUEST']._serialized_start=472
+  _globals['_FULLDATAREQUEST']._serialized_end=509
+  _globals['_WATERMARK']._serialized_start=511
+  _globals['_WATERMARK']._serialized_end=566
+  _globals['_CHANGESREQUEST']._serialized_start=568
+  _globals['_CHANGESREQUEST']._serialized_end=636
+  _globals['_TREENODESREQUEST']._serialized_start=638
+  _globals['_TREENODESREQUEST']._serialized_end=688
+  _globals['_TREENODES']._serialized_start=690
+  _globals['_TREENODES']._serialized_end=717
+  _globals['_BUCKETSREQUEST']._serialized_start=719
+  _globals['_BUCKETSREQUEST']._serialized_end=765
+  _globals['_PRESENCE']._serialized_start=767
+  _globals['_PRESENCE']._serialized_end=810
+  _globals['_DATASYNC']._serialized_start=813
+  _globals['_DATASYNC']._serialized_end=1102
+  _globals['_ANTIENTROPY']._serialized_start=1104
+  _globals['_ANTIENTROPY']._serialized_end=1211
+  _globals['_PRESENCEGOSSIP']._serialized_start=1213
+  _globals['_PRESENCEGOSSIP']._serialized_end=1263
 # @@protoc_insertion_point(module_scope)
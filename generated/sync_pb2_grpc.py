@@ -49,6 +49,21 @@ class DataSyncStub(object):
                 request_serializer=sync__pb2.Empty.SerializeToString,
                 response_deserializer=sync__pb2.DataPackage.FromString,
                 _registered_method=True)
+        self.StreamFullData = channel.unary_stream(
+                '/DataSync/StreamFullData',
+                request_serializer=sync__pb2.FullDataRequest.SerializeToString,
+                response_deserializer=sync__pb2.DataPackage.FromString,
+                _registered_method=True)
+        self.StreamFullSync = channel.stream_unary(
+                '/DataSync/StreamFullSync',
+                request_serializer=sync__pb2.DataPackage.SerializeToString,
+                response_deserializer=sync__pb2.SyncResponse.FromString,
+                _registered_method=True)
+        self.GetChangesSince = channel.unary_stream(
+                '/DataSync/GetChangesSince',
+                request_serializer=sync__pb2.ChangesRequest.SerializeToString,
+                response_deserializer=sync__pb2.DataPackage.FromString,
+                _registered_method=True)
 
 
 class DataSyncServicer(object):
@@ -72,6 +87,26 @@ class DataSyncServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamFullData(self, request, context):
+        """the full store in bounded chunks, for stores too large for one message
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def StreamFullSync(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetChangesSince(self, request, context):
+        """the changes made on this node after the caller's watermark, OUT_OF_RANGE when they are no longer known
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_DataSyncServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -90,6 +125,21 @@ def add_DataSyncServicer_to_server(servicer, server):
                     request_deserializer=sync__pb2.Empty.FromString,
                     response_serializer=sync__pb2.DataPackage.SerializeToString,
             ),
+            'StreamFullData': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamFullData,
+                    request_deserializer=sync__pb2.FullDataRequest.FromString,
+                    response_serializer=sync__pb2.DataPackage.SerializeToString,
+            ),
+            'StreamFullSync': grpc.stream_unary_rpc_method_handler(
+                    servicer.StreamFullSync,
+                    request_deserializer=sync__pb2.DataPackage.FromString,
+                    response_serializer=sync__pb2.SyncResponse.SerializeToString,
+            ),
+            'GetChangesSince': grpc.unary_stream_rpc_method_handler(
+                    servicer.GetChangesSince,
+                    request_deserializer=sync__pb2.ChangesRequest.FromString,
+                    response_serializer=sync__pb2.DataPackage.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'DataSync', rpc_method_handlers)
@@ -181,3 +231,279 @@ class DataSync(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def StreamFullData(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/DataSync/StreamFullData',
+            sync__pb2.FullDataRequest.SerializeToString,
+            sync__pb2.DataPackage.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def StreamFullSync(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/DataSync/StreamFullSync',
+            sync__pb2.DataPackage.SerializeToString,
+            sync__pb2.SyncResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetChangesSince(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/DataSync/GetChangesSince',
+            sync__pb2.ChangesRequest.SerializeToString,
+            sync__pb2.DataPackage.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+
+class AntiEntropyStub(object):
+    """hash tree summary of a replica, compared by the anti-entropy task (server/anti_entropy.py)
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.GetTreeNodes = channel.unary_unary(
+                '/AntiEntropy/GetTreeNodes',
+                request_serializer=sync__pb2.TreeNodesRequest.SerializeToString,
+                response_deserializer=sync__pb2.TreeNodes.FromString,
+                _registered_method=True)
+        self.GetBuckets = channel.unary_stream(
+                '/AntiEntropy/GetBuckets',
+                request_serializer=sync__pb2.BucketsRequest.SerializeToString,
+                response_deserializer=sync__pb2.DataPackage.FromString,
+                _registered_method=True)
+
+
+class AntiEntropyServicer(object):
+    """hash tree summary of a replica, compared by the anti-entropy task (server/anti_entropy.py)
+    """
+
+    def GetTreeNodes(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetBuckets(self, request, context):
+        """messages and tombstones (deleted_ids) of the given buckets
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_AntiEntropyServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'GetTreeNodes': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetTreeNodes,
+                    request_deserializer=sync__pb2.TreeNodesRequest.FromString,
+                    response_serializer=sync__pb2.TreeNodes.SerializeToString,
+            ),
+            'GetBuckets': grpc.unary_stream_rpc_method_handler(
+                    servicer.GetBuckets,
+                    request_deserializer=sync__pb2.BucketsRequest.FromString,
+                    response_serializer=sync__pb2.DataPackage.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'AntiEntropy', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('AntiEntropy', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class AntiEntropy(object):
+    """hash tree summary of a replica, compared by the anti-entropy task (server/anti_entropy.py)
+    """
+
+    @staticmethod
+    def GetTreeNodes(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/AntiEntropy/GetTreeNodes',
+            sync__pb2.TreeNodesRequest.SerializeToString,
+            sync__pb2.TreeNodes.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetBuckets(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/AntiEntropy/GetBuckets',
+            sync__pb2.BucketsRequest.SerializeToString,
+            sync__pb2.DataPackage.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+
+class PresenceGossipStub(object):
+    """users logged in on each node, exchanged by the presence gossip (server/presence_gossip.py)
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.Exchange = channel.unary_unary(
+                '/PresenceGossip/Exchange',
+                request_serializer=sync__pb2.Presence.SerializeToString,
+                response_deserializer=sync__pb2.Presence.FromString,
+                _registered_method=True)
+
+
+class PresenceGossipServicer(object):
+    """users logged in on each node, exchanged by the presence gossip (server/presence_gossip.py)
+    """
+
+    def Exchange(self, request, context):
+        """the caller's online users, answered with ours
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_PresenceGossipServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'Exchange': grpc.unary_unary_rpc_method_handler(
+                    servicer.Exchange,
+                    request_deserializer=sync__pb2.Presence.FromString,
+                    response_serializer=sync__pb2.Presence.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'PresenceGossip', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('PresenceGossip', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class PresenceGossip(object):
+    """users logged in on each node, exchanged by the presence gossip (server/presence_gossip.py)
+    """
+
+    @staticmethod
+    def Exchange(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/PresenceGossip/Exchange',
+            sync__pb2.Presence.SerializeToString,
+            sync__pb2.Presence.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -3,10 +3,15 @@ import json
 import tkinter as tk
 from tkinter import messagebox
 import socket
+import select
+from collections import defaultdict, deque
 from common.protocol import Protocol
-from common.utils import send_data, recv_data
+from common.utils import send_data, recv_data, recv_request
 from common.message import Chatmsg
 
+# how long to wait for RESP_HELLO, older servers never answer REQ_HELLO
+HELLO_TIMEOUT_S = 1.0
+
 class ClientConfigLoader:
     def __init__(self, config_path = 'cluster_config.json'):
         with open(config_path) as f:
@@ -36,21 +41,41 @@ class ClientConfigLoader:
         ]
     
 class ChatClientApp:
+    # number of messages fetched per history page
+    PAGE_SIZE = 50
+    # how often the idle connection is checked for pushed messages
+    PUSH_POLL_MS = 200
+
     def __init__(self, root, host='127.0.0.1', port=5000):
         self.root = root
         self.host = host
         self.port = port
         self.client_socket = None
         self.username = None
+        # token of the current login, lets another node take the session over without the password
+        self.session_token = None
+        # whether the server sends a session token after each login
+        self.session_tokens = False
+        # whether the server echoes request ids, then several requests may be outstanding
+        self.request_ids = False
+        # whether the server tells if the recipient of a message is online
+        self.send_receipts = False
+        self.next_request_id = 0
+        # responses read while waiting for another request's, {request_id: deque([(type, obj), ...])}
+        self.early_responses = defaultdict(deque)
         self.protocol = Protocol()
         self.config = ClientConfigLoader()
         self.nodes = self.config.get_all_tcp_nodes()
         self.current_node_idx = 0
+        # loaded part of the open conversation, oldest first
+        self.chat_messages = []
+        self.has_older_messages = False
 
         
         self.current_screen = None
 
         self.login_screen()
+        self.root.after(self.PUSH_POLL_MS, self._poll_pushes)
 
     def _connect_with_retry(self):
         while not self._is_connected():
@@ -74,12 +99,105 @@ class ChatClientApp:
         self.client_socket.settimeout(5)  # Set connection timeout
         try:
             self.client_socket.connect((node['host'], node['port']))
+            self.early_responses.clear()
+            # ask for the compact message encoding, request ids and session tokens
+            send_data(self.client_socket, Protocol.REQ_HELLO, list(Protocol.FEATURES))
+            features = self._recv_hello()
+            self.request_ids = Protocol.FEATURE_REQUEST_IDS in (features or ())
+            self.session_tokens = Protocol.FEATURE_SESSION_TOKENS in (features or ())
+            self.send_receipts = Protocol.FEATURE_SEND_RECEIPTS in (features or ())
+            self._resume_session()
             print(f"Connected to {node['name']} successfully")
             self._update_ui_connection_status(True, node)
         except (socket.timeout, ConnectionRefusedError) as e:
             self.client_socket.close()
             raise ConnectionError(f"Failed to connect to {node['name']}: {str(e)}")
 
+    def _recv_hello(self):
+        """
+        :return: the features of RESP_HELLO, None when the server does not answer REQ_HELLO in time
+        """
+        if not select.select([self.client_socket], [], [], HELLO_TIMEOUT_S)[0]:
+            print("No answer to REQ_HELLO, using the default encoding")
+            return None
+        _, features = recv_data(self.client_socket)
+        return features
+
+    def _resume_session(self):
+        """Resume the session of the previous connection, if any and if the server supports it"""
+        if self.session_token is None:
+            return
+        if not self.session_tokens:
+            print("Session could not be resumed")
+            self.session_token = None
+            return
+        send_data(self.client_socket, Protocol.REQ_RESUME_SESSION, self.session_token)
+        resp_type, _ = recv_data(self.client_socket)
+        if resp_type == Protocol.RESP_LOGIN_SUCCESS:
+            _, self.session_token = recv_data(self.client_socket)
+        else:
+            print("Session could not be resumed")
+            self.session_token = None
+
+    def _send_request(self, msg_type, data):
+        """
+        Send a request, tagged with a new request id when the server supports them.
+        :return: the request id to pass to _recv_response
+        """
+        if not self.request_ids:
+            send_data(self.client_socket, msg_type, data)
+            return None
+        self.next_request_id = (self.next_request_id + 1) % (1 << 32)
+        send_data(self.client_socket, msg_type, data, request_id=self.next_request_id)
+        return self.next_request_id
+
+    def _recv_response(self, request_id):
+        """
+        Read the next response to request_id, responses to other requests are kept for later
+        and messages pushed meanwhile are shown once the current operation is done.
+        """
+        if self.early_responses[request_id]:
+            return self.early_responses[request_id].popleft()
+        while True:
+            resp_type, resp, resp_id = recv_request(self.client_socket)
+            if resp_type == Protocol.PUSH_NEW_MESSAGES:
+                self.root.after(0, self._show_pushed, resp)
+                continue
+            if resp_type == Protocol.RESP_HELLO:
+                continue  # came after _recv_hello gave up on it
+            if resp_type is None or resp_id == request_id:
+                return resp_type, resp
+            self.early_responses[resp_id].append((resp_type, resp))
+
+    def _poll_pushes(self):
+        """Read the messages the server pushed while no request was outstanding"""
+        try:
+            while self.session_token is not None and select.select([self.client_socket], [], [], 0)[0]:
+                resp_type, resp, resp_id = recv_request(self.client_socket)
+                if resp_type is None:
+                    break  # the next operation reconnects
+                if resp_type == Protocol.PUSH_NEW_MESSAGES:
+                    self._show_pushed(resp)
+                else:
+                    self.early_responses[resp_id].append((resp_type, resp))
+        except (OSError, ValueError) as e:
+            print(e)
+        self.root.after(self.PUSH_POLL_MS, self._poll_pushes)
+
+    def _show_pushed(self, msgs):
+        """Add pushed messages to the open conversation, or flag their sender in the user list"""
+        for msg in msgs:
+            print(f"📩 New message from {msg.sender}")
+            if self.current_screen == f"chat_{msg.sender}":
+                # the page fetched while the push was queued may hold it already
+                if any(m.id == msg.id for m in self.chat_messages):
+                    continue
+                self.chat_messages.append(msg)
+                self.message_listbox.insert(tk.END, f"{msg.sender}: {msg.content}")
+                self.message_listbox.see(tk.END)
+            elif self.current_screen == "user_list" and msg.sender in getattr(self, "user_buttons", {}):
+                self.user_buttons[msg.sender].config(text=f"{msg.sender} (new message)")
+
     def _rotate_to_next_node(self):
         """Switch to the next available node"""
         self.current_node_idx += 1
@@ -127,10 +245,10 @@ class ChatClientApp:
         
         # Phase 1: Send username for login
         self._connect_with_retry()
-        send_data(self.client_socket, Protocol.REQ_LOGIN_1, username)
+        request_id = self._send_request(Protocol.REQ_LOGIN_1, username)
         
         # Receive response for username
-        resp_type, resp = recv_data(self.client_socket)
+        resp_type, resp = self._recv_response(request_id)
         print(f"Received response: {resp_type}, {resp}")  # debugging output
         
         if resp_type == Protocol.RESP_USER_EXISTING:
@@ -165,15 +283,19 @@ class ChatClientApp:
 
         # Send password for login (Phase 2)
         self._connect_with_retry()
-        send_data(self.client_socket, Protocol.REQ_LOGIN_2, password)
+        request_id = self._send_request(Protocol.REQ_LOGIN_2, password)
 
         # Receive response for password
-        resp_type, resp = recv_data(self.client_socket)
+        resp_type, resp = self._recv_response(request_id)
         if resp_type == Protocol.RESP_LOGIN_SUCCESS:
+            if self.session_tokens:
+                _, self.session_token = self._recv_response(request_id)
             self.show_user_list_screen()
         elif resp_type == Protocol.RESP_LOGIN_FAILED:
             messagebox.showerror("Login Failed", "Invalid username or password.")
             self.client_socket.close()
+        elif resp_type == Protocol.RESP_SERVER_BUSY:
+            messagebox.showwarning("Server Busy", "The server is busy, please try again in a moment.")
         else:
             messagebox.showerror("Login Error", "Unexpected response from server.")
             self.client_socket.close()
@@ -186,8 +308,8 @@ class ChatClientApp:
 
         # Request the list of users
         self._connect_with_retry()
-        send_data(self.client_socket, Protocol.REQ_LIST_USERS, None)
-        resp_type, resp = recv_data(self.client_socket)
+        request_id = self._send_request(Protocol.REQ_LIST_USERS, None)
+        resp_type, resp = self._recv_response(request_id)
 
         if resp_type == Protocol.RESP_LIST_USERS:
             self.users = resp
@@ -213,26 +335,57 @@ class ChatClientApp:
         self._connect_with_retry()
         send_data(self.client_socket, Protocol.REQ_READ_MSG, username)
 
-        # Request the list of messages for the selected user
-        self._connect_with_retry()
-        send_data(self.client_socket, Protocol.REQ_LIST_MESSAGES, username)
-        resp_type, resp = recv_data(self.client_socket)
-
-        if resp_type == Protocol.RESP_LIST_MESSAGES:
-            self.display_messages(resp, username)
+        # Request the latest page of messages for the selected user
+        self._show_latest_page(username)
             
     def show_message_list(self, username):
         # Clear the screen
         self.clear_screen()
 
         self.current_screen = f"chat_{username}"
-        # Request the list of messages for the selected user
+        # Request the latest page of messages for the selected user
+        self._show_latest_page(username)
+
+    def fetch_message_page(self, username, before=None, before_id=None):
+        """Fetch one page of history, older than the (before, before_id) cursor if given"""
+        query = {"friend": username, "limit": self.PAGE_SIZE}
+        if before is not None:
+            query["before"] = before
+            query["before_id"] = before_id
         self._connect_with_retry()
-        send_data(self.client_socket, Protocol.REQ_LIST_MESSAGES, username)
-        resp_type, resp = recv_data(self.client_socket)
+        request_id = self._send_request(Protocol.REQ_LIST_MESSAGES_PAGE, query)
+        resp_type, resp = self._recv_response(request_id)
+
+        if resp_type == Protocol.RESP_LIST_MESSAGES_PAGE:
+            return resp["messages"], bool(resp["has_more"])
+        return None, False
 
-        if resp_type == Protocol.RESP_LIST_MESSAGES:
-            self.display_messages(resp, username)
+    def _show_latest_page(self, username):
+        page, has_more = self.fetch_message_page(username)
+        if page is None:
+            return
+        self.chat_messages = page
+        self.has_older_messages = has_more
+        self.display_messages(self.chat_messages, username)
+
+    def load_older_messages(self, username):
+        """Prepend the page right before the oldest loaded message"""
+        if not self.chat_messages:
+            return
+        oldest = self.chat_messages[0]
+        page, has_more = self.fetch_message_page(username, before=oldest.timestamp, before_id=oldest.id)
+        if page is None:
+            return
+        self.chat_messages = page + self.chat_messages
+        self.has_older_messages = has_more
+
+        self.message_listbox.delete(0, tk.END)
+        for message in self.chat_messages:
+            self.message_listbox.insert(tk.END, f"{message.sender}: {message.content}")
+        # keep the previously first message in view
+        self.message_listbox.see(len(page))
+        if not self.has_older_messages:
+            self.load_older_button.config(state=tk.DISABLED)
 
 
     def on_message_click(self, event, messages, username):
@@ -249,14 +402,23 @@ class ChatClientApp:
         self.chat_label = tk.Label(self.root, text=f"Chat with {username}:")
         self.chat_label.pack()
 
+        # older history is only fetched on demand
+        self.load_older_button = tk.Button(self.root, text="Load older messages",
+                                           command=lambda: self.load_older_messages(username))
+        if not self.has_older_messages:
+            self.load_older_button.config(state=tk.DISABLED)
+        self.load_older_button.pack()
+
         self.message_listbox = tk.Listbox(self.root, height=10, width=50)
         self.message_listbox.pack()
 
         for message in messages:
             display_message = f"{message.sender}: {message.content}"
             self.message_listbox.insert(tk.END, display_message)
+        self.message_listbox.see(tk.END)
         
-        self.message_listbox.bind("<<ListboxSelect>>", lambda event: self.on_message_click(event, messages, username))
+        # look the list up at click time, older pages may have been prepended since
+        self.message_listbox.bind("<<ListboxSelect>>", lambda event: self.on_message_click(event, self.chat_messages, username))
 
         self.message_entry = tk.Entry(self.root)
         self.message_entry.pack()
@@ -284,7 +446,13 @@ class ChatClientApp:
             messagebox.showwarning("Input Error", "Message cannot be empty!")
             return
         self._connect_with_retry()
-        send_data(self.client_socket, Protocol.REQ_SEND_MSG, [recipient, message])
+        if self.send_receipts:
+            request_id = self._send_request(Protocol.REQ_SEND_MSG, [recipient, message])
+            resp_type, receipt = self._recv_response(request_id)
+            if resp_type == Protocol.RESP_MESSAGE_SENT and receipt["delivery"] == Protocol.DELIVERY_STORED:
+                print(f"{recipient} is offline, the message is delivered at the next login")
+        else:
+            send_data(self.client_socket, Protocol.REQ_SEND_MSG, [recipient, message])
 
         # Refresh message list after sending the message
         self.show_message_list(recipient)
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from common.utils import load_user_accounts_from_json
+
+# journal records written before they are folded into a new snapshot
+ACCOUNTS_COMPACT_AFTER = 1000
+
+
+class AccountStore:
+    """
+    User accounts {username: bcrypt hash}, loaded once at startup and kept in memory.
+
+    Every change is a record {"username", "hash", "timestamp"}, with hash None for a
+    deleted account. Records are appended to a journal (<node>.accounts.json, JSON lines,
+    fsynced), which is folded into an atomically replaced snapshot
+    (<node>.accounts.snapshot.json) once it holds compact_after records.
+
+    Records replicated from peers are applied when they are newer than the version we
+    have (last writer wins); deleted accounts keep their version so an older create
+    arriving late does not bring them back. Until open() is called the store only
+    lives in memory.
+    """
+    def __init__(self, accounts, compact_after=ACCOUNTS_COMPACT_AFTER):
+        self.accounts = accounts  # the shared {username: hash} dict
+        self.compact_after = compact_after
+        self.filename = None
+        self._versions = {}  # {username: record} of the latest change of every known account
+        self._journaled = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self, filename, legacy_filename='user_accounts.json'):
+        """
+        Load the snapshot and the journal, then keep journaling to filename.
+        A node without either imports the shared legacy accounts file once.
+        """
+        with self._lock:
+            self.filename = filename
+            snapshot = self.snapshot_filename()
+            torn = False
+            if not os.path.exists(filename) and not os.path.exists(snapshot) and os.path.exists(legacy_filename):
+                legacy = {}
+                load_user_accounts_from_json(legacy, legacy_filename)
+                # version 0, any change made since wins
+                for username, hashed in legacy.items():
+                    self._set({"username": username, "hash": hashed, "timestamp": 0.0})
+                self._write_snapshot()
+                print(f"📥 Imported {len(legacy)} accounts from {legacy_filename}")
+            else:
+                for record in self._read_snapshot():
+                    self._set(record)
+                records, torn = self._read_journal()
+                for record in records:
+                    self._set(record)
+                    self._journaled += 1
+            self._file = open(filename, 'a', encoding='utf-8')
+            if torn:
+                # later records must not be appended to the torn line
+                self._compact()
+
+    def snapshot_filename(self):
+        root, ext = os.path.splitext(self.filename)
+        return f"{root}.snapshot{ext}"
+
+    def put(self, username, hashed, timestamp=None):
+        """Create or update an account, :return: the change record to replicate"""
+        return self._record({"username": username, "hash": hashed, "timestamp": time.time() if timestamp is None else timestamp})
+
+    def delete(self, username, timestamp=None):
+        """Delete an account, :return: the change record to replicate"""
+        return self._record({"username": username, "hash": None, "timestamp": time.time() if timestamp is None else timestamp})
+
+    def apply(self, records):
+        """
+        Apply change records replicated from a peer, keeping only those newer than ours
+        :return: the records applied
+        """
+        applied = []
+        with self._lock:
+            for record in records:
+                current = self._versions.get(record["username"])
+                if current is not None and record["timestamp"] <= current["timestamp"]:
+                    continue
+                self._set(record)
+                self._journal(record)
+                applied.append(record)
+            self._maybe_compact()
+        return applied
+
+    def records(self):
+        """Latest change record of every account, deleted ones included, for full syncs"""
+        with self._lock:
+            return list(self._versions.values())
+
+    def clear(self):
+        with self._lock:
+            self.accounts.clear()
+            self._versions.clear()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _record(self, record):
+        with self._lock:
+            self._set(record)
+            self._journal(record)
+            self._maybe_compact()
+        return record
+
+    def _set(self, record):
+        self._versions[record["username"]] = record
+        if record["hash"] is None:
+            self.accounts.pop(record["username"], None)
+        else:
+            self.accounts[record["username"]] = record["hash"]
+
+    def _journal(self, record):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._journaled += 1
+
+    def _maybe_compact(self):
+        if self._file is not None and self._journaled >= self.compact_after:
+            self._compact()
+
+    def _compact(self):
+        self._write_snapshot()
+        self._file.truncate(0)
+        self._journaled = 0
+
+    def _write_snapshot(self):
+        snapshot = self.snapshot_filename()
+        tmp = snapshot + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"accounts": list(self._versions.values())}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, snapshot)
+
+    def _read_snapshot(self):
+        try:
+            with open(self.snapshot_filename(), 'r', encoding='utf-8') as f:
+                return json.load(f)["accounts"]
+        except FileNotFoundError:
+            return []
+
+    def _read_journal(self):
+        """
+        :return: (records, whether the last one was torn)
+        :raises ValueError: on an undecodable record before the last one, compacting would drop the later ones
+        """
+        records = []
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                lines = [line for line in f if line.strip()]
+        except FileNotFoundError:
+            return records, False
+        for number, line in enumerate(lines, 1):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                if number < len(lines):
+                    raise ValueError(f"Corrupted record {number} of {len(lines)} in {self.filename}")
+                print(f"⚠️ Ignoring torn record at the end of {self.filename}")
+                return records, True
+        return records, False
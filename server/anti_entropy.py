@@ -0,0 +1,118 @@
+import time
+import grpc
+from generated.sync_pb2 import TreeNodesRequest, BucketsRequest
+from generated.sync_pb2_grpc import AntiEntropyStub
+from server.handler import hold_messages, message_store, merkle_tree, tombstones, tombstone_ttl_s, delete_entry, persist, wait_persisted
+from server.grpc_client import deletions
+from server.grpc_sync import SyncService
+
+# tree levels descended per round trip, each differing node is answered with its 2 ** DESCEND_STEP descendants
+DESCEND_STEP = 4
+# deadline of the bucket transfer, which may carry many messages
+BUCKETS_TIMEOUT_S = 60
+
+# repairs apply messages the same way replicated ones are
+_service = SyncService()
+
+
+def differing_buckets(local_nodes, fetch, buckets, step=DESCEND_STEP):
+    """
+    Walk both hash trees down from the root and return the leaf buckets that differ.
+    Only the descendants of differing nodes are fetched, so the cost grows with the divergence.
+    :param local_nodes: local node hashes, indexed like MerkleTree.nodes()
+    :param fetch: function returning the remote hashes (ints) of a list of node ids
+    """
+    if fetch([1]) == [local_nodes[1]]:
+        return []
+    frontier = [1]
+    depth = buckets.bit_length() - 1
+    level = 0
+    while level < depth and frontier:
+        s = min(step, depth - level)
+        children = [child for node in frontier for child in range(node << s, (node + 1) << s)]
+        remote = fetch(children)
+        frontier = [child for child, h in zip(children, remote) if h != local_nodes[child]]
+        level += s
+    return [node - buckets for node in frontier]
+
+
+def repair(data_package):
+    """
+    Merge a chunk of buckets fetched from a peer: messages we lack (or hold an older copy of)
+    are taken, a message read there is read here, tombstones delete our copy. Messages
+    only the peer lacks are left alone, the peer's own anti-entropy task pulls them.
+    Tombstones older than tombstone_ttl_s are skipped, we may have expired them already.
+    :return: number of changes applied
+    """
+    entries = []
+    deleted_ids = []
+    read_ids = []
+    added = 0
+    with hold_messages(data_package.messages, data_package.deleted_ids):
+        for msg_data in data_package.messages:
+            if msg_data.id in tombstones:
+                continue
+            local = message_store.peek(msg_data.id)
+            if local is None or msg_data.timestamp > local.timestamp:
+                was_read = local is not None and local.status == "read"
+                msg = _service._add_message(msg_data)
+                entries.append(msg.to_dict())
+                added += 1
+                if was_read and msg.status == "unread":
+                    _service._read_message(msg.id)
+                    read_ids.append(msg.id)
+            elif msg_data.status == "read" and local.status == "unread":
+                _service._read_message(local.id)
+                read_ids.append(local.id)
+
+        cutoff = time.time() - tombstone_ttl_s[0]
+        for msg_id, deleted_at in deletions(data_package):
+            if msg_id not in tombstones and deleted_at >= cutoff:
+                # also record tombstones of messages we never had, to pass them on
+                _service._remove_message(msg_id, deleted_at)
+                deleted_ids.append(msg_id)
+
+        if deleted_ids:
+            entries.append(delete_entry(deleted_ids))
+        if read_ids:
+            entries.append({"operation": "read", "ids": read_ids})
+        ticket = persist(entries, 'entries') if entries else None
+    wait_persisted(ticket)
+    return added + len(deleted_ids) + len(read_ids)
+
+
+def sync_with_peer(stub, rpc_timeout=5.0):
+    """
+    One anti-entropy round with a peer, pulling the differing buckets
+    :return: (number of differing buckets, number of changes repaired)
+    """
+    buckets = merkle_tree.buckets
+    # nodes() hands out a fresh list after every change, it is not mutated later
+    local_nodes = merkle_tree.nodes()
+
+    def fetch(node_ids):
+        reply = stub.GetTreeNodes(TreeNodesRequest(buckets=buckets, nodes=node_ids), timeout=rpc_timeout)
+        return [int.from_bytes(h, 'big') for h in reply.hashes]
+
+    diff = differing_buckets(local_nodes, fetch, buckets)
+    if not diff:
+        return 0, 0
+    repaired = 0
+    for chunk in stub.GetBuckets(BucketsRequest(buckets=buckets, ids=diff), timeout=BUCKETS_TIMEOUT_S):
+        repaired += repair(chunk)
+    return len(diff), repaired
+
+
+def run_anti_entropy(peer_addrs, interval_s=30, rpc_timeout=5.0):
+    """Compare hash trees with every peer from time to time and repair the differences"""
+    peers = [(addr, AntiEntropyStub(grpc.insecure_channel(addr))) for addr in peer_addrs]
+    while True:
+        time.sleep(interval_s)
+        for addr, stub in peers:
+            try:
+                diff, repaired = sync_with_peer(stub, rpc_timeout)
+            except grpc.RpcError as e:
+                print(f"Anti-entropy with {addr} failed: {e.code()}")
+                continue
+            if diff:
+                print(f"🩹 Anti-entropy with {addr}: {diff} buckets differed, {repaired} changes repaired")
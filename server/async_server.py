@@ -0,0 +1,167 @@
+import asyncio
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from common.protocol import Protocol
+from common.utils import send_data
+from common.frame_reader import HEADER_SIZE, HEADER_V2_SIZE, MAX_FRAME_SIZE, split_header
+from server.handler import handle_request, handle_new_connection, handle_disconnect, submit_login, finish_login
+from server.auth_executor import ServerBusy
+from server.push_registry import MAX_PENDING_PUSH_BYTES
+
+# per-connection StreamReader buffer limit
+STREAM_LIMIT = 64 * 1024
+# requests that only read the state: pipelined ones (with a request id) run concurrently
+# and are answered as they finish, the others wait for them and run one at a time
+READ_ONLY_REQUESTS = (Protocol.REQ_LIST_MESSAGES, Protocol.REQ_LIST_MESSAGES_PAGE, Protocol.REQ_LIST_USERS)
+
+
+class StreamSocket:
+    """
+    Minimal socket facade over an asyncio StreamWriter, so that handle_request
+    (which runs on a worker thread) can reply with the usual send_data().
+    """
+    def __init__(self, loop, writer, max_pending=MAX_PENDING_PUSH_BYTES):
+        self._loop = loop
+        self._writer = writer
+        self.max_pending = max_pending
+        self._dropped = False
+
+    def sendall(self, data):
+        # writes are handed back to the event loop thread, which preserves their order
+        self._loop.call_soon_threadsafe(self._writer.write, data)
+
+    def push(self, data):
+        """
+        Write data unless the client does not keep up: replies are awaited with drain(),
+        pushes are not, so a client with max_pending bytes still unsent is disconnected.
+        :return: False once the connection was dropped
+        """
+        if self._dropped:
+            return False
+        self._loop.call_soon_threadsafe(self._write_push, data)
+        return True
+
+    def _write_push(self, data):
+        transport = self._writer.transport
+        if self._dropped or transport.is_closing():
+            return
+        if transport.get_write_buffer_size() + len(data) > self.max_pending:
+            print("⚠️ Client does not keep up with its pushes, disconnecting it")
+            self._dropped = True
+            transport.abort()
+            return
+        self._writer.write(data)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._writer.close)
+
+
+async def recv_frame(reader):
+    """
+    Async counterpart of recv_request: read one frame and decode its payload.
+    Returns (msg_type, obj, request_id), (None, None, None) when the peer closed the connection.
+    """
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+        msg_type, data_len = struct.unpack("!QI", header)
+        msg_type, header_size = split_header(msg_type)
+        request_id = None
+        if header_size == HEADER_V2_SIZE:
+            request_id, = struct.unpack("!I", await reader.readexactly(HEADER_V2_SIZE - HEADER_SIZE))
+    except asyncio.IncompleteReadError:
+        return None, None, None
+
+    if data_len == 0:
+        return msg_type, None, request_id
+    if data_len > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {data_len} bytes exceeds limit of {MAX_FRAME_SIZE}")
+
+    try:
+        payload = await reader.readexactly(data_len)
+    except asyncio.IncompleteReadError:
+        return None, None, None
+
+    obj, _ = Protocol.decode_obj(payload)
+    return msg_type, obj, request_id
+
+
+async def login(sock, address, pwd, sync_client, executor, request_id=None):
+    """REQ_LOGIN_2 without holding a handler thread while bcrypt runs on the auth executor"""
+    loop = asyncio.get_running_loop()
+    try:
+        # without an auth executor submit_login hashes inline, keep that off the loop
+        username, created, pending = await loop.run_in_executor(executor, submit_login, address, pwd)
+    except ServerBusy:
+        send_data(sock, Protocol.RESP_SERVER_BUSY, None, request_id=request_id)
+        return
+    result = await asyncio.wrap_future(pending)
+    # saving a new account writes to the account store
+    await loop.run_in_executor(executor, finish_login, sock, address, username, created, result, sync_client, request_id)
+
+
+async def client_coroutine_entry(reader, writer, sync_client, executor):
+    """
+    entry for each coroutine serving a client, the asyncio version of client_thread_entry
+    """
+    loop = asyncio.get_running_loop()
+    address = writer.get_extra_info('peername')
+    sock = StreamSocket(loop, writer)
+
+    handle_new_connection(address)
+    # pipelined read-only requests still running
+    reads = set()
+
+    try:
+        while True:
+            msg_type, parsed_obj, request_id = await recv_frame(reader)
+            if msg_type is None:
+                break
+            if request_id is not None and msg_type in READ_ONLY_REQUESTS:
+                # handlers may block (file io, grpc), so they run on the shared pool
+                reads.add(loop.run_in_executor(
+                    executor, handle_request, sock, address, msg_type, parsed_obj, sync_client, request_id
+                ))
+            else:
+                # a change is not visible to reads sent before it
+                if reads:
+                    await asyncio.gather(*reads)
+                    reads.clear()
+                if msg_type == Protocol.REQ_LOGIN_2:
+                    await login(sock, address, parsed_obj, sync_client, executor, request_id)
+                else:
+                    await loop.run_in_executor(
+                        executor, handle_request, sock, address, msg_type, parsed_obj, sync_client, request_id
+                    )
+            for read in [read for read in reads if read.done()]:
+                reads.discard(read)
+                read.result()  # re-raise its error
+            await writer.drain()
+        if reads:
+            await asyncio.gather(*reads)
+    except Exception as e:
+        print(f"[ERROR] {e}")
+    finally:
+        handle_disconnect(sock, address)
+
+
+async def create_async_server(host, port, sync_client, executor):
+    """Create the asyncio TCP server without starting to serve forever"""
+    return await asyncio.start_server(
+        lambda r, w: client_coroutine_entry(r, w, sync_client, executor),
+        host,
+        port,
+        limit=STREAM_LIMIT,
+        backlog=1024,
+    )
+
+
+async def serve_asyncio(host, port, sync_client, workers=32):
+    """
+    Serve clients from a single event loop: idle connections cost one coroutine
+    instead of one OS thread, requests are handled on a bounded thread pool.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+    server = await create_async_server(host, port, sync_client, executor)
+    print(f"🟢 Server listening on {host}:{port} (asyncio mode, {workers} handler workers)")
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,106 @@
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from common.utils import hash_pwd, check_pwd
+
+
+class ServerBusy(Exception):
+    """Raised by AuthExecutor.submit when too many requests are already waiting"""
+
+
+def _timed(fn, args, submitted):
+    """Runs in a worker process: call fn and report when it started and how long it took"""
+    started = time.time()
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, started - submitted, time.perf_counter() - t0
+
+
+class AuthExecutor:
+    """
+    Bounded pool of worker processes for the bcrypt work of logins, so a burst of
+    logins neither holds the GIL of the request handlers nor queues without limit.
+
+    Admission control: at most max_pending requests are queued or running, submit()
+    raises ServerBusy beyond that and the client is answered RESP_SERVER_BUSY.
+    Workers are spawned rather than forked, the server process runs gRPC threads.
+    """
+    def __init__(self, workers=2, max_pending=64, stats_window=1024):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        # (queue wait in ms, hash time in ms) of the most recent requests
+        self._timings = deque(maxlen=stats_window)
+
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) in a worker process
+        :return: Future of fn's result
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise ServerBusy(f"{self._pending} auth requests pending")
+            self._pending += 1
+        result = Future()
+        try:
+            work = self._pool.submit(_timed, fn, args, time.time())
+        except Exception:
+            self._done(None)
+            raise
+        work.add_done_callback(lambda f: self._finish(f, result))
+        return result
+
+    def hash_pwd(self, password):
+        return self.submit(hash_pwd, password)
+
+    def check_pwd(self, password, hashed_password):
+        return self.submit(check_pwd, password, hashed_password)
+
+    def stats(self):
+        """Queue wait and hash time of the recent requests"""
+        with self._lock:
+            timings = list(self._timings)
+            pending, completed, rejected = self._pending, self._completed, self._rejected
+        waits = [wait for wait, _ in timings]
+        hashes = [hash_ms for _, hash_ms in timings]
+        return {
+            "workers": self.workers,
+            "pending": pending,
+            "completed": completed,
+            "rejected": rejected,
+            "avg_queue_wait_ms": sum(waits) / len(waits) if waits else 0,
+            "max_queue_wait_ms": max(waits, default=0),
+            "avg_hash_ms": sum(hashes) / len(hashes) if hashes else 0,
+            "max_hash_ms": max(hashes, default=0),
+        }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _finish(self, work, result):
+        if work.cancelled():
+            self._done(None)
+            result.cancel()
+            return
+        error = work.exception()
+        if error is not None:
+            self._done(None)
+            result.set_exception(error)
+            return
+        value, wait_s, hash_s = work.result()
+        self._done((max(wait_s, 0.0) * 1000, hash_s * 1000))
+        result.set_result(value)
+
+    def _done(self, timing):
+        with self._lock:
+            self._pending -= 1
+            if timing is not None:
+                self._completed += 1
+                self._timings.append(timing)
@@ -0,0 +1,169 @@
+import itertools
+import json
+import threading
+import uuid
+from collections import deque
+from common.log_writer import LogWriter
+from common.utils import read_records
+from generated.sync_pb2 import DataPackage, MessageData
+from server.grpc_client import merge_packages, account_data, account_record, FULL_SYNC_CHUNK_SIZE, FULL_SYNC_CHUNK_BYTES
+
+
+class ChangeLog:
+    """
+    Sequence-numbered record of the changes made on this node (not of the ones replicated
+    from peers), kept so a restarting peer fetches only what it missed.
+
+    The file holds JSON lines, an epoch record followed by one record per change:
+        {"operation": "epoch", "epoch": "<hex uuid>"}
+        {"seq": 1, "messages": [...], "deleted_ids": [...], "deleted_at": [...], "read_ids": [...], "accounts": [...]}
+    The epoch is drawn when the file is created, and again when the log was not closed
+    ({"operation": "closed"} is its last record): after a crash the tail may be lost and
+    its sequence numbers handed out again. A watermark from another epoch says
+    nothing about our sequence numbers, such peers get the full data instead.
+    Only the last `retain` changes are kept, older watermarks also get the full data.
+    """
+    def __init__(self, filename, origin, retain=100000, policy="interval", interval_ms=50):
+        self.filename = filename
+        self.origin = origin
+        self.retain = retain
+        self.epoch = None
+        self.seq = 0
+
+        self._lock = threading.Lock()
+        self._changes = deque()  # DataPackage of each retained change, in seq order
+        self._on_disk = 0  # change records in the file, trimmed by compact()
+        self._load()
+        if self.epoch is not None and not self._clean:
+            print(f"⚠️ {self.filename} was not closed, starting a new epoch")
+            self.epoch = None
+            self.seq = 0
+            self._changes.clear()
+            self._on_disk = 0
+
+        self._writer = LogWriter(filename, policy=policy, interval_ms=interval_ms)
+        if self.epoch is None:
+            self.epoch = uuid.uuid4().hex
+            self._writer.rewrite_entries([{"operation": "epoch", "epoch": self.epoch}])
+
+    def _load(self):
+        self._clean = False
+        try:
+            for record in read_records(self.filename):
+                if record.get("operation") == "epoch":
+                    self.epoch = record["epoch"]
+                    continue
+                if record.get("operation") == "closed":
+                    self._clean = True
+                    continue
+                self._retain(self._from_entry(record))
+                self.seq = record["seq"]
+                self._on_disk += 1
+                self._clean = False
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            print(f"⚠️ Ignoring torn record at the end of {self.filename}")
+            self._clean = False
+
+    def record(self, data_package):
+        """
+        Assign the next sequence number to a change made on this node and log it.
+        The package is tagged with origin, epoch and seq so peers can track their watermark.
+        :return: the sequence number
+        """
+        with self._lock:
+            self.seq += 1
+            data_package.origin = self.origin
+            data_package.epoch = self.epoch
+            data_package.from_seq = self.seq
+            data_package.to_seq = self.seq
+            self._retain(data_package)
+            self._writer.append([self._to_entry(data_package)], 'entries')
+            self._on_disk += 1
+            return self.seq
+
+    def position(self):
+        """(epoch, seq) of the latest change"""
+        with self._lock:
+            return self.epoch, self.seq
+
+    def since(self, epoch, seq, chunk_size=FULL_SYNC_CHUNK_SIZE, chunk_bytes=FULL_SYNC_CHUNK_BYTES):
+        """
+        The changes after seq, merged into chunks of at most chunk_size changes and roughly chunk_bytes.
+        :return: list of DataPackages, None when the changes are not known (other epoch, trimmed, or lost)
+        """
+        with self._lock:
+            if epoch != self.epoch or seq > self.seq:
+                return None
+            first = self._changes[0].from_seq if self._changes else self.seq + 1
+            if seq + 1 < first:
+                return None
+            changes = list(itertools.islice(self._changes, seq + 1 - first, None))
+
+        chunks = []
+        batch = []
+        size = 0
+        for change in changes:
+            batch.append(change)
+            size += change.ByteSize()
+            if len(batch) >= chunk_size or size >= chunk_bytes:
+                chunks.append(merge_packages(batch))
+                batch = []
+                size = 0
+        if batch:
+            chunks.append(merge_packages(batch))
+        return chunks
+
+    def compact(self):
+        """Drop the trimmed changes from the file once it holds twice as many records as retained"""
+        with self._lock:
+            if self._on_disk <= 2 * self.retain:
+                return
+            entries = [{"operation": "epoch", "epoch": self.epoch}]
+            entries.extend(self._to_entry(change) for change in self._changes)
+            self._writer.rewrite_entries(entries)
+            self._on_disk = len(self._changes)
+
+    def close(self):
+        with self._lock:
+            self._writer.append([{"operation": "closed"}], 'entries')
+        self._writer.close()
+
+    def _retain(self, data_package):
+        self._changes.append(data_package)
+        if len(self._changes) > self.retain:
+            self._changes.popleft()
+
+    def _to_entry(self, data_package):
+        return {
+            "seq": data_package.from_seq,
+            "messages": [
+                {
+                    "id": m.id,
+                    "sender": m.sender,
+                    "recipient": m.recipient,
+                    "content": m.content,
+                    "status": m.status,
+                    "timestamp": m.timestamp,
+                }
+                for m in data_package.messages
+            ],
+            "deleted_ids": list(data_package.deleted_ids),
+            "deleted_at": list(data_package.deleted_at),
+            "read_ids": list(data_package.read_ids),
+            "accounts": [account_record(a) for a in data_package.accounts],
+        }
+
+    def _from_entry(self, entry):
+        return DataPackage(
+            messages=[MessageData(**m) for m in entry["messages"]],
+            deleted_ids=entry["deleted_ids"],
+            deleted_at=entry.get("deleted_at", []),
+            read_ids=entry["read_ids"],
+            accounts=[account_data(record) for record in entry.get("accounts", [])],
+            origin=self.origin,
+            epoch=self.epoch or "",
+            from_seq=entry["seq"],
+            to_seq=entry["seq"],
+        )
@@ -0,0 +1,261 @@
+import threading
+from array import array
+from common.message import Chatmsg, STATUS_CODES, STATUS_NAMES
+from server.content_segments import ContentRef
+
+# status column values besides the STATUS_CODES
+STATUS_CUSTOM = 254  # a status without a code, kept in _custom_statuses
+STATUS_DELETED = 255  # the row was removed, compact() drops it
+
+
+class ContentBuffer:
+    """Contents kept in the heap, in one bytearray"""
+    def __init__(self):
+        self._data = bytearray()
+
+    def append(self, data):
+        """Copy data to the end of the buffer, returns its address"""
+        address = len(self._data)
+        self._data += data
+        return address
+
+    def read(self, address, length):
+        return self._data[address:address + length].decode('utf-8')
+
+    def ref(self, address, length):
+        """A reference to a content, decoded when it is read; the buffer it is in stays alive as long as the reference"""
+        return ContentRef(self._data, address, length)
+
+    def reader(self):
+        """read() of the contents stored so far, unaffected by a later clear()"""
+        data = self._data
+        return lambda address, length: data[address:address + length].decode('utf-8')
+
+    def nbytes(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data = bytearray()
+
+
+class ColdView:
+    """
+    The rows of a ColdStore when view() was called, read without its lock: add() only
+    extends the columns, compact() and clear() replace them with new ones, and the
+    status column is copied, so rows removed since are still seen.
+    Messages are built one at a time as the view is iterated.
+    """
+    def __init__(self, store):
+        # the store's lock is held
+        self._ids = store._ids
+        self._timestamps = store._timestamps
+        self._senders = store._senders
+        self._recipients = store._recipients
+        self._addresses = store._addresses
+        self._lengths = store._lengths
+        self._users = store._users
+        self._statuses = array('B', store._statuses)
+        self._custom_statuses = dict(store._custom_statuses)
+        self._read = store._content.reader()
+        self._len = len(store._rows)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for row, code in enumerate(self._statuses):
+            if code == STATUS_DELETED:
+                continue
+            yield Chatmsg(
+                sender=self._users[self._senders[row]],
+                recipient=self._users[self._recipients[row]],
+                content=self._read(self._addresses[row], self._lengths[row]),
+                msg_id=self._ids[row],
+                timestamp=self._timestamps[row],
+                status=self._custom_statuses[row] if code == STATUS_CUSTOM else STATUS_NAMES[code],
+            )
+
+
+class ColdStore:
+    """
+    Columnar storage of old messages, one row per message:
+        _ids          msg ids (the same strings the indexes hold)
+        _timestamps   array('d')
+        _senders      array('I') user numbers, _users maps them back to usernames
+        _recipients   array('I')
+        _statuses     array('B') STATUS_CODES code, STATUS_CUSTOM or STATUS_DELETED
+        _addresses    array('Q') address of the utf-8 content in _content
+        _lengths      array('I') its length in bytes
+    A row costs about 29 bytes plus its content instead of a Chatmsg object with its
+    float and str. The contents go to a ContentBuffer in the heap, or to ContentSegments
+    files mapped with mmap. Messages are handed out as detached Chatmsg copies, whose
+    content is read from the segment when it is used.
+    Removing a row only flags it, compact() drops the flagged rows and their content.
+    Rows are appended and flagged by handlers holding different stripes, so the columns
+    have their own lock.
+    """
+    def __init__(self, content=None):
+        """:param content: ContentBuffer (the default) or ContentSegments holding the contents"""
+        self._lock = threading.Lock()
+        self._content = content if content is not None else ContentBuffer()
+        self._users = []
+        self._user_numbers = {}
+        self._custom_statuses = {}  # {row: status}
+        self._reset()
+
+    def _reset(self):
+        self._rows = {}  # {msg_id: row}
+        self._ids = []
+        self._timestamps = array('d')
+        self._senders = array('I')
+        self._recipients = array('I')
+        self._statuses = array('B')
+        self._addresses = array('Q')
+        self._lengths = array('I')
+        self._content.clear()
+        self._custom_statuses.clear()
+        self._deleted = 0
+
+    def add(self, msg):
+        """Store a message, replacing the row of the same id if there is one"""
+        content = msg.content.encode('utf-8')
+        with self._lock:
+            self._discard(msg.id)
+            row = len(self._ids)
+            self._rows[msg.id] = row
+            self._ids.append(msg.id)
+            self._timestamps.append(msg.timestamp)
+            self._senders.append(self._user_number(msg.sender))
+            self._recipients.append(self._user_number(msg.recipient))
+            self._statuses.append(self._status_code(row, msg.status))
+            self._addresses.append(self._content.append(content))
+            self._lengths.append(len(content))
+
+    def get(self, msg_id):
+        """Detached copy of a message, None when it is not stored here"""
+        with self._lock:
+            row = self._rows.get(msg_id)
+            return None if row is None else self._message(row)
+
+    def pop(self, msg_id):
+        """Remove a message and return it, None when it is not stored here"""
+        with self._lock:
+            row = self._rows.get(msg_id)
+            if row is None:
+                return None
+            # the message goes back to the hot tier, it must not keep a segment mapped
+            msg = self._message(row, lazy=False)
+            self._discard(msg_id)
+            return msg
+
+    def discard(self, msg_id):
+        with self._lock:
+            return self._discard(msg_id)
+
+    def set_status(self, msg_id, status):
+        """
+        Change the status of a stored message in place.
+        :return: the previous status, None when the message is not stored here
+        """
+        with self._lock:
+            row = self._rows.get(msg_id)
+            if row is None:
+                return None
+            old = self._status(row)
+            self._custom_statuses.pop(row, None)
+            self._statuses[row] = self._status_code(row, status)
+            return old
+
+    def mark_read(self, msg_id):
+        """Set an unread message to read, returns a copy of it; None when it is not stored here or not unread"""
+        with self._lock:
+            row = self._rows.get(msg_id)
+            if row is None or self._statuses[row] != STATUS_CODES["unread"]:
+                return None
+            self._statuses[row] = STATUS_CODES["read"]
+            return self._message(row)
+
+    def messages(self):
+        """Detached copies of every stored message, in the order they were added"""
+        # rows are only renumbered by compact(), which the caller does not run concurrently
+        for row in range(len(self._ids)):
+            with self._lock:
+                if self._statuses[row] == STATUS_DELETED:
+                    continue
+                msg = self._message(row)
+            yield msg
+
+    def view(self):
+        """The rows stored now, as a ColdView that is read without holding the store"""
+        with self._lock:
+            return ColdView(self)
+
+    def compact(self, min_deleted=0.5):
+        """Rewrite the columns without the removed rows once they are at least min_deleted of all rows"""
+        with self._lock:
+            if not self._ids or self._deleted < min_deleted * len(self._ids):
+                return False
+            live = [self._message(row, lazy=False) for row in range(len(self._ids)) if self._statuses[row] != STATUS_DELETED]
+            self._reset()
+        for msg in live:
+            self.add(msg)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def nbytes(self):
+        """Bytes held by the columns and the contents kept in the heap"""
+        with self._lock:
+            columns = (self._timestamps, self._senders, self._recipients, self._statuses, self._addresses, self._lengths)
+            return sum(column.itemsize * len(column) for column in columns) + self._content.nbytes()
+
+    def __contains__(self, msg_id):
+        return msg_id in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(list(self._rows))
+
+    def _discard(self, msg_id):
+        row = self._rows.pop(msg_id, None)
+        if row is None:
+            return False
+        self._statuses[row] = STATUS_DELETED
+        self._custom_statuses.pop(row, None)
+        self._deleted += 1
+        return True
+
+    def _message(self, row, lazy=True):
+        read = self._content.ref if lazy else self._content.read
+        return Chatmsg(
+            sender=self._users[self._senders[row]],
+            recipient=self._users[self._recipients[row]],
+            content=read(self._addresses[row], self._lengths[row]),
+            msg_id=self._ids[row],
+            timestamp=self._timestamps[row],
+            status=self._status(row),
+        )
+
+    def _user_number(self, username):
+        number = self._user_numbers.get(username)
+        if number is None:
+            number = self._user_numbers[username] = len(self._users)
+            self._users.append(username)
+        return number
+
+    def _status_code(self, row, status):
+        code = STATUS_CODES.get(status)
+        if code is None:
+            self._custom_statuses[row] = status
+            return STATUS_CUSTOM
+        return code
+
+    def _status(self, row):
+        code = self._statuses[row]
+        if code == STATUS_CUSTOM:
+            return self._custom_statuses[row]
+        return STATUS_NAMES[code]
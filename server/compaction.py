@@ -0,0 +1,79 @@
+import argparse
+import os
+import time
+from collections import defaultdict, deque
+from common.utils import load_from_file, save_snapshot, save_to_file, snapshot_filename, previous_log_filename
+
+
+def run_compactor(take_snapshot, log_writer, interval_s=60, min_records=10000):
+    """
+    Periodically snapshot the node while it is running.
+    A snapshot is only taken when at least min_records were appended to the log since the last one,
+    a failed one is retried at the next round.
+    """
+    last = log_writer.appended
+    while True:
+        time.sleep(interval_s)
+        appended = log_writer.appended
+        if appended - last < min_records:
+            continue
+        start = time.perf_counter()
+        try:
+            take_snapshot()
+        except Exception as e:
+            print(f"⛔ Snapshot failed, retrying in {interval_s} s: {e}")
+            continue
+        print(f"📦 Snapshot taken, compacted {appended - last} log records in {(time.perf_counter() - start) * 1000:.1f} ms")
+        last = appended
+
+
+def compact_files(log_filename):
+    """
+    Offline compaction of a stopped node: fold the log into the snapshot and truncate the log.
+    :return: number of messages in the new snapshot
+    """
+    snapshot = snapshot_filename(log_filename)
+    message_store = {}
+    watermarks = {}
+    tombstones = {}
+    load_from_file(message_store, defaultdict(lambda: defaultdict(deque)), log_filename,
+                   snapshot=snapshot, watermarks=watermarks, tombstones=tombstones)
+
+    save_snapshot(message_store, snapshot, watermarks, tombstones)
+    # the snapshot is durable, the records it covers can go
+    if os.path.exists(log_filename):
+        save_to_file({}, log_filename, mode='overwrite')
+    if os.path.exists(previous_log_filename(log_filename)):
+        os.remove(previous_log_filename(log_filename))
+    return len(message_store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the log of a stopped chat server node")
+    parser.add_argument(
+        "--node",
+        required=True,
+        help="Name of the node, its log is <node>.json (or <node>.binlog) in the data directory"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "binary"],
+        default="json",
+        help="Log format of the node (default: json)"
+    )
+    parser.add_argument(
+        "--dir",
+        default=".",
+        help="Directory holding the node files (default: current directory)"
+    )
+    args = parser.parse_args()
+
+    ext = "binlog" if args.format == "binary" else "json"
+    log_filename = os.path.join(args.dir, f"{args.node}.{ext}")
+    before = os.path.getsize(log_filename) if os.path.exists(log_filename) else 0
+    count = compact_files(log_filename)
+    print(f"📦 Compacted {log_filename} ({before} bytes) into {snapshot_filename(log_filename)} with {count} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,50 @@ import json
 import argparse
 from typing import Dict, List
 
+# defaults of the optional "storage" section
+DEFAULT_STORAGE = {
+    "fsync_policy": "interval",  # always | interval | os
+    "fsync_interval_ms": 50,
+    "snapshot_interval_s": 60,  # how often the compactor checks the log
+    "snapshot_min_records": 10000,  # log records needed before a new snapshot is taken
+    # age at which a snapshot moves messages to the cold store, null keeps them all hot; ids and index
+    # entries stay in memory, about 181 bytes per cold message against 270 hot (see README, Cold history)
+    "cold_after_s": 86400,
+    "content_segments": False,  # keep cold contents in mmap'ed segment files instead of the heap
+    "stats_interval_s": 60,  # how often the log writer and auth pool metrics are printed, null never prints them
+}
+
+# defaults of the optional "replication" section
+DEFAULT_REPLICATION = {
+    "queue_size": 1024,  # packages buffered per peer before the oldest is dropped
+    "rpc_timeout_s": 2.0,  # deadline of each sync RPC
+    "retry_backoff_s": 0.1,  # first retry delay, doubled after each failure
+    "retry_backoff_max_s": 5.0,
+    "batch_window_ms": 5,  # how long a sender waits to coalesce more packages into one RPC
+    "batch_max_packages": 256,  # packages merged into one RPC at most
+    "full_sync_chunk_size": 1000,  # messages per chunk of a streamed full sync
+    "change_log_retain": 100000,  # changes kept to serve catch-up, older watermarks get the full data
+    "anti_entropy_interval_s": 30,  # pause between two hash tree comparisons with the peers
+    "tombstone_ttl_s": 604800,  # how long deleted ids are remembered, a week
+    "presence_interval_s": 2,  # pause between two presence exchanges with the peers
+    "presence_ttl_s": 10,  # a peer's online users are forgotten when it did not report them for this long
+}
+
+# defaults of the optional "auth" section
+DEFAULT_AUTH = {
+    "workers": 2,  # processes running bcrypt
+    "max_pending": 64,  # logins queued or running before new ones get RESP_SERVER_BUSY
+}
+
+# the example secret of the docs, a node refuses to sign tokens with it
+PLACEHOLDER_SESSION_SECRET = "replace-with-a-long-random-cluster-secret"
+
+# defaults of the optional "session" section
+DEFAULT_SESSION = {
+    "secret": None,  # shared key signing session tokens, None draws a random one per node
+    "ttl_s": 86400,  # how long a session token can be resumed
+}
+
 class ServerConfig:
     def __init__(self, config_path: str):
         # Load the configuration file
@@ -22,6 +66,43 @@ class ServerConfig:
                 if field not in node:
                     raise ValueError(f"Node {node.get('name', 'unknown')} is missing required field: {field}")
     
+    def get_storage_config(self) -> Dict:
+        """Settings of the node log writer, missing keys fall back to DEFAULT_STORAGE."""
+        storage = dict(DEFAULT_STORAGE)
+        storage.update(self._raw.get("storage", {}))
+        if storage["fsync_policy"] not in ("always", "interval", "os"):
+            raise ValueError(f"Invalid fsync_policy: {storage['fsync_policy']}")
+        return storage
+
+    def get_replication_config(self) -> Dict:
+        """Settings of the outbound replication queues, missing keys fall back to DEFAULT_REPLICATION."""
+        replication = dict(DEFAULT_REPLICATION)
+        replication.update(self._raw.get("replication", {}))
+        return replication
+
+    def get_auth_config(self) -> Dict:
+        """Settings of the bcrypt worker pool, missing keys fall back to DEFAULT_AUTH."""
+        auth = dict(DEFAULT_AUTH)
+        auth.update(self._raw.get("auth", {}))
+        if auth["workers"] < 1 or auth["max_pending"] < 1:
+            raise ValueError("auth workers and max_pending must be at least 1")
+        return auth
+
+    def get_session_config(self) -> Dict:
+        """Settings of the session tokens, missing keys fall back to DEFAULT_SESSION."""
+        session = dict(DEFAULT_SESSION)
+        session.update(self._raw.get("session", {}))
+        if session["secret"] == PLACEHOLDER_SESSION_SECRET:
+            raise ValueError("session.secret is the example value, set a random secret shared by the nodes or null")
+        return session
+
+    def get_log_format(self, node_name: str) -> str:
+        """On-disk format of the node's log, set per node with "log_format": json | binary"""
+        log_format = self.get_current_node(node_name).get("log_format", "json")
+        if log_format not in ("json", "binary"):
+            raise ValueError(f"Invalid log_format for node {node_name}: {log_format}")
+        return log_format
+
     def get_current_node(self, node_name: str) -> Dict:
         # Retrieve the configuration of the specified node
         if node_name not in self.nodes:
@@ -60,4 +141,16 @@ def parse_cli_args():
         default="servers.json",
         help="Path to the configuration file (default: servers.json)"
     )
+    parser.add_argument(
+        "--mode",
+        choices=["thread", "asyncio"],
+        default="thread",
+        help="Connection handling model: one thread per client, or a single asyncio event loop (default: thread)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=32,
+        help="Size of the request handler pool in asyncio mode (default: 32)"
+    )
     return parser.parse_args()
@@ -0,0 +1,78 @@
+import mmap
+import os
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+OFFSET_BITS = 40  # an address is the segment number followed by the offset in the segment
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+
+class ContentRef:
+    """Content of a message kept in a segment (or a ContentBuffer), decoded each time it is read"""
+    __slots__ = ("_segment", "_offset", "_length")
+
+    def __init__(self, segment, offset, length):
+        self._segment = segment
+        self._offset = offset
+        self._length = length
+
+    def load(self):
+        return self._segment[self._offset:self._offset + self._length].decode('utf-8')
+
+
+class ContentSegments:
+    """
+    Message contents in append-only segment files mapped with mmap: the OS pages
+    them in when a content is read, instead of every content staying in the heap.
+    Segments are files of segment_size bytes (sparse until written), a content never
+    spans two of them. They only back this process and are recreated at startup,
+    the log and the snapshot remain the durable copy of the messages.
+    Callers serialize append() and clear(), the ColdStore lock does.
+    """
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._segments = []
+        self._used = 0  # bytes written to the last segment
+        os.makedirs(directory, exist_ok=True)
+        self.clear()  # segments of a previous run
+
+    def append(self, data):
+        """Copy data to the current segment, returns its address"""
+        if not self._segments or self._used + len(data) > len(self._segments[-1]):
+            self._new_segment(max(self.segment_size, len(data)))
+        offset = self._used
+        self._segments[-1][offset:offset + len(data)] = data
+        self._used += len(data)
+        return (len(self._segments) - 1) << OFFSET_BITS | offset
+
+    def read(self, address, length):
+        return self.ref(address, length).load()
+
+    def reader(self):
+        """read() of the contents stored so far, unaffected by a later clear()"""
+        segments = list(self._segments)
+        return lambda address, length: ContentRef(segments[address >> OFFSET_BITS], address & OFFSET_MASK, length).load()
+
+    def ref(self, address, length):
+        """A reference to a content, the segment stays mapped as long as the reference lives"""
+        return ContentRef(self._segments[address >> OFFSET_BITS], address & OFFSET_MASK, length)
+
+    def nbytes(self):
+        # the mapped pages belong to the page cache, not to the heap
+        return 0
+
+    def clear(self):
+        """Drop every segment, references handed out keep reading the unlinked files"""
+        self._segments = []
+        self._used = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.seg'):
+                os.remove(os.path.join(self.directory, name))
+
+    def _new_segment(self, size):
+        path = os.path.join(self.directory, f"{len(self._segments):06d}.seg")
+        with open(path, 'w+b') as f:
+            f.truncate(size)
+            # the mapping stays valid once the file is closed
+            self._segments.append(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_WRITE))
+        self._used = 0
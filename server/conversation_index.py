@@ -0,0 +1,104 @@
+import bisect
+from collections import defaultdict
+from operator import itemgetter
+
+
+def conversation_key(user_a, user_b):
+    """Key of the conversation between two users, the same in both directions"""
+    return (user_a, user_b) if user_a <= user_b else (user_b, user_a)
+
+
+class ConversationIndex:
+    """
+    Secondary index over message_store:
+        {(user_a, user_b): [(timestamp, msg_id), ...]}
+    Each conversation is kept sorted by time, so listing a conversation costs
+    O(rows returned) instead of a scan of every stored message.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._partners = defaultdict(set)  # {username: {usernames they have a conversation with}}
+
+    def add(self, msg):
+        key = conversation_key(msg.sender, msg.recipient)
+        entries = self._entries.setdefault(key, [])
+        item = (msg.timestamp, msg.id)
+        # new messages are almost always the latest of their conversation
+        if not entries or entries[-1] < item:
+            entries.append(item)
+        else:
+            idx = bisect.bisect_left(entries, item)
+            if idx < len(entries) and entries[idx] == item:
+                return
+            entries.insert(idx, item)
+        self._partners[msg.sender].add(msg.recipient)
+        self._partners[msg.recipient].add(msg.sender)
+
+    def remove(self, msg):
+        key = conversation_key(msg.sender, msg.recipient)
+        entries = self._entries.get(key)
+        if not entries:
+            return
+        item = (msg.timestamp, msg.id)
+        idx = bisect.bisect_left(entries, item)
+        if idx < len(entries) and entries[idx] == item:
+            del entries[idx]
+        if not entries:
+            self._drop(key)
+
+    def mark_read(self, msg):
+        """Nothing to do, the index does not depend on the read status"""
+
+    def remove_user(self, username):
+        """Drop every conversation the user takes part in"""
+        for partner in list(self._partners.get(username, ())):
+            self._drop(conversation_key(username, partner))
+        self._partners.pop(username, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._partners.clear()
+
+    def get(self, user_a, user_b):
+        """Message ids of the conversation, oldest first"""
+        entries = self._entries.get(conversation_key(user_a, user_b), [])
+        return [msg_id for _, msg_id in entries]
+
+    def page(self, user_a, user_b, limit, before=None, after=None, before_id=None, after_id=None):
+        """
+        One page of the conversation, oldest first.
+        The cursors are exclusive: before / after are timestamps, the optional
+        before_id / after_id break ties between messages sharing that timestamp.
+        Without an after cursor the page ends at the newest matching message.
+        :return: (msg_ids, has_more) where has_more tells whether further rows
+                 exist beyond the page in the direction of the scan
+        """
+        entries = self._entries.get(conversation_key(user_a, user_b), [])
+
+        lo, hi = 0, len(entries)
+        if before is not None:
+            if before_id is not None:
+                hi = bisect.bisect_left(entries, (before, before_id))
+            else:
+                hi = bisect.bisect_left(entries, before, key=itemgetter(0))
+        if after is not None:
+            if after_id is not None:
+                lo = bisect.bisect_right(entries, (after, after_id), hi=hi)
+            else:
+                lo = bisect.bisect_right(entries, after, hi=hi, key=itemgetter(0))
+
+        if after is not None and before is None:
+            # scanning forward from the cursor
+            end = min(lo + limit, hi)
+            return [msg_id for _, msg_id in entries[lo:end]], end < hi
+        start = max(lo, hi - limit)
+        return [msg_id for _, msg_id in entries[start:hi]], start > lo
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        user_a, user_b = key
+        for user, partner in ((user_a, user_b), (user_b, user_a)):
+            partners = self._partners.get(user)
+            if partners is not None:
+                # the empty set is kept, another conversation of the user may be adding to it concurrently
+                partners.discard(partner)
@@ -0,0 +1,34 @@
+import argparse
+from common.binlog import is_binary_log
+from common.message import Chatmsg
+from common.utils import read_records, serialize_entries
+
+
+def convert_log(src, dst):
+    """
+    Convert a node log (or snapshot) between JSON lines and the binary format,
+    the format of each file is given by its extension (.binlog is binary).
+    Records are copied one by one in their original order.
+    :return: number of records converted
+    """
+    binary = is_binary_log(dst)
+    count = 0
+    with open(dst, 'wb') as out:
+        for record in read_records(src):
+            entry = record.to_dict() if isinstance(record, Chatmsg) else record
+            out.write(serialize_entries([entry], binary))
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a node log between JSON lines and the binary format")
+    parser.add_argument("src", help="Log to read, binary if it ends with .binlog")
+    parser.add_argument("dst", help="Log to write, binary if it ends with .binlog")
+    args = parser.parse_args()
+    count = convert_log(args.src, args.dst)
+    print(f"🔁 Converted {count} records from {args.src} to {args.dst}")
+
+
+if __name__ == "__main__":
+    main()
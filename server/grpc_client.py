@@ -1,10 +1,233 @@
+import threading
+import time
+from collections import deque
 import grpc
-from generated.sync_pb2 import DataPackage, MessageData, Empty
+from generated.sync_pb2 import DataPackage, MessageData, AccountData, Empty, FullDataRequest, ChangesRequest, Watermark
 from generated.sync_pb2_grpc import DataSyncStub
 from common.message import Chatmsg
 
+# bounds of one chunk of a streamed full sync, well below the 4 MB gRPC message limit
+FULL_SYNC_CHUNK_SIZE = 1000
+FULL_SYNC_CHUNK_BYTES = 1024 * 1024
+
+
+def iter_chunks(msgs, convert, chunk_size=FULL_SYNC_CHUNK_SIZE, chunk_bytes=FULL_SYNC_CHUNK_BYTES):
+    """
+    Split messages into DataPackages of at most chunk_size messages and roughly chunk_bytes,
+    converting each message to MessageData only when its chunk is built.
+    """
+    chunk = []
+    size = 0
+    for msg in msgs:
+        data = convert(msg)
+        chunk.append(data)
+        # encoded size (multi-byte UTF-8 included), plus the tag and length of the repeated field
+        size += data.ByteSize() + 4
+        if len(chunk) >= chunk_size or size >= chunk_bytes:
+            yield DataPackage(messages=chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield DataPackage(messages=chunk)
+
+
+def account_data(record):
+    """AccountData of an account store change record"""
+    return AccountData(username=record["username"], password_hash=record["hash"] or "", timestamp=record["timestamp"])
+
+
+def account_record(data):
+    """Account store change record of an AccountData"""
+    return {"username": data.username, "hash": data.password_hash or None, "timestamp": data.timestamp}
+
+
+def deletions(data_package):
+    """(msg_id, time of deletion) pairs of a package, now for packages of older nodes without the times"""
+    if len(data_package.deleted_at) == len(data_package.deleted_ids):
+        return list(zip(data_package.deleted_ids, data_package.deleted_at))
+    now = time.time()
+    return [(msg_id, now) for msg_id in data_package.deleted_ids]
+
+
+def merge_packages(packages):
+    """Coalesce several DataPackages into one, keeping messages, deletes and reads in order"""
+    merged = DataPackage()
+    for data_package in packages:
+        merged.messages.extend(data_package.messages)
+        merged.deleted_ids.extend(data_package.deleted_ids)
+        merged.deleted_at.extend(deleted_at for _, deleted_at in deletions(data_package))
+        merged.read_ids.extend(data_package.read_ids)
+        merged.accounts.extend(data_package.accounts)
+    first, last = packages[0], packages[-1]
+    if first.origin:
+        merged.origin = first.origin
+        merged.epoch = first.epoch
+        merged.to_seq = last.to_seq
+        # a gap (dropped packages) leaves from_seq unset, the receiver then keeps its watermark
+        contiguous = all(b.from_seq == a.to_seq + 1 for a, b in zip(packages, packages[1:]))
+        merged.from_seq = first.from_seq if contiguous else 0
+    return merged
+
+
+def apply_package(local_data, data_package, tombstones=None, account_store=None):
+    """
+    Merge a package fetched at startup into local_data:
+    unknown or newer messages are taken, a message read on either side stays read,
+    deletes and reads are applied to the messages we have.
+    :param tombstones: Optional {msg_id: time of deletion}, deleted messages are not taken and deletes are added
+    :param account_store: Optional server.account_store.AccountStore the account changes are applied to
+    """
+    if account_store is not None and data_package.accounts:
+        account_store.apply([account_record(a) for a in data_package.accounts])
+    for remote_msg in data_package.messages:
+        id = remote_msg.id
+        if tombstones is not None and id in tombstones:
+            continue
+        if id not in local_data or remote_msg.timestamp > local_data[id].timestamp:
+            local_data[id] = Chatmsg(
+                sender=remote_msg.sender,
+                recipient=remote_msg.recipient,
+                content=remote_msg.content,
+                msg_id=remote_msg.id,
+                status=remote_msg.status,
+                timestamp=remote_msg.timestamp
+            )
+        elif remote_msg.status == "read":
+            local_data[id].status = "read"
+    for id, deleted_at in deletions(data_package):
+        local_data.pop(id, None)
+        if tombstones is not None:
+            tombstones.setdefault(id, deleted_at)
+    for id in data_package.read_ids:
+        if id in local_data:
+            local_data[id].status = "read"
+
+
+class PeerSender:
+    """
+    Outbound replication queue of one peer, drained by a background thread.
+    Writers only enqueue, so a slow or dead peer never holds them up:
+    packages queued within batch_window (or up to batch_max of them) are
+    coalesced into a single RPC, each RPC has a deadline, failures are
+    retried with exponential backoff, and when the queue is full the oldest
+    package is dropped.
+    """
+    def __init__(self, stub, addr, queue_size=1024, rpc_timeout=2.0, backoff=0.1, backoff_max=5.0,
+                 batch_window=0.005, batch_max=256):
+        self.stub = stub
+        self.addr = addr
+        self.rpc_timeout = rpc_timeout
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+
+        self._queue = deque()
+        self._queue_size = queue_size
+        self._cond = threading.Condition()
+        self._in_flight = False
+        self._stopped = False
+
+        self.sent = 0  # packages delivered
+        self.rpcs = 0  # successful IncrementalSync calls, one per coalesced batch
+        self.failures = 0
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._run, name=f"sync-{addr}", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, data_package):
+        with self._cond:
+            if len(self._queue) >= self._queue_size:
+                self._queue.popleft()
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    print(f"⚠️ Replication queue to {self.addr} is full, {self.dropped} packages dropped so far")
+            self._queue.append(data_package)
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """Wait until the queue is drained, returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "sent": self.sent,
+                "rpcs": self.rpcs,
+                "failures": self.failures,
+                "dropped": self.dropped,
+            }
+
+    def _take_batch(self):
+        """Wait for packages and pop the next batch, called with the condition held"""
+        while not self._queue and not self._stopped:
+            self._cond.wait()
+        if self._stopped:
+            return None, 0
+        # give concurrent writers a short window to add to the batch
+        deadline = time.monotonic() + self.batch_window
+        while len(self._queue) < self.batch_max and not self._stopped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        count = min(len(self._queue), self.batch_max)
+        batch = [self._queue.popleft() for _ in range(count)]
+        self._in_flight = True
+        data_package = batch[0] if count == 1 else merge_packages(batch)
+        return data_package, count
+
+    def _run(self):
+        delay = self.backoff
+        data_package, count = None, 0
+        while True:
+            if data_package is None:
+                with self._cond:
+                    data_package, count = self._take_batch()
+                if data_package is None:
+                    return
+
+            try:
+                self.stub.IncrementalSync(data_package, timeout=self.rpc_timeout)
+            except grpc.RpcError as e:
+                with self._cond:
+                    self.failures += 1
+                if self.failures == 1 or delay >= self.backoff_max:
+                    print(f"Incremental sync failed to {self.addr}, retrying in {delay:.1f}s: {e}")
+                # back off, but wake up early when stopped
+                with self._cond:
+                    if self._cond.wait_for(lambda: self._stopped, timeout=delay):
+                        return
+                delay = min(delay * 2, self.backoff_max)
+                continue
+
+            delay = self.backoff
+            with self._cond:
+                self.sent += count
+                self.rpcs += 1
+                self._in_flight = False
+                self._cond.notify_all()
+            data_package, count = None, 0
+
+
 class SyncClient:
-    def __init__(self, target_nodes):
+    def __init__(self, target_nodes, queue_size=1024, rpc_timeout=2.0, backoff=0.1, backoff_max=5.0,
+                 batch_window=0.005, batch_max=256, chunk_size=FULL_SYNC_CHUNK_SIZE, change_log=None):
         self.channels = [
             grpc.insecure_channel(addr) for addr in target_nodes
         ]
@@ -12,6 +235,16 @@ class SyncClient:
         self.stubs_addr = {}
         for i in range(len(self.stubs)):
             self.stubs_addr[self.stubs[i]]= target_nodes[i]
+        self.rpc_timeout = rpc_timeout
+        self.chunk_size = chunk_size
+        # server.change_log.ChangeLog numbering the changes made on this node
+        self.change_log = change_log
+        # one outbound queue and sender thread per peer
+        self.senders = [
+            PeerSender(stub, self.stubs_addr[stub], queue_size, rpc_timeout, backoff, backoff_max,
+                       batch_window, batch_max)
+            for stub in self.stubs
+        ]
 
     def fetch_full_data(self):
         """Fetch full data from the first available node"""
@@ -22,45 +255,122 @@ class SyncClient:
                 print(f"Failed to fetch data from node {self.stubs_addr[stub]}: {e}")
         raise Exception("All nodes are unavailable")
 
+    def stream_full_data(self):
+        """
+        Yield the full data of the first available node chunk by chunk.
+        Falls back to GetFullData for peers without the streaming RPC.
+        A node failing mid-stream is skipped, the caller must tolerate chunks being delivered twice.
+        """
+        for stub in self.stubs:
+            try:
+                yield from self._full_data_of(stub)
+                return
+            except grpc.RpcError as e:
+                print(f"Failed to fetch data from node {self.stubs_addr[stub]}: {e}")
+        raise Exception("All nodes are unavailable")
+
+    def _full_data_of(self, stub):
+        """Chunks of the full data of one node, through GetFullData for nodes without the streaming RPC"""
+        try:
+            yield from stub.StreamFullData(FullDataRequest(chunk_size=self.chunk_size))
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            yield stub.GetFullData(Empty())
+
     def sync_on_startup(self, local_data):
-        """Perform synchronization on startup"""
+        """Perform synchronization on startup, applying the remote data as its chunks arrive"""
         try:
-            remote_data = self.fetch_full_data()
-            for remote_msg in remote_data.messages:
-                id = remote_msg.id
-                if id not in local_data or remote_msg.timestamp > local_data[id].timestamp:
-                    local_data[id] = Chatmsg(
-                        sender=remote_msg.sender,
-                        recipient=remote_msg.recipient,
-                        content=remote_msg.content,
-                        msg_id=remote_msg.id,
-                        status=remote_msg.status,
-                        timestamp=remote_msg.timestamp
-                    )
+            for chunk in self.stream_full_data():
+                apply_package(local_data, chunk)
             return 
         except Exception as e:
             print(f"⛔ Startup synchronization failed: {e}")
             return 
 
+    def catch_up(self, local_data, watermarks, tombstones=None, account_store=None, lock=None):
+        """
+        Fetch from every peer the changes made there since our watermark: inserts, reads and deletes.
+        Peers that cannot serve the delta (no watermark yet, other epoch, changes trimmed, older node)
+        send their full data instead.
+        :param watermarks: {origin: (epoch, seq)}, advanced as the changes are applied
+        :param tombstones: Optional {msg_id: time of deletion}, see apply_package
+        :param account_store: Optional AccountStore, see apply_package
+        :param lock: Optional lock guarding local_data and watermarks, held while a chunk is applied
+                     (the sync service already accepts IncrementalSync during the catch-up)
+        """
+        if lock is None:
+            lock = threading.Lock()
+        request = ChangesRequest(
+            watermarks=[Watermark(origin=o, epoch=e, seq=s) for o, (e, s) in watermarks.items()],
+            chunk_size=self.chunk_size,
+        )
+        for stub in self.stubs:
+            addr = self.stubs_addr[stub]
+            try:
+                count = 0
+                for chunk in stub.GetChangesSince(request):
+                    with lock:
+                        apply_package(local_data, chunk, tombstones, account_store)
+                        watermarks[chunk.origin] = (chunk.epoch, chunk.to_seq)
+                    count += chunk.to_seq - chunk.from_seq + 1
+                print(f"🔄 Caught up with {addr}: {count} changes")
+                continue
+            except grpc.RpcError as e:
+                if e.code() not in (grpc.StatusCode.OUT_OF_RANGE, grpc.StatusCode.UNIMPLEMENTED):
+                    print(f"⛔ Catch-up with {addr} failed: {e}")
+                    continue
+
+            print(f"🔄 No delta available from {addr}, fetching its full data")
+            try:
+                last = None
+                for chunk in self._full_data_of(stub):
+                    with lock:
+                        apply_package(local_data, chunk, tombstones, account_store)
+                    last = chunk
+                # the full data is as recent as the change it was taken at
+                if last is not None and last.origin:
+                    with lock:
+                        watermarks[last.origin] = (last.epoch, last.to_seq)
+            except grpc.RpcError as e:
+                print(f"⛔ Full data fetch from {addr} failed: {e}")
+
     def full_sync(self, data_package):
         for stub in self.stubs:
             try:
-                stub.FullSync(data_package)
+                stub.FullSync(data_package, timeout=self.rpc_timeout)
             except grpc.RpcError as e:
                 print(f"Full sync failed to {self.stubs_addr[stub]}: {e}")
 
-    def incremental_sync(self, data_package):
+    def stream_full_sync(self, msgs):
+        """
+        Replace the data of every peer with msgs, streamed in bounded chunks
+        :param msgs: sequence of Chatmsg, iterated once per peer
+        """
         for stub in self.stubs:
             try:
-                stub.IncrementalSync(data_package)
+                stub.StreamFullSync(iter_chunks(msgs, self._convert_message, self.chunk_size))
             except grpc.RpcError as e:
-                print(f"Incremental sync failed to {self.stubs_addr[stub]}: {e}")
+                print(f"Full sync failed to {self.stubs_addr[stub]}: {e}")
+
+    def incremental_sync(self, data_package):
+        """Number the change when there is a change log, queue it for every peer and return immediately"""
+        if self.change_log is not None:
+            self.change_log.record(data_package)
+        for sender in self.senders:
+            sender.enqueue(data_package)
+
+    def flush(self, timeout=None):
+        """Wait until every peer queue is drained"""
+        return all(sender.flush(timeout) for sender in self.senders)
 
-    def create_data_package(self, new_msgs=[], deleted_ids=[], read_ids=[]):
+    def create_data_package(self, new_msgs=[], deleted_ids=[], read_ids=[], accounts=[], deleted_at=[]):
         return DataPackage(
             messages=[self._convert_message(m) for m in new_msgs],
             deleted_ids=deleted_ids,
-            read_ids = read_ids
+            deleted_at=deleted_at,
+            read_ids = read_ids,
+            accounts=[account_data(record) for record in accounts]
         )
 
     def _convert_message(self, msg):
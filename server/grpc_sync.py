@@ -1,50 +1,176 @@
 import grpc
+import itertools
 from concurrent import futures
 import threading
-from generated.sync_pb2 import DataPackage, SyncResponse, MessageData
-from generated.sync_pb2_grpc import DataSyncServicer, add_DataSyncServicer_to_server
-from server.handler import message_store, messages, lock, node_name
-from common.utils import save_to_file
+from generated.sync_pb2 import DataPackage, SyncResponse, MessageData, TreeNodes, Presence
+from generated.sync_pb2_grpc import DataSyncServicer, add_DataSyncServicer_to_server, AntiEntropyServicer, add_AntiEntropyServicer_to_server, PresenceGossipServicer, add_PresenceGossipServicer_to_server
+from server.handler import message_store, messages, lock, hold_messages, message_ids, node_name, indexes, index_add, index_remove, index_mark_read, persist, snapshot_lock, capture_snapshot, write_snapshot, rebuild_indexes, change_log, advance_watermark, tombstones, add_tombstones, delete_entry, merkle_tree, account_store, push_registry, presence
+from server.grpc_client import iter_chunks, account_data, account_record, deletions, FULL_SYNC_CHUNK_SIZE
 from common.message import Chatmsg
 
+# largest chunk a peer may ask for
+MAX_CHUNK_SIZE = 10000
+# tombstone ids per chunk of GetBuckets
+TOMBSTONE_CHUNK_SIZE = 10000
+
 class SyncService(DataSyncServicer):
     def FullSync(self, request, context):
-    
-        message_store.clear()
-        messages.clear()
-        for msg_data in request.messages:
-            self._add_message(msg_data)
-
-        for msg_id in request.deleted_ids:
-            self._remove_message(msg_id)
-        
-        save_to_file(message_store, f'{node_name[0]}.json', mode='overwrite')
+        self._apply_accounts(request.accounts)
+        with snapshot_lock:
+            with lock:
+                message_store.clear()
+                messages.clear()
+                for index in indexes:
+                    index.clear()
+                for msg_data in request.messages:
+                    self._add_message(msg_data)
+
+                for msg_id, deleted_at in deletions(request):
+                    self._remove_message(msg_id, deleted_at)
+
+                state = capture_snapshot()
+            write_snapshot(state)
         return SyncResponse(success=True)
 
     def IncrementalSync(self, request, context):
-        if len(request.messages) != 0:
+        # a package may hold many coalesced updates, log them with a single write
+        # the account store journals the account changes itself
+        self._apply_accounts(request.accounts)
+        entries = []
+        # messages first seen here, pushed to their recipients if connected to this node
+        new_msgs = []
+        # only the conversations the package touches are locked
+        with hold_messages(request.messages, list(request.deleted_ids) + list(request.read_ids)):
             for msg_data in request.messages:
+                is_new = msg_data.id not in message_store
                 msg = self._add_message(msg_data)
-                save_to_file(msg, f'{node_name[0]}.json', mode='append')
-            
-        if len(request.deleted_ids) != 0:
-            for id in request.deleted_ids:
-                self._remove_message(id)
-            save_to_file(list(request.deleted_ids), f'{node_name[0]}.json', mode='delete')
-
-        if len(request.read_ids) != 0:
-            for id in request.read_ids:
-                self._read_message(id)
-            save_to_file(list(request.read_ids), f'{node_name[0]}.json', mode='read')
-        
+                if msg is not None:
+                    entries.append(msg.to_dict())
+                    if is_new:
+                        new_msgs.append(msg)
+
+            if len(request.deleted_ids) != 0:
+                for id, deleted_at in deletions(request):
+                    self._remove_message(id, deleted_at)
+                entries.append(delete_entry(request.deleted_ids))
+
+            if len(request.read_ids) != 0:
+                for id in request.read_ids:
+                    self._read_message(id)
+                entries.append({"operation": "read", "ids": list(request.read_ids)})
+
+            watermark = advance_watermark(request)
+            if watermark is not None:
+                entries.append(watermark)
+            if entries:
+                persist(entries, 'entries')
+        if new_msgs:
+            push_registry.push(new_msgs)
         return SyncResponse(success=True)
     
     def GetFullData(self, request, context):
+        # cold messages are built while the package is, after the lock is released
+        with lock:
+            msgs = message_store.view()
         return DataPackage(
-            messages=[self._convert_message(m) for m in message_store.values()]
+            messages=[self._convert_message(m) for m in msgs],
+            accounts=[account_data(record) for record in account_store.records()]
         )
 
+    def StreamFullData(self, request, context):
+        """Send the store in bounded chunks instead of one DataPackage"""
+        chunk_size = min(request.chunk_size or FULL_SYNC_CHUNK_SIZE, MAX_CHUNK_SIZE)
+        # only the references of hot messages are copied, cold ones are built and
+        # converted chunk by chunk
+        log = change_log[0]
+        with lock:
+            msgs = message_store.view()
+            position = log.position() if log is not None else None
+        accounts = [account_data(record) for record in account_store.records()]
+
+        # the accounts follow the messages in a chunk of their own
+        chunks = itertools.chain(
+            iter_chunks(msgs, self._convert_message, chunk_size),
+            [DataPackage(accounts=accounts)] if accounts else [],
+        )
+        if position is None:
+            yield from chunks
+            return
+        # tag the chunks with the change the data was taken at, the receiver's watermark for this node
+        epoch, seq = position
+        for chunk in itertools.chain(chunks, [DataPackage()] if not msgs and not accounts else []):
+            chunk.origin = log.origin
+            chunk.epoch = epoch
+            chunk.to_seq = seq
+            yield chunk
+
+    def GetChangesSince(self, request, context):
+        """Stream the changes made on this node after the caller's watermark"""
+        log = change_log[0]
+        if log is None:
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, "This node keeps no change log")
+        mark = next((w for w in request.watermarks if w.origin == log.origin), None)
+        chunk_size = min(request.chunk_size or FULL_SYNC_CHUNK_SIZE, MAX_CHUNK_SIZE)
+        chunks = log.since(mark.epoch, mark.seq, chunk_size) if mark is not None else None
+        if chunks is None:
+            context.abort(grpc.StatusCode.OUT_OF_RANGE, "Changes since the watermark are no longer known")
+        yield from chunks
+
+    def StreamFullSync(self, request_iterator, context):
+        """
+        Replace the store with the streamed chunks.
+        The chunks are staged first, a stream broken halfway leaves the store untouched.
+        """
+        staged = {}
+        deleted = {}
+        for chunk in request_iterator:
+            self._apply_accounts(chunk.accounts)
+            for msg_data in chunk.messages:
+                if msg_data.id in tombstones:
+                    continue
+                staged[msg_data.id] = Chatmsg(
+                    sender=msg_data.sender,
+                    recipient=msg_data.recipient,
+                    content=msg_data.content,
+                    msg_id=msg_data.id,
+                    status=msg_data.status,
+                    timestamp=msg_data.timestamp
+                )
+            for msg_id, deleted_at in deletions(chunk):
+                staged.pop(msg_id, None)
+                deleted[msg_id] = deleted_at
+
+        with snapshot_lock:
+            with lock:
+                add_tombstones(list(deleted), list(deleted.values()))
+                message_store.clear()
+                message_store.update(staged)
+                rebuild_indexes()
+                state = capture_snapshot()
+            write_snapshot(state)
+        return SyncResponse(success=True)
+
+    def _apply_accounts(self, accounts):
+        if accounts:
+            account_store.apply([account_record(a) for a in accounts])
+
     def _add_message(self, msg_data):
+        """
+        Apply a replicated message like apply_package: an unknown or newer message is taken,
+        a message read on either side stays read. Packages are re-sent after a timeout,
+        applying one again changes nothing.
+        :return: the message stored, None when it was deleted here already or nothing changed
+        """
+        if msg_data.id in tombstones:
+            return None
+        old = message_store.peek(msg_data.id)
+        if old is not None and msg_data.timestamp <= old.timestamp:
+            if msg_data.status != "read":
+                return None
+            msg = message_store.mark_read(msg_data.id)
+            if msg is not None:
+                index_mark_read(msg)
+            return msg
         msg = Chatmsg(
             sender=msg_data.sender,
             recipient=msg_data.recipient,
@@ -53,19 +179,28 @@ class SyncService(DataSyncServicer):
             status=msg_data.status,
             timestamp=msg_data.timestamp
         )
+        if old is None:
+            message_ids(msg.recipient, msg.sender).append(msg.id)
+        else:
+            index_remove(old)
+            if old.status == "read":
+                msg.status = "read"
         message_store[msg.id] = msg
-        messages[msg.recipient][msg.sender].append(msg.id)
+        index_add(msg)
         return msg
     
-    def _remove_message(self, msg_id):
+    def _remove_message(self, msg_id, deleted_at=None):
+        add_tombstones([msg_id], None if deleted_at is None else [deleted_at])
         if msg_id in message_store:
             msg = message_store.pop(msg_id)
+            index_remove(msg)
             if msg.recipient in messages and msg.sender in messages[msg.recipient]:
                 messages[msg.recipient][msg.sender].remove(msg.id)
     
     def _read_message(self, msg_id):
-        if msg_id in message_store:
-            message_store[msg_id].status = "read"
+        msg = message_store.mark_read(msg_id)
+        if msg is not None:
+            index_mark_read(msg)
 
 
     def _convert_message(self, msg):
@@ -78,9 +213,49 @@ class SyncService(DataSyncServicer):
             timestamp=msg.timestamp
         )
 
+class AntiEntropyService(AntiEntropyServicer):
+    """Serves this node's hash tree and buckets to the anti-entropy task of the peers"""
+    _convert_message = SyncService._convert_message
+
+    def GetTreeNodes(self, request, context):
+        self._check_buckets(request.buckets, context)
+        if any(not 0 < node < 2 * merkle_tree.buckets for node in request.nodes):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Unknown tree node")
+        # the tree has its own lock
+        return TreeNodes(hashes=merkle_tree.hashes(request.nodes))
+
+    def GetBuckets(self, request, context):
+        self._check_buckets(request.buckets, context)
+        if any(bucket >= merkle_tree.buckets for bucket in request.ids):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Unknown bucket")
+        msgs = []
+        dead = []
+        for bucket in request.ids:
+            bucket_ids, bucket_dead = merkle_tree.bucket(bucket)
+            # the tree only keeps ids, a message deleted since is skipped
+            msgs.extend(msg for msg in map(message_store.peek, bucket_ids) if msg is not None)
+            dead.extend(bucket_dead)
+        yield from iter_chunks(msgs, self._convert_message)
+        for i in range(0, len(dead), TOMBSTONE_CHUNK_SIZE):
+            chunk = dead[i:i + TOMBSTONE_CHUNK_SIZE]
+            # a tombstone expired in the meantime is sent as too old to be taken
+            yield DataPackage(deleted_ids=chunk, deleted_at=[tombstones.get(msg_id, 0.0) for msg_id in chunk])
+
+    def _check_buckets(self, buckets, context):
+        if buckets != merkle_tree.buckets:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, f"This node uses {merkle_tree.buckets} buckets")
+
+class PresenceService(PresenceGossipServicer):
+    """Takes a peer's online users and answers with the ones logged in here"""
+    def Exchange(self, request, context):
+        presence.update(request.node, request.usernames)
+        return Presence(node=node_name[0], usernames=presence.local_usernames())
+
 def run_grpc_server(port=50051):
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
     add_DataSyncServicer_to_server(SyncService(), server)
+    add_AntiEntropyServicer_to_server(AntiEntropyService(), server)
+    add_PresenceGossipServicer_to_server(PresenceService(), server)
     server.add_insecure_port(f'[::]:{port}')
     server.start()
     print(f"🚀 gRPC sync server started on port {port}")
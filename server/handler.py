@@ -1,22 +1,265 @@
 from collections import deque, defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+import os
+import secrets
 import threading
-from common.utils import recv_data, send_data, check_pwd, hash_pwd, save_to_file, save_user_accounts_to_json
+import time
+from common.utils import send_data, check_pwd, hash_pwd, save_to_file, save_snapshot, snapshot_filename, previous_log_filename, move_records
 from common.protocol import Protocol
+from common.frame_reader import FrameReader
 from common.message import Chatmsg
+from common.session import issue_token, verify_token, DEFAULT_SESSION_TTL_S
+from server.conversation_index import ConversationIndex, conversation_key
+from server.unread_counter import UnreadCounter
+from server.merkle_tree import MerkleTree
+from server.message_store import MessageStore
+from server.striped_lock import StripedLock
+from server.auth_executor import ServerBusy
+from server.account_store import AccountStore
+from server.push_registry import PushRegistry, SerializedSocket
+from server.presence_index import PresenceIndex
 
 
 # dict mapping client addr to username
 connected_clients = {}
+# dict mapping client addr to the wire features negotiated with REQ_HELLO
+client_features = {}
+# live connections of the logged-in users, new messages are pushed to them
+push_registry = PushRegistry()
+# who is logged in here or on a peer (server/presence_gossip.py fills in the peers)
+presence = PresenceIndex()
 
 # dict mapping username to password
 user_accounts = {}
+# persists and versions user_accounts, opened on <node>.accounts.json by start_server
+account_store = AccountStore(user_accounts)
 
 # global message store 
-message_store = {}  # {msg_id: Message}
+message_store = MessageStore()  # {msg_id: Message}, older messages are kept in columns
 messages = defaultdict(lambda: defaultdict(deque))  # {sender: {recipient: deque([msg_id1, msg_id2, ...])}}
+conversations = ConversationIndex()  # {(user_a, user_b): [(timestamp, msg_id), ...]}
+unread_counts = UnreadCounter()  # {recipient: {sender: unread count}}
+merkle_tree = MerkleTree()  # hash tree of message_store and tombstones, for anti-entropy
+# secondary indexes derived from message_store,
+# all of them expose add / remove / mark_read / remove_user / clear,
+# remove gets the message as it was added (the tree keeps no copy to find its digest)
+indexes = (conversations, unread_counts, merkle_tree)
+# {msg_id: time of deletion} of deleted messages, so anti-entropy does not bring them back
+tombstones = {}
+# tombstones older than this are dropped when a snapshot is taken
+tombstone_ttl_s = [7 * 24 * 3600]
 node_name = ['']
+# messages older than this many seconds are moved to the columnar cold tier of message_store
+# when a snapshot is taken, None keeps every message as an object
+cold_after_s = [None]
+# on-disk format of this node's log and snapshot: json | binary
+log_format = ['json']
+# group-commit writer of this node's log (common.log_writer.LogWriter), set up by start_server
+log_writer = [None]
+# sequence-numbered log of the changes made on this node (server.change_log.ChangeLog), set up by start_server
+change_log = [None]
+# process pool running the bcrypt work of logins (server.auth_executor.AuthExecutor), set up by start_server
+auth_executor = [None]
+# key signing the session tokens, shared through the cluster config so any node accepts them;
+# the random default only lets a client resume on the node it logged in to
+session_secret = [secrets.token_bytes(32)]
+session_ttl_s = [DEFAULT_SESSION_TTL_S]
+# {peer node: (epoch, seq)} of the last change made on each peer that is applied here
+watermarks = {}
 
-lock = threading.Lock()
+# guards the message state, striped by conversation: hold(conversation keys) for the
+# messages of some conversations, `with lock:` (every stripe) for the whole state
+lock = StripedLock()
+watermark_lock = threading.Lock()
+# serializes direct log writes when there is no log writer, stripes may persist concurrently
+persist_lock = threading.Lock()
+# one snapshot is captured and written at a time, taken before `lock`
+snapshot_lock = threading.Lock()
+# guards tombstones (and the tombstones of merkle_tree): deletes of ids stored on another
+# node hold no stripe, the stripes are found from the stored messages
+tombstone_lock = threading.Lock()
+
+def log_filename():
+    ext = 'binlog' if log_format[0] == 'binary' else 'json'
+    return f'{node_name[0]}.{ext}'
+
+def change_log_filename():
+    return f'{node_name[0]}.changes.json'
+
+def accounts_filename():
+    return f'{node_name[0]}.accounts.json'
+
+def segments_dirname():
+    """Directory of the mmap'ed content segments of the cold store"""
+    return f'{node_name[0]}.segments'
+
+def persist(data, mode):
+    """
+    Record a mutation in this node's log, accepts the same data / mode as save_to_file.
+    Records are queued on the log writer when there is one, otherwise written directly.
+    The whole dataset is stored with capture_snapshot() and write_snapshot() instead.
+    :return: ticket for wait_persisted()
+    """
+    writer = log_writer[0]
+    if writer is None:
+        with persist_lock:
+            save_to_file(data, log_filename(), mode)
+        return None
+    return writer.append(data, mode)
+
+def capture_snapshot():
+    """
+    Cut the log over and capture the state the snapshot holds, call it holding
+    snapshot_lock and every stripe. Only references and the cold statuses are copied,
+    the changes made from now on go to the new log.
+    :return: the state to pass to write_snapshot() once the stripes are released
+    """
+    previous = previous_log_filename(log_filename())
+    writer = log_writer[0]
+    if writer is not None:
+        writer.rotate(previous)
+    else:
+        with persist_lock:
+            move_records(log_filename(), previous)
+    with tombstone_lock:
+        deleted = dict(tombstones)
+    return message_store.view(), dict(watermarks), deleted
+
+def write_snapshot(state):
+    """Write a capture_snapshot() state as the new snapshot, call it holding snapshot_lock"""
+    msgs, marks, deleted = state
+    save_snapshot(msgs, snapshot_filename(log_filename()), marks, deleted)
+    # the snapshot covers the records cut over
+    os.remove(previous_log_filename(log_filename()))
+
+def take_snapshot():
+    """
+    Snapshot message_store and truncate the log, while the node keeps serving:
+    the stripes are only held to capture the state, not while it is written.
+    """
+    with snapshot_lock:
+        with lock:
+            expire_tombstones(tombstone_ttl_s[0])
+            state = capture_snapshot()
+        write_snapshot(state)
+        if cold_after_s[0] is not None:
+            with lock:
+                frozen = message_store.freeze(time.time() - cold_after_s[0])
+            if frozen:
+                print(f"🧊 Moved {frozen} messages to the cold store ({message_store.stats()})")
+    if change_log[0] is not None:
+        change_log[0].compact()
+
+def add_tombstones(msg_ids, deleted_at=None):
+    """:param deleted_at: Optional time of deletion of each id (as replicated from its origin), now by default"""
+    if deleted_at is None:
+        deleted_at = [time.time()] * len(msg_ids)
+    with tombstone_lock:
+        for msg_id, when in zip(msg_ids, deleted_at):
+            if msg_id not in tombstones:
+                tombstones[msg_id] = when
+                merkle_tree.add_tombstone(msg_id)
+
+def delete_entry(msg_ids):
+    """Log record of deleted messages, with the time of deletion kept by their tombstones"""
+    with tombstone_lock:
+        deleted_at = [tombstones[msg_id] for msg_id in msg_ids]
+    return {"operation": "delete", "ids": list(msg_ids), "deleted_at": deleted_at}
+
+def expire_tombstones(ttl):
+    """Drop the tombstones older than ttl seconds, replicas down for longer may bring their messages back"""
+    cutoff = time.time() - ttl
+    with tombstone_lock:
+        for msg_id in [msg_id for msg_id, deleted_at in tombstones.items() if deleted_at < cutoff]:
+            del tombstones[msg_id]
+            merkle_tree.remove_tombstone(msg_id)
+
+def message_ids(recipient, sender):
+    """The deque of ids sent by sender to recipient, created if needed without racing other stripes"""
+    return messages.setdefault(recipient, defaultdict(deque))[sender]
+
+def conversation_keys(msgs=(), msg_ids=()):
+    """Conversations of the given messages and of the stored messages msg_ids"""
+    keys = {conversation_key(msg.sender, msg.recipient) for msg in msgs}
+    for msg_id in msg_ids:
+        msg = message_store.peek(msg_id)
+        if msg is not None:
+            keys.add(conversation_key(msg.sender, msg.recipient))
+    return keys
+
+@contextmanager
+def hold_messages(msgs=(), msg_ids=()):
+    """
+    Hold the stripes of the conversations touched by msgs and by the stored messages msg_ids.
+    An id may get stored while we wait for the stripes, so its conversation is checked again once they are held.
+    """
+    keys = conversation_keys(msgs, msg_ids)
+    while True:
+        stripes = lock.acquire(keys)
+        missing = conversation_keys((), msg_ids) - keys
+        if not missing:
+            break
+        lock.release(stripes)
+        keys |= missing
+    try:
+        yield
+    finally:
+        lock.release(stripes)
+
+def advance_watermark(data_package):
+    """
+    Move the watermark of the package's origin to its last change, when the package
+    continues the changes already applied. After a gap the watermark stays put, so
+    the missed changes are fetched by the next catch-up.
+    :return: watermark log record to persist along with the changes, None when it did not move
+    """
+    if not data_package.origin or data_package.from_seq == 0:
+        return None
+    with watermark_lock:
+        epoch, seq = watermarks.get(data_package.origin, (None, 0))
+        if epoch != data_package.epoch:
+            # only follow a new change log from its first change
+            if data_package.from_seq != 1:
+                return None
+        elif data_package.from_seq > seq + 1 or data_package.to_seq <= seq:
+            return None
+        watermarks[data_package.origin] = (data_package.epoch, data_package.to_seq)
+    return {"operation": "watermark", "origin": data_package.origin, "epoch": data_package.epoch, "seq": data_package.to_seq}
+
+def wait_persisted(ticket):
+    """Wait until the record is durable as required by the fsync policy, call it without holding lock"""
+    writer = log_writer[0]
+    if writer is not None and ticket is not None:
+        writer.wait(ticket)
+
+def index_add(msg):
+    for index in indexes:
+        index.add(msg)
+
+def index_remove(msg):
+    for index in indexes:
+        index.remove(msg)
+
+def index_mark_read(msg):
+    for index in indexes:
+        index.mark_read(msg)
+
+def check_unread_counters():
+    """Recount unread messages and compare with the maintained counters, for tests"""
+    return unread_counts.verify(message_store)
+
+def rebuild_indexes():
+    """Rebuild messages and the secondary indexes from message_store"""
+    messages.clear()
+    for index in indexes:
+        index.clear()
+    for msg in message_store.values():
+        messages[msg.recipient][msg.sender].append(msg.id)
+        index_add(msg)
+    with tombstone_lock:
+        for msg_id in tombstones:
+            merkle_tree.add_tombstone(msg_id)
 
 def handle_new_connection(address):
     print(f"[INFO] Client connected from {address}")
@@ -26,6 +269,9 @@ def handle_new_connection(address):
 def handle_disconnect(client_socket, address):
     if address in connected_clients:
         del connected_clients[address]
+    client_features.pop(address, None)
+    push_registry.unregister(address)
+    presence.logout(address)
     client_socket.close()
     print(f"[INFO] Client disconnected.")
 
@@ -34,138 +280,232 @@ def send_message(sender, recipient, content, sync_client):
     """ send message:
     - online user:directly send messages
     - offline user: store into undelivered_messages
+    :return: the RESP_MESSAGE_SENT payload, {"id": msg id, "delivery": Protocol.DELIVERY_*}
     """
-    with lock:
+    with lock.hold([conversation_key(sender, recipient)]):
         msg = Chatmsg(sender, recipient, content)
         message_store[msg.id] = msg  # global storage for messages
 
-        messages[recipient][sender].append(msg.id)
+        message_ids(recipient, sender).append(msg.id)
         
-        if recipient in connected_clients.values():  # if recipient is online
+        # only a push from this node counts as delivered, the peers' presence may be
+        # ttl_s old and their pushes are not confirmed
+        if push_registry.is_online(recipient):
             print(f"✅ Message delivered to {recipient}")
             msg.status = 'read'
+            delivery = Protocol.DELIVERY_PUSHED
+        elif presence.is_online(recipient):
+            print(f"📨 {recipient} is online, it gets the message with its next push or poll.")
+            delivery = Protocol.DELIVERY_ONLINE
         else:  # recipient is offline
             print(f"📩 {recipient} is offline. Message stored for later delivery.")
+            delivery = Protocol.DELIVERY_STORED
+        index_add(msg)
         
-        save_to_file(msg, f'{node_name[0]}.json', 'append')
+        ticket = persist(msg, 'append')
         sync_client.incremental_sync(sync_client.create_data_package(new_msgs=[msg]))
+    # outside the lock, a slow recipient must not hold up the conversation
+    push_registry.push([msg])
+    wait_persisted(ticket)
+    return {"id": msg.id, "delivery": delivery}
 
 def read_messages(sender, recipient, sync_client):
-    with lock:
+    with lock.hold([conversation_key(sender, recipient)]):
         if recipient not in messages or sender not in messages[recipient]:
             print(f"🚫 No messages from {sender} to {recipient}.")
             return
         
-        message_ids = list(messages[recipient][sender])
         print(f"{recipient} read messages from {sender}.")
-        for msg_id in message_ids:
-            if msg_id in message_store and message_store[msg_id].status == 'unread':
-                message_store[msg_id].status = "read"
-                save_to_file([msg_id], f'{node_name[0]}.json', 'read')
+        read_ids = []
+        for msg_id in list(messages[recipient][sender]):
+            # cold messages are updated in place
+            msg = message_store.mark_read(msg_id)
+            if msg is not None:
+                index_mark_read(msg)
+                read_ids.append(msg_id)
+        # opening a chat with nothing unread changes nothing, nothing to log or replicate
+        if not read_ids:
+            return
+        # one log record for the whole batch
+        ticket = persist(read_ids, 'read')
 
-        sync_client.incremental_sync(sync_client.create_data_package(read_ids=message_ids))
+        sync_client.incremental_sync(sync_client.create_data_package(read_ids=read_ids))
+    wait_persisted(ticket)
 
 
 def list_messages(username, friend):
-    ret = []
-    for msg in message_store.values():
-        # my message to this friend 
-        if msg.sender == username and msg.recipient == friend:
-            ret.append(msg)
-        # this frind's message to me
-        if msg.sender == friend and msg.recipient == username:
-            ret.append(msg)
-    
-    # sort mseeage by time
-    sorted(ret, key= lambda msg : msg.timestamp)
-    return ret
+    # the conversation index is already sorted by time
+    with lock.hold([conversation_key(username, friend)]):
+        msgs = (message_store.peek(msg_id) for msg_id in conversations.get(username, friend))
+        return [msg for msg in msgs if msg is not None]
+
+# upper bound of messages returned by one REQ_LIST_MESSAGES_PAGE
+MAX_PAGE_SIZE = 200
+DEFAULT_PAGE_SIZE = 50
+
+def list_messages_page(username, friend, limit=DEFAULT_PAGE_SIZE, before=None, after=None, before_id=None, after_id=None):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    with lock.hold([conversation_key(username, friend)]):
+        msg_ids, has_more = conversations.page(username, friend, limit, before, after, before_id, after_id)
+        page = [msg for msg in map(message_store.peek, msg_ids) if msg is not None]
+    return {"messages": page, "has_more": int(has_more)}
 
 def list_users(username):
-    unread_msg_cnt = {}
-    for sender in user_accounts.keys():
-        msg_queue = messages[username][sender]
-        count = 0
-        for msg_id in msg_queue:
-            msg = message_store[msg_id]
-            if msg.status == "unread":
-                count += 1
-        unread_msg_cnt[sender] = count
-    
-    return unread_msg_cnt
+    return {sender: unread_counts.get(username, sender) for sender in user_accounts.keys()}
 
 def delete_message(username, msg_id, sync_client):
-    with lock:
+    with hold_messages(msg_ids=[msg_id]):
         if msg_id in message_store:
-            recipient = message_store[msg_id].recipient
-            del message_store[msg_id]
+            msg = message_store.pop(msg_id)
+            recipient = msg.recipient
+            index_remove(msg)
 
             messages[recipient][username].remove(msg_id)
+            add_tombstones([msg_id])
 
-            save_to_file([msg_id], f'{node_name[0]}.json', 'delete')
-            sync_client.incremental_sync(sync_client.create_data_package(deleted_ids=[msg_id]))
+            entry = delete_entry([msg_id])
+            ticket = persist([entry], 'entries')
+            sync_client.incremental_sync(sync_client.create_data_package(deleted_ids=[msg_id], deleted_at=entry["deleted_at"]))
 
             print(f"🗑️ Deleted message {msg_id} from {username} to {recipient}")
+        else:
+            ticket = None
+    wait_persisted(ticket)
 
-def delete_account(username):
+def save_account(username, hashed, sync_client):
+    """Create or update an account in the account store and replicate the change"""
+    change = account_store.put(username, hashed)
+    sync_client.incremental_sync(sync_client.create_data_package(accounts=[change]))
+
+def delete_account(username, sync_client):
+    if username in user_accounts:
+        change = account_store.delete(username)
+        sync_client.incremental_sync(sync_client.create_data_package(accounts=[change]))
     with lock:
-        if username in user_accounts:
-            del user_accounts[username]
-            save_user_accounts_to_json(user_accounts)
+        for index in indexes:
+            index.remove_user(username)
+        deleted_ids = []
         if username in messages:
             for sender in list(messages[username].keys()):  # iterate message this user received
                 for msg_id in messages[username][sender]: 
-                    if msg_id in message_store:
-                        del message_store[msg_id]   
+                    msg = message_store.pop(msg_id, None)
+                    if msg is not None:
+                        merkle_tree.remove(msg)
+                        deleted_ids.append(msg_id)
             del messages[username] 
 
         for recipient in list(messages.keys()):  # iterate message this user sended
             if username in messages[recipient]:  # if user is sender
                 for msg_id in messages[recipient][username]: 
-                    if msg_id in message_store:
-                        del message_store[msg_id]
+                    msg = message_store.pop(msg_id, None)
+                    if msg is not None:
+                        merkle_tree.remove(msg)
+                        deleted_ids.append(msg_id)
                 del messages[recipient][username]  # 
 
                 if not messages[recipient]:  # 
                     del messages[recipient]
 
+        # tombstones let anti-entropy carry the deletion to the other replicas
+        add_tombstones(deleted_ids)
+        ticket = persist([delete_entry(deleted_ids)], 'entries') if deleted_ids else None
+
         print(f"❌ {username} has been deleted.")
+    wait_persisted(ticket)
+
+
+def submit_login(address, pwd):
+    """
+    Start the bcrypt work of a REQ_LOGIN_2: hashing the password of a new account,
+    or checking it against the stored hash. It runs on the auth executor when there is one.
+    :return: (username, whether the account is being created, Future of the new hash or of the check)
+    :raises ServerBusy: when the auth executor admits no more requests
+    """
+    username = connected_clients[address]
+    executor = auth_executor[0]
+    hashed = user_accounts[username]
+    created = hashed is None
+    if executor is not None:
+        pending = executor.hash_pwd(pwd) if created else executor.check_pwd(pwd, hashed)
+    else:
+        pending = Future()
+        pending.set_result(hash_pwd(pwd) if created else check_pwd(pwd, hashed))
+    return username, created, pending
 
+def finish_login(sock, address, username, created, result, sync_client, request_id=None):
+    """
+    Answer a REQ_LOGIN_2 once submit_login's future is done
+    :param created: submit_login's flag, result is then the new hash, otherwise whether the password matched
+    """
+    if created:
+        save_account(username, result, sync_client)
+        login_success(sock, address, username, request_id)
+    elif result:
+        login_success(sock, address, username, request_id)
+    else:
+        send_data(sock, Protocol.RESP_LOGIN_FAILED, None, request_id=request_id)
+
+def login_success(sock, address, username, request_id=None):
+    # a successful login should response the list of accounts, then a token to resume the session elsewhere
+    send_data(sock, Protocol.RESP_LOGIN_SUCCESS, list(user_accounts.keys()), request_id=request_id)
+    # clients that did not ask for tokens would take it for the reply to their next request
+    if Protocol.FEATURE_SESSION_TOKENS in client_features.get(address, ()):
+        token = issue_token(username, session_secret[0], session_ttl_s[0])
+        send_data(sock, Protocol.RESP_SESSION_TOKEN, token, request_id=request_id)
+    presence.login(username, address)
+    # from now on the connection receives the user's new messages, if it asked for them
+    if Protocol.FEATURE_PUSH in client_features.get(address, ()):
+        push_registry.register(username, address, sock, compact_chatmsg(address))
+
+def compact_chatmsg(address):
+    """Whether the client at address negotiated the compact Chatmsg encoding"""
+    return Protocol.FEATURE_COMPACT_CHATMSG in client_features.get(address, ())
 
-def handle_request(sock, address, msg_type, parsed_obj, sync_client):
+def handle_request(sock, address, msg_type, parsed_obj, sync_client, request_id=None):
+    """
+    Handle one client request, replies go to sock.
+    :param request_id: id from a v2 header, echoed in the replies
+    """
     match msg_type:
         case Protocol.REQ_LOGIN_1:
             username = parsed_obj
             connected_clients[address] = username
             # user exists
             if username in user_accounts:
-                send_data(sock, Protocol.RESP_USER_EXISTING, None)
+                send_data(sock, Protocol.RESP_USER_EXISTING, None, request_id=request_id)
             # user not exists, prompt to create account
             else:
                 user_accounts[username] = None
-                send_data(sock, Protocol.RESP_USER_NOT_EXISTING, None)
+                send_data(sock, Protocol.RESP_USER_NOT_EXISTING, None, request_id=request_id)
             return
             
         case Protocol.REQ_LOGIN_2:
-            pwd = parsed_obj
-            username = connected_clients[address]
-            # the behavior is creating account 
-            if user_accounts[username] is None:
-                user_accounts[username] = hash_pwd(pwd)
-                save_user_accounts_to_json(user_accounts)
-                # a successful login should response the list of accounts
-                send_data(sock, Protocol.RESP_LOGIN_SUCCESS, list(user_accounts.keys()))
-            # the behavior is validating account
-            else:
-                if check_pwd(pwd, user_accounts[username]):
-                    send_data(sock, Protocol.RESP_LOGIN_SUCCESS, list(user_accounts.keys()))
-                else:
-                    send_data(sock, Protocol.RESP_LOGIN_FAILED, None)
+            try:
+                username, created, pending = submit_login(address, parsed_obj)
+            except ServerBusy:
+                send_data(sock, Protocol.RESP_SERVER_BUSY, None, request_id=request_id)
+                return
+            finish_login(sock, address, username, created, pending.result(), sync_client, request_id)
             return
                 
+        case Protocol.REQ_RESUME_SESSION:
+            # reconnect, e.g. after a failover, with a cheap HMAC check instead of bcrypt
+            username = verify_token(parsed_obj, session_secret[0])
+            # the account may have been deleted since the token was issued
+            if username is None or user_accounts.get(username) is None:
+                send_data(sock, Protocol.RESP_LOGIN_FAILED, None, request_id=request_id)
+                return
+            connected_clients[address] = username
+            login_success(sock, address, username, request_id)
+            return
+
         case Protocol.REQ_SEND_MSG:
             recipient, content = parsed_obj
             username = connected_clients[address]
-            send_message(sender=username, recipient=recipient, content=content, sync_client=sync_client)
+            receipt = send_message(sender=username, recipient=recipient, content=content, sync_client=sync_client)
+            # tells the sender whether the recipient is online somewhere in the cluster
+            if Protocol.FEATURE_SEND_RECEIPTS in client_features.get(address, ()):
+                send_data(sock, Protocol.RESP_MESSAGE_SENT, receipt, request_id=request_id)
             return 
         
         case Protocol.REQ_READ_MSG:
@@ -178,13 +518,28 @@ def handle_request(sock, address, msg_type, parsed_obj, sync_client):
             friend = parsed_obj
             username = connected_clients[address]
             resp_list = list_messages(username, friend)
-            send_data(sock, Protocol.RESP_LIST_MESSAGES, resp_list)
+            send_data(sock, Protocol.RESP_LIST_MESSAGES, resp_list, compact_chatmsg(address), request_id=request_id)
+            return
+
+        case Protocol.REQ_LIST_MESSAGES_PAGE:
+            query = parsed_obj
+            username = connected_clients[address]
+            resp = list_messages_page(
+                username,
+                query["friend"],
+                limit=query.get("limit", DEFAULT_PAGE_SIZE),
+                before=query.get("before"),
+                after=query.get("after"),
+                before_id=query.get("before_id"),
+                after_id=query.get("after_id"),
+            )
+            send_data(sock, Protocol.RESP_LIST_MESSAGES_PAGE, resp, compact_chatmsg(address), request_id=request_id)
             return
 
         case Protocol.REQ_LIST_USERS:
             username = connected_clients[address]
             resp_list = list_users(username)
-            send_data(sock, Protocol.RESP_LIST_USERS, resp_list)
+            send_data(sock, Protocol.RESP_LIST_USERS, resp_list, request_id=request_id)
             return
         
         case Protocol.REQ_DELETE_MESSAGE:
@@ -195,7 +550,14 @@ def handle_request(sock, address, msg_type, parsed_obj, sync_client):
         
         case Protocol.REQ_DELETE_ACCOUNT:
             username = connected_clients[address]
-            delete_account(username)
+            delete_account(username, sync_client)
+            return
+
+        case Protocol.REQ_HELLO:
+            # features unknown to this server are left out, the client falls back to the default encoding
+            features = [f for f in parsed_obj if f in Protocol.FEATURES]
+            client_features[address] = set(features)
+            send_data(sock, Protocol.RESP_HELLO, features, request_id=request_id)
             return
 
         case Protocol.REQ_PING:
@@ -216,13 +578,17 @@ def client_thread_entry(client_socket, address, sync_client):
     
     handle_new_connection(address)
 
+    reader = FrameReader(client_socket)
+    # replies and pushes from other threads share the socket
+    sock = SerializedSocket(client_socket)
     try:
         while True:
-            msg_type, parsed_obj = recv_data(client_socket)
+            msg_type, parsed_obj, request_id = reader.read_request()
             if msg_type is None:
                 break
-            handle_request(client_socket, address, msg_type, parsed_obj, sync_client)
+            handle_request(sock, address, msg_type, parsed_obj, sync_client, request_id)
     except Exception as e:
         print(f"[ERROR] {e}")
     finally:
-        handle_disconnect(client_socket, address)
+        # also stops the writer thread of the pushes
+        handle_disconnect(sock, address)
@@ -0,0 +1,128 @@
+import hashlib
+import threading
+
+# number of leaf buckets, a power of two shared by every node of the cluster
+MERKLE_BUCKETS = 1024
+HASH_SIZE = 16
+
+
+def bucket_of(msg_id, buckets=MERKLE_BUCKETS):
+    """Leaf bucket of a message id"""
+    return int.from_bytes(hashlib.blake2b(msg_id.encode(), digest_size=8).digest(), 'big') & (buckets - 1)
+
+
+def message_digest(msg_id, timestamp, status):
+    return int.from_bytes(hashlib.blake2b(f"{msg_id}|{timestamp!r}|{status}".encode(), digest_size=HASH_SIZE).digest(), 'big')
+
+
+def tombstone_digest(msg_id):
+    return int.from_bytes(hashlib.blake2b(f"{msg_id}|deleted".encode(), digest_size=HASH_SIZE).digest(), 'big')
+
+
+class MerkleTree:
+    """
+    Hash tree summary of message_store and of the tombstones of deleted messages,
+    used by anti-entropy to find the buckets two replicas disagree on.
+
+    Messages are spread over MERKLE_BUCKETS leaves by a hash of their id. A leaf is
+    the XOR of the digests of its messages (id, timestamp, status) and tombstones,
+    so it is updated in O(1) on every change; every inner node is the XOR of its
+    two children. Nodes are numbered like a heap: 1 is the root, the children of
+    node i are 2i and 2i + 1, and the leaves are buckets..2 * buckets - 1.
+    Only message ids are kept, not the messages (cold ones are not objects at all),
+    so a message changes by removing the old version and adding the new one.
+    Buckets do not follow conversations, so the tree has its own lock.
+    """
+    def __init__(self, buckets=MERKLE_BUCKETS):
+        if buckets & (buckets - 1):
+            raise ValueError("The number of buckets must be a power of two")
+        self.buckets = buckets
+        self._leaves = [0] * buckets
+        self._messages = [set() for _ in range(buckets)]  # msg ids of each bucket
+        self._tombstones = [set() for _ in range(buckets)]
+        self._tree = None  # cached inner nodes, rebuilt after a change
+        self._lock = threading.RLock()
+
+    # digests are computed before taking the lock, it only covers the bucket update
+
+    def add(self, msg):
+        """Add a message, a message already in the tree is left as it is"""
+        bucket = bucket_of(msg.id, self.buckets)
+        digest = message_digest(msg.id, msg.timestamp, msg.status)
+        with self._lock:
+            entries = self._messages[bucket]
+            if msg.id not in entries:
+                entries.add(msg.id)
+                self._flip(bucket, digest)
+
+    def remove(self, msg):
+        """Remove a message, msg must be the version that was added"""
+        bucket = bucket_of(msg.id, self.buckets)
+        digest = message_digest(msg.id, msg.timestamp, msg.status)
+        with self._lock:
+            if msg.id in self._messages[bucket]:
+                self._messages[bucket].discard(msg.id)
+                self._flip(bucket, digest)
+
+    def mark_read(self, msg):
+        # called once the message went from unread to read
+        bucket = bucket_of(msg.id, self.buckets)
+        digest = message_digest(msg.id, msg.timestamp, "unread") ^ message_digest(msg.id, msg.timestamp, msg.status)
+        with self._lock:
+            if msg.id in self._messages[bucket]:
+                self._flip(bucket, digest)
+
+    def remove_user(self, username):
+        # the tree does not know who sent what, delete_account removes the user's messages one by one
+        pass
+
+    def clear(self):
+        """Forget the messages, tombstones are kept"""
+        with self._lock:
+            for bucket, entries in enumerate(self._messages):
+                entries.clear()
+                self._leaves[bucket] = 0
+                for msg_id in self._tombstones[bucket]:
+                    self._leaves[bucket] ^= tombstone_digest(msg_id)
+            self._tree = None
+
+    def add_tombstone(self, msg_id):
+        bucket = bucket_of(msg_id, self.buckets)
+        digest = tombstone_digest(msg_id)
+        with self._lock:
+            if msg_id not in self._tombstones[bucket]:
+                self._tombstones[bucket].add(msg_id)
+                self._flip(bucket, digest)
+
+    def remove_tombstone(self, msg_id):
+        bucket = bucket_of(msg_id, self.buckets)
+        digest = tombstone_digest(msg_id)
+        with self._lock:
+            if msg_id in self._tombstones[bucket]:
+                self._tombstones[bucket].discard(msg_id)
+                self._flip(bucket, digest)
+
+    def nodes(self):
+        """All node hashes as ints, indexed like a heap (index 0 is unused)"""
+        with self._lock:
+            if self._tree is None:
+                tree = [0] * self.buckets + self._leaves
+                for i in range(self.buckets - 1, 0, -1):
+                    tree[i] = tree[2 * i] ^ tree[2 * i + 1]
+                self._tree = tree
+            return self._tree
+
+    def hashes(self, node_ids):
+        """Hashes of the given nodes, as HASH_SIZE bytes each"""
+        with self._lock:
+            tree = self.nodes()
+            return [tree[i].to_bytes(HASH_SIZE, 'big') for i in node_ids]
+
+    def bucket(self, bucket):
+        """(message ids, tombstone ids) of a bucket"""
+        with self._lock:
+            return list(self._messages[bucket]), list(self._tombstones[bucket])
+
+    def _flip(self, bucket, digest):
+        self._leaves[bucket] ^= digest
+        self._tree = None
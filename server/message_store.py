@@ -0,0 +1,137 @@
+from collections.abc import MutableMapping
+from server.cold_store import ColdStore
+
+
+class StoreView:
+    """The messages of a MessageStore when view() was called, see MessageStore.view()"""
+    def __init__(self, hot, cold):
+        self._hot = hot
+        self._cold = cold
+
+    def __len__(self):
+        return len(self._hot) + len(self._cold)
+
+    def __iter__(self):
+        yield from self._hot
+        yield from self._cold
+
+
+class MessageStore(MutableMapping):
+    """
+    {msg_id: Chatmsg} of the handler, split in two tiers: recent messages are kept as
+    objects, the ones freeze() moves out are rows of a columnar ColdStore. The ids (and
+    the indexes built on them) stay in memory for every message, cold ones included.
+
+    Reading a cold message with [] or get() brings it back to the hot tier, since the
+    caller may change it (e.g. its status). peek(), values() and items() leave cold
+    messages where they are and hand out detached copies: the list paths use those.
+    Callers hold the handler lock of the messages' conversations, like for a dict.
+    """
+    def __init__(self):
+        self._hot = {}
+        self.cold = ColdStore()
+
+    def __getitem__(self, msg_id):
+        msg = self._hot.get(msg_id)
+        if msg is None:
+            msg = self.cold.pop(msg_id)
+            if msg is None:
+                raise KeyError(msg_id)
+            self._hot[msg_id] = msg
+        return msg
+
+    def __setitem__(self, msg_id, msg):
+        self.cold.discard(msg_id)
+        self._hot[msg_id] = msg
+
+    def __delitem__(self, msg_id):
+        if self._hot.pop(msg_id, None) is None and not self.cold.discard(msg_id):
+            raise KeyError(msg_id)
+
+    def __contains__(self, msg_id):
+        return msg_id in self._hot or msg_id in self.cold
+
+    def __iter__(self):
+        yield from self._hot
+        yield from self.cold
+
+    def __len__(self):
+        return len(self._hot) + len(self.cold)
+
+    def get(self, msg_id, default=None):
+        try:
+            return self[msg_id]
+        except KeyError:
+            return default
+
+    def pop(self, msg_id, *default):
+        msg = self._hot.pop(msg_id, None)
+        if msg is None:
+            msg = self.cold.pop(msg_id)
+        if msg is None:
+            if default:
+                return default[0]
+            raise KeyError(msg_id)
+        return msg
+
+    def peek(self, msg_id, default=None):
+        """The message without moving it between tiers, a detached copy when it is cold"""
+        msg = self._hot.get(msg_id)
+        if msg is None:
+            msg = self.cold.get(msg_id)
+        return default if msg is None else msg
+
+    def mark_read(self, msg_id):
+        """
+        Set an unread message to read, in place for a cold one.
+        :return: the message (a copy when cold) if it was unread, otherwise None
+        """
+        msg = self._hot.get(msg_id)
+        if msg is None:
+            return self.cold.mark_read(msg_id)
+        if msg.status != "unread":
+            return None
+        msg.status = "read"
+        return msg
+
+    def values(self):
+        yield from list(self._hot.values())
+        yield from self.cold.messages()
+
+    def view(self):
+        """
+        The messages stored now, to read once the caller released the handler lock:
+        only the references to the hot messages are copied, cold ones are built as the
+        view is iterated. Hot messages changed in place since show their new state.
+        """
+        return StoreView(list(self._hot.values()), self.cold.view())
+
+    def items(self):
+        for msg in self.values():
+            yield msg.id, msg
+
+    def clear(self):
+        self._hot.clear()
+        self.cold.clear()
+
+    def freeze(self, cutoff):
+        """
+        Move the messages older than cutoff (a timestamp) to the cold tier.
+        Run it while no handler touches the store, removed cold rows may be compacted.
+        :return: the number of messages moved
+        """
+        hot = {}
+        moved = 0
+        for msg_id, msg in self._hot.items():
+            if msg.timestamp < cutoff:
+                self.cold.add(msg)
+                moved += 1
+            else:
+                hot[msg_id] = msg
+        # a new dict, deleting the keys would leave the old one at its full size
+        self._hot = hot
+        self.cold.compact()
+        return moved
+
+    def stats(self):
+        return {"hot": len(self._hot), "cold": len(self.cold), "cold_bytes": self.cold.nbytes()}
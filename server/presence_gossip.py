@@ -0,0 +1,35 @@
+import time
+import grpc
+from generated.sync_pb2 import Presence
+from generated.sync_pb2_grpc import PresenceGossipStub
+from server.handler import presence, node_name
+
+
+def exchange_presence(stub, rpc_timeout=2.0):
+    """Send our online users to a peer and record the ones it reports"""
+    reply = stub.Exchange(Presence(node=node_name[0], usernames=presence.local_usernames()), timeout=rpc_timeout)
+    presence.update(reply.node, reply.usernames)
+
+
+def run_presence_gossip(peer_addrs, interval_s=2, rpc_timeout=2.0):
+    """
+    Swap online users with every peer from time to time. Each round is one small
+    RPC per peer; reports of peers that stop answering expire in the presence index.
+    """
+    peers = [(addr, PresenceGossipStub(grpc.insecure_channel(addr))) for addr in peer_addrs]
+    # only report a peer going down or coming back, not every failed round
+    down = set()
+    while True:
+        time.sleep(interval_s)
+        for addr, stub in peers:
+            try:
+                exchange_presence(stub, rpc_timeout)
+            except grpc.RpcError as e:
+                if addr not in down:
+                    print(f"Presence gossip with {addr} failed: {e.code()}")
+                    down.add(addr)
+                continue
+            if addr in down:
+                print(f"👋 Presence gossip with {addr} restored")
+                down.discard(addr)
+        presence.expire()
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import Counter
+
+
+class PresenceIndex:
+    """
+    Cluster-wide view of who is online: the users logged in here (one count per
+    session, with or without push) and the users the peers reported through the
+    presence gossip.
+
+    Every lookup is a dict access, nothing scans the connections. A peer report
+    replaces that peer's previous one and expires after ttl_s, so the users of a node
+    that stopped gossiping (crashed, partitioned) go offline.
+    """
+    def __init__(self, ttl_s=15.0):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._sessions = {}  # {address: username} of the sessions here
+        self._local = Counter()  # {username: number of sessions here}
+        self._remote = {}  # {node: (frozenset(usernames), received_at)}
+        self._counts = Counter()  # {username: number of peers reporting it}
+
+    def login(self, username, address):
+        """Count the session at address, a previous login on that connection is replaced"""
+        with self._lock:
+            self._logout(address)
+            self._sessions[address] = username
+            self._local[username] += 1
+
+    def logout(self, address):
+        with self._lock:
+            self._logout(address)
+
+    def update(self, node, usernames, now=None):
+        """Replace the online users reported by node"""
+        usernames = frozenset(usernames)
+        with self._lock:
+            old, _ = self._remote.get(node, (frozenset(), None))
+            self._counts.subtract(old - usernames)
+            self._counts.update(usernames - old)
+            self._remote[node] = (usernames, time.time() if now is None else now)
+            self._drop_zero(old - usernames)
+
+    def expire(self, now=None):
+        """Forget the reports older than ttl_s, returns the nodes dropped"""
+        cutoff = (time.time() if now is None else now) - self.ttl_s
+        with self._lock:
+            stale = [node for node, (_, received_at) in self._remote.items() if received_at < cutoff]
+            for node in stale:
+                usernames, _ = self._remote.pop(node)
+                self._counts.subtract(usernames)
+                self._drop_zero(usernames)
+        return stale
+
+    def is_online(self, username):
+        """Whether the user is logged in on this node or on any peer"""
+        with self._lock:
+            return username in self._local or username in self._counts
+
+    def online_elsewhere(self, username):
+        with self._lock:
+            return username in self._counts
+
+    def local_usernames(self):
+        with self._lock:
+            return list(self._local)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._local.clear()
+            self._remote.clear()
+            self._counts.clear()
+
+    def _logout(self, address):
+        username = self._sessions.pop(address, None)
+        if username is not None:
+            self._local[username] -= 1
+            if self._local[username] <= 0:
+                del self._local[username]
+
+    def _drop_zero(self, usernames):
+        for username in usernames:
+            if self._counts[username] <= 0:
+                del self._counts[username]
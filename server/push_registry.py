@@ -0,0 +1,151 @@
+import socket
+import threading
+from collections import defaultdict, deque
+from common.protocol import Protocol
+from common.utils import encode_frame
+
+# bytes of pushes a connection may have waiting, beyond that the client does not keep up and is disconnected
+MAX_PENDING_PUSH_BYTES = 1024 * 1024
+
+
+class SerializedSocket:
+    """
+    Socket facade whose sendall calls do not interleave: replies come from the
+    connection's own thread, pushes from a writer thread started with the first push.
+    """
+    def __init__(self, sock, max_pending=MAX_PENDING_PUSH_BYTES):
+        self._sock = sock
+        self._lock = threading.Lock()
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._pushes = deque()
+        self._pending = 0  # bytes in _pushes
+        self._writer = None
+        self._closed = False
+
+    def sendall(self, data):
+        with self._lock:
+            self._sock.sendall(data)
+
+    def push(self, data):
+        """
+        Queue data for the writer thread, without blocking the caller on a slow client.
+        :return: False when the connection is closed or more than max_pending bytes are waiting,
+                 the connection is then shut down
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            if self._pending + len(data) > self.max_pending:
+                print("⚠️ Client does not keep up with its pushes, disconnecting it")
+                self._closed = True
+                self._cond.notify()
+                self._shutdown()
+                return False
+            self._pushes.append(data)
+            self._pending += len(data)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pushes, daemon=True)
+                self._writer.start()
+            self._cond.notify()
+        return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._sock.close()
+
+    def _write_pushes(self):
+        while True:
+            with self._cond:
+                while not self._pushes and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                data = self._pushes.popleft()
+            try:
+                self.sendall(data)
+            except OSError:
+                return  # the connection's thread notices the broken socket
+            with self._cond:
+                self._pending -= len(data)
+
+    def _shutdown(self):
+        # wakes the connection's thread, which then disconnects as usual
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class PushRegistry:
+    """
+    Live connections of each logged-in user {username: {address: (sock, compact)}},
+    so new messages are written straight to the recipient instead of waiting for a poll.
+    Only authenticated connections are registered, a bare REQ_LOGIN_1 receives nothing.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = defaultdict(dict)
+        self._addresses = {}  # {address: username}
+
+    def register(self, username, address, sock, compact=False):
+        """:param compact: the connection negotiated the compact Chatmsg encoding"""
+        with self._lock:
+            self._remove(address)
+            self._users[username][address] = (sock, compact)
+            self._addresses[address] = username
+
+    def unregister(self, address):
+        with self._lock:
+            self._remove(address)
+
+    def is_online(self, username):
+        with self._lock:
+            return username in self._users
+
+    def connections(self, username):
+        """Number of live connections of the user"""
+        with self._lock:
+            return len(self._users.get(username, ()))
+
+    def usernames(self):
+        with self._lock:
+            return list(self._users)
+
+    def push(self, msgs):
+        """
+        Queue each message for the live connections of its recipient, connections
+        that are closed or do not keep up are dropped (their handler notices it itself).
+        Call it without holding the handler locks.
+        :return: set of the recipients reached
+        """
+        by_recipient = defaultdict(list)
+        for msg in msgs:
+            by_recipient[msg.recipient].append(msg)
+        with self._lock:
+            targets = [(username, address, sock, compact)
+                       for username in by_recipient
+                       for address, (sock, compact) in self._users.get(username, {}).items()]
+
+        reached = set()
+        for username, address, sock, compact in targets:
+            if sock.push(encode_frame(Protocol.PUSH_NEW_MESSAGES, by_recipient[username], compact)):
+                reached.add(username)
+            else:
+                self.unregister(address)
+        return reached
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._addresses.clear()
+
+    def _remove(self, address):
+        username = self._addresses.pop(address, None)
+        if username is None:
+            return
+        self._users[username].pop(address, None)
+        if not self._users[username]:
+            del self._users[username]
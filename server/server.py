@@ -1,18 +1,42 @@
+import asyncio
 import socket
 import sys
 import threading
 import time
-from server.handler import client_thread_entry, message_store, messages, node_name, user_accounts
-from common.utils import load_from_file, save_to_file, load_user_accounts_from_json
+from server.handler import client_thread_entry, lock, message_store, messages, node_name, account_store, accounts_filename, indexes, rebuild_indexes, log_writer, log_format, log_filename, take_snapshot, change_log, change_log_filename, watermarks, tombstones, tombstone_ttl_s, cold_after_s, segments_dirname, auth_executor, session_secret, session_ttl_s, presence
+from common.utils import load_from_file, snapshot_filename
+from common.log_writer import LogWriter
 import signal
 from server.config_loader import ServerConfig, parse_cli_args
 from server.grpc_sync import run_grpc_server
 from server.grpc_client import SyncClient
+from server.async_server import serve_asyncio
+from server.compaction import run_compactor
+from server.stats_reporter import run_stats_reporter
+from server.change_log import ChangeLog
+from server.anti_entropy import run_anti_entropy
+from server.presence_gossip import run_presence_gossip
+from server.auth_executor import AuthExecutor
+from server.cold_store import ColdStore
+from server.content_segments import ContentSegments
 
 
 def signal_handler(sig, frame):
     print("\nCtrl+C pressed. Exiting...")
+    # a change log that was not closed gets a new epoch on restart
+    if change_log[0] is not None:
+        change_log[0].close()
     sys.exit(0)
+
+def serve_threaded(tcp_host, tcp_port, sync_client):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind((tcp_host, tcp_port))
+    server_socket.listen(5)
+    print(f"🟢 Server listening on {tcp_host}:{tcp_port}")
+    while True:
+        client_socket, addr = server_socket.accept()
+        t = threading.Thread(target=client_thread_entry, args=(client_socket, addr, sync_client))
+        t.start()
     
 def start_server():
     # Parse command-line arguments
@@ -26,6 +50,42 @@ def start_server():
         tcp_port = current_node["tcp"]["port"]
         grpc_port = current_node["grpc"]["port"]
         node_name[0] = current_node['name']
+        log_format[0] = config.get_log_format(args.node)
+
+        # long-lived writer for this node's log, shared by the tcp handlers and the sync service
+        storage = config.get_storage_config()
+        log_writer[0] = LogWriter(
+            log_filename(),
+            policy=storage["fsync_policy"],
+            interval_ms=storage["fsync_interval_ms"],
+        )
+        # snapshots move older messages out of the object store into columns
+        cold_after_s[0] = storage["cold_after_s"]
+        if storage["content_segments"]:
+            # the cold store is still empty, its contents go to files paged in on demand
+            message_store.cold = ColdStore(ContentSegments(segments_dirname()))
+        # numbers the changes made here, so restarting peers only fetch what they missed
+        replication = config.get_replication_config()
+        tombstone_ttl_s[0] = replication["tombstone_ttl_s"]
+        change_log[0] = ChangeLog(
+            change_log_filename(),
+            node_name[0],
+            retain=replication["change_log_retain"],
+            policy=storage["fsync_policy"],
+            interval_ms=storage["fsync_interval_ms"],
+        )
+
+        # bcrypt runs in worker processes, logins beyond max_pending are turned away
+        auth = config.get_auth_config()
+        auth_executor[0] = AuthExecutor(workers=auth["workers"], max_pending=auth["max_pending"])
+
+        # every node signs session tokens with the same secret, a client resumes on any of them
+        session = config.get_session_config()
+        if session["secret"]:
+            session_secret[0] = session["secret"].encode()
+        else:
+            print("⚠️ No session secret configured, sessions can only be resumed on this node")
+        session_ttl_s[0] = session["ttl_s"]
 
         # start grpc server for sync  
         grpc_thread = threading.Thread(
@@ -39,24 +99,72 @@ def start_server():
         peer_addrs = config.get_peer_grpc_addrs(args.node) 
         peer_nodes = config.get_peer_nodes(args.node)
         peer_info = [f"{n['address']} ({n['desc']})" for n in peer_nodes]
-        sync_client = SyncClient(peer_addrs)
+        sync_client = SyncClient(
+            peer_addrs,
+            queue_size=replication["queue_size"],
+            rpc_timeout=replication["rpc_timeout_s"],
+            backoff=replication["retry_backoff_s"],
+            backoff_max=replication["retry_backoff_max_s"],
+            batch_window=replication["batch_window_ms"] / 1000.0,
+            batch_max=replication["batch_max_packages"],
+            chunk_size=replication["full_sync_chunk_size"],
+            change_log=change_log[0],
+        )
+        # accounts are loaded once and kept in memory, peers send their changes over gRPC
+        account_store.open(accounts_filename())
         # sync message from other nodes
-        load_from_file(message_store, messages, f'{node_name[0]}.json')
+        load_from_file(message_store, messages, log_filename(), indexes,
+                       snapshot=snapshot_filename(log_filename()), watermarks=watermarks, tombstones=tombstones)
         print(f"🔄 Syncing with peer nodes: {', '.join(peer_info)}")
         # sleep 3s to let other nodes' grpc server start
         time.sleep(3)
-        sync_client.sync_on_startup(message_store)
-        save_to_file(message_store, f'{node_name[0]}.json', 'overwrite')
+        # only the changes made since our watermarks, full data from peers that cannot tell
+        # every stripe is held while a chunk is applied, IncrementalSync may already be running
+        sync_client.catch_up(message_store, watermarks, tombstones, account_store, lock=lock)
+        # catch-up only fills message_store
+        with lock:
+            rebuild_indexes()
+        take_snapshot()
+
+        # fold the log into a new snapshot from time to time
+        compactor_thread = threading.Thread(
+            target=run_compactor,
+            args=(take_snapshot, log_writer[0], storage["snapshot_interval_s"], storage["snapshot_min_records"]),
+            daemon=True
+        )
+        compactor_thread.start()
+
+        # group commit metrics, to tune fsync_policy and fsync_interval_ms,
+        # and hash time and queue depth of the logins, to size the auth pool
+        if storage["stats_interval_s"]:
+            stats_thread = threading.Thread(
+                target=run_stats_reporter,
+                args=([("log writer", log_writer[0].stats), ("auth", auth_executor[0].stats)], storage["stats_interval_s"]),
+                daemon=True
+            )
+            stats_thread.start()
+
+        # compare hash trees with the peers and repair what replication missed
+        anti_entropy_thread = threading.Thread(
+            target=run_anti_entropy,
+            args=(peer_addrs, replication["anti_entropy_interval_s"], replication["rpc_timeout_s"]),
+            daemon=True
+        )
+        anti_entropy_thread.start()
+
+        # tell the peers who is online here, so they know whether a recipient can get a message now
+        presence.ttl_s = replication["presence_ttl_s"]
+        presence_thread = threading.Thread(
+            target=run_presence_gossip,
+            args=(peer_addrs, replication["presence_interval_s"], replication["rpc_timeout_s"]),
+            daemon=True
+        )
+        presence_thread.start()
 
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.bind((tcp_host, tcp_port))
-        server_socket.listen(5)
-        print(f"🟢 Server listening on {tcp_host}:{tcp_port}")
-        while True:
-            client_socket, addr = server_socket.accept()
-            load_user_accounts_from_json(user_accounts)
-            t = threading.Thread(target=client_thread_entry, args=(client_socket, addr, sync_client))
-            t.start()
+        if args.mode == "asyncio":
+            asyncio.run(serve_asyncio(tcp_host, tcp_port, sync_client, workers=args.workers))
+        else:
+            serve_threaded(tcp_host, tcp_port, sync_client)
 
     except Exception as e:
         # Handle startup failure
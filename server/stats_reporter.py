@@ -0,0 +1,23 @@
+import time
+
+
+def format_stats(stats):
+    """One line of the scalar metrics of a stats() dict, lists such as recent_batches are left out"""
+    parts = []
+    for key, value in stats.items():
+        if isinstance(value, float):
+            parts.append(f"{key}={value:.1f}")
+        elif isinstance(value, (int, str)):
+            parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+
+def run_stats_reporter(sources, interval_s=60):
+    """
+    Print the metrics of the node from time to time.
+    :param sources: [(name, stats function)], each function returns a dict like LogWriter.stats()
+    """
+    while True:
+        time.sleep(interval_s)
+        for name, stats in sources:
+            print(f"📊 {name}: {format_stats(stats())}")
@@ -0,0 +1,53 @@
+import threading
+import zlib
+from contextlib import contextmanager
+
+
+class StripedLock:
+    """
+    Fixed set of locks standing in for one global lock: a key (e.g. a conversation)
+    is guarded by the stripe it hashes to, so operations on independent keys run
+    in parallel.
+
+    Locking order: stripes are always taken in increasing index order, whether for
+    one key, several keys or all of them, so no two holders can deadlock.
+    Using the object itself as a context manager (`with lock:`) holds every stripe,
+    for operations on the whole state such as delete_account or a snapshot.
+    """
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def stripe(self, key):
+        """Stripe index of a key, stable across runs (unlike hash() of a str)"""
+        return zlib.crc32(repr(key).encode()) % len(self._locks)
+
+    def acquire(self, keys):
+        """
+        Acquire the stripes of the given keys
+        :return: the stripe indexes held, to pass to release()
+        """
+        stripes = sorted({self.stripe(key) for key in keys})
+        for i in stripes:
+            self._locks[i].acquire()
+        return stripes
+
+    def release(self, stripes):
+        for i in reversed(stripes):
+            self._locks[i].release()
+
+    @contextmanager
+    def hold(self, keys):
+        stripes = self.acquire(keys)
+        try:
+            yield
+        finally:
+            self.release(stripes)
+
+    def __enter__(self):
+        for lock in self._locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        for lock in reversed(self._locks):
+            lock.release()
@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+
+class UnreadCounter:
+    """
+    Unread message counters {recipient: {sender: count}}, maintained incrementally
+    so REQ_LIST_USERS does not have to look at any message.
+    """
+    def __init__(self):
+        self._counts = defaultdict(dict)
+
+    def add(self, msg):
+        if msg.status == "unread":
+            self._inc(msg.recipient, msg.sender, 1)
+
+    def remove(self, msg):
+        if msg.status == "unread":
+            self._inc(msg.recipient, msg.sender, -1)
+
+    def mark_read(self, msg):
+        # called once the message went from unread to read
+        self._inc(msg.recipient, msg.sender, -1)
+
+    def remove_user(self, username):
+        self._counts.pop(username, None)
+        for recipient in list(self._counts.keys()):
+            counts = self._counts[recipient]
+            counts.pop(username, None)
+            if not counts:
+                del self._counts[recipient]
+
+    def clear(self):
+        self._counts.clear()
+
+    def get(self, recipient, sender):
+        counts = self._counts.get(recipient)
+        if counts is None:
+            return 0
+        return counts.get(sender, 0)
+
+    def _inc(self, recipient, sender, delta):
+        counts = self._counts[recipient]
+        count = counts.get(sender, 0) + delta
+        if count > 0:
+            counts[sender] = count
+        else:
+            # the recipient's dict is kept, other conversations of the recipient may be updating it concurrently
+            counts.pop(sender, None)
+
+    @staticmethod
+    def recount(message_store):
+        """Count unread messages from scratch, {recipient: {sender: count}}"""
+        counts = defaultdict(dict)
+        for msg in message_store.values():
+            if msg.status == "unread":
+                counts[msg.recipient][msg.sender] = counts[msg.recipient].get(msg.sender, 0) + 1
+        return counts
+
+    def verify(self, message_store):
+        """
+        Consistency check against a full recount.
+        :return: list of (recipient, sender, expected, actual), empty when consistent
+        """
+        expected = self.recount(message_store)
+        mismatches = []
+        pairs = {(r, s) for r, counts in expected.items() for s in counts}
+        pairs |= {(r, s) for r, counts in self._counts.items() for s in counts}
+        for recipient, sender in sorted(pairs):
+            want = expected.get(recipient, {}).get(sender, 0)
+            have = self.get(recipient, sender)
+            if want != have:
+                mismatches.append((recipient, sender, want, have))
+        return mismatches
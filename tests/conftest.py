@@ -0,0 +1,62 @@
+import pytest
+
+from common.utils import recv_data
+from server import handler
+
+
+class FakeSocket:
+    """Stands in for a client connection, what the server sends is read back with recv_data"""
+    def __init__(self):
+        self.sent = b""
+
+    def sendall(self, data):
+        self.sent += data
+
+    def push(self, data):
+        self.sendall(data)
+        return True
+
+    def response(self):
+        return recv_data(self)
+
+    def recv_into(self, buf):
+        n = min(len(buf), len(self.sent))
+        buf[:n], self.sent = self.sent[:n], self.sent[n:]
+        return n
+
+    def close(self):
+        pass
+
+
+class FakeSyncClient:
+    """Stands in for SyncClient, records the packages instead of sending them"""
+    def __init__(self):
+        self.packages = []
+
+    def create_data_package(self, new_msgs=[], deleted_ids=[], read_ids=[], accounts=[], deleted_at=[]):
+        return {"new_msgs": list(new_msgs), "deleted_ids": list(deleted_ids), "read_ids": list(read_ids), "accounts": list(accounts)}
+
+    def incremental_sync(self, data_package):
+        self.packages.append(data_package)
+
+
+@pytest.fixture
+def server_state(tmp_path, monkeypatch):
+    """The handler module of a node named test_node, its state is reset afterwards"""
+    # handlers append to <node>.json in the working directory
+    monkeypatch.chdir(tmp_path)
+    name = handler.node_name[0]
+    handler.node_name[0] = "test_node"
+    yield handler
+    handler.node_name[0] = name
+    handler.message_store.clear()
+    handler.messages.clear()
+    for index in handler.indexes:
+        index.clear()
+    handler.expire_tombstones(float("-inf"))  # drop them all
+    handler.account_store.clear()
+    handler.connected_clients.clear()
+    handler.client_features.clear()
+    handler.push_registry.clear()
+    handler.presence.clear()
+    handler.auth_executor[0] = None
@@ -0,0 +1,138 @@
+import json
+import pytest
+
+from common.utils import save_user_accounts_to_json
+from generated.sync_pb2 import DataPackage
+from server.account_store import AccountStore
+from server.change_log import ChangeLog
+from server.grpc_client import SyncClient, apply_package, merge_packages
+from server.grpc_sync import SyncService
+
+
+def test_changes_survive_restart(tmp_path):
+    filename = str(tmp_path / "n1.accounts.json")
+    store = AccountStore({})
+    store.open(filename)
+    store.put("alice", "h1")
+    store.put("bob", "h2")
+    store.delete("bob")
+    store.close()
+
+    accounts = {}
+    store = AccountStore(accounts)
+    store.open(filename)
+    assert accounts == {"alice": "h1"}
+    # bob's deletion is remembered
+    assert {r["username"]: r["hash"] for r in store.records()} == {"alice": "h1", "bob": None}
+    store.close()
+
+
+def test_journal_is_folded_into_snapshot(tmp_path):
+    filename = str(tmp_path / "n1.accounts.json")
+    store = AccountStore({}, compact_after=3)
+    store.open(filename)
+    for i in range(4):
+        store.put(f"u{i}", "h")
+    store.close()
+
+    with open(filename) as f:
+        assert len(f.readlines()) == 1
+    with open(tmp_path / "n1.accounts.snapshot.json") as f:
+        assert len(json.load(f)["accounts"]) == 3
+
+    accounts = {}
+    AccountStore(accounts).open(filename)
+    assert sorted(accounts) == ["u0", "u1", "u2", "u3"]
+
+
+def test_torn_record_is_dropped(tmp_path):
+    filename = tmp_path / "n1.accounts.json"
+    filename.write_text(json.dumps({"username": "alice", "hash": "h", "timestamp": 1.0}) + '\n{"username": "bo')
+    accounts = {}
+    store = AccountStore(accounts)
+    store.open(str(filename))
+    store.put("carol", "h")
+    store.close()
+
+    accounts = {}
+    AccountStore(accounts).open(str(filename))
+    assert sorted(accounts) == ["alice", "carol"]
+
+
+def test_corrupted_record_before_the_end_raises(tmp_path):
+    filename = tmp_path / "n1.accounts.json"
+    lines = [json.dumps({"username": "alice", "hash": "h", "timestamp": 1.0}), '{"username": "bo',
+             json.dumps({"username": "carol", "hash": "h", "timestamp": 2.0})]
+    filename.write_text('\n'.join(lines) + '\n')
+    with pytest.raises(ValueError, match="Corrupted record 2 of 3"):
+        AccountStore({}).open(str(filename))
+    # the journal is left as it was
+    assert filename.read_text() == '\n'.join(lines) + '\n'
+
+
+def test_legacy_file_is_imported_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    save_user_accounts_to_json({"alice": "h"})
+    accounts = {}
+    store = AccountStore(accounts)
+    store.open("n1.accounts.json")
+    assert accounts == {"alice": "h"}
+    # any real change is newer than the imported version
+    store.delete("alice")
+    store.close()
+
+    accounts = {}
+    AccountStore(accounts).open("n1.accounts.json")
+    assert accounts == {}
+
+
+def test_newest_change_wins():
+    accounts = {}
+    store = AccountStore(accounts)
+    store.put("alice", "h1", timestamp=10.0)
+    applied = store.apply([
+        {"username": "alice", "hash": "old", "timestamp": 5.0},
+        {"username": "bob", "hash": "h2", "timestamp": 5.0},
+        {"username": "alice", "hash": None, "timestamp": 11.0},
+    ])
+    assert [r["username"] for r in applied] == ["bob", "alice"]
+    assert accounts == {"bob": "h2"}
+    # a create older than the deletion does not bring the account back
+    store.apply([{"username": "alice", "hash": "h1", "timestamp": 10.5}])
+    assert "alice" not in accounts
+
+
+@pytest.fixture
+def accounts_state(server_state):
+    return server_state
+
+
+def test_account_changes_are_replicated(accounts_state):
+    client = SyncClient([])
+    sent = []
+    client.incremental_sync = sent.append
+    accounts_state.save_account("alice", "h1", client)
+    accounts_state.delete_account("alice", client)
+    package = merge_packages(sent)
+    assert [(a.username, a.password_hash) for a in package.accounts] == [("alice", "h1"), ("alice", "")]
+
+    # a peer applies them through the sync service
+    accounts_state.account_store.clear()
+    SyncService().IncrementalSync(DataPackage(accounts=package.accounts[:1]), None)
+    assert accounts_state.user_accounts == {"alice": "h1"}
+    SyncService().IncrementalSync(DataPackage(accounts=package.accounts[1:]), None)
+    assert accounts_state.user_accounts == {}
+
+
+def test_accounts_go_through_change_log_and_catch_up(tmp_path):
+    log = ChangeLog(str(tmp_path / "n1.changes.json"), "n1")
+    client = SyncClient([], change_log=log)
+    client.incremental_sync(client.create_data_package(accounts=[{"username": "alice", "hash": "h", "timestamp": 1.0}]))
+    log.close()
+
+    log = ChangeLog(str(tmp_path / "n1.changes.json"), "n1")
+    [chunk] = log.since(log.epoch, 0)
+    accounts = {}
+    apply_package({}, chunk, account_store=AccountStore(accounts))
+    assert accounts == {"alice": "h"}
+    log.close()
@@ -0,0 +1,226 @@
+from collections import defaultdict, deque
+from concurrent import futures
+import time
+import grpc
+import pytest
+
+from common.message import Chatmsg
+from common.utils import load_from_file, snapshot_filename
+from generated import sync_pb2_grpc
+from generated.sync_pb2 import BucketsRequest, DataPackage, TreeNodes, TreeNodesRequest
+from server import handler
+from server.anti_entropy import differing_buckets, repair, sync_with_peer
+from server.grpc_client import SyncClient, iter_chunks
+from server.grpc_sync import AntiEntropyService
+from server.merkle_tree import MerkleTree, bucket_of
+
+
+def make_msg(msg_id, status="unread", timestamp=1.0):
+    return Chatmsg("alice", "bob", msg_id, msg_id=msg_id, timestamp=timestamp, status=status)
+
+
+def test_tree_is_order_independent():
+    a, b = MerkleTree(), MerkleTree()
+    msgs = [make_msg(f"m{i}") for i in range(50)]
+    for msg in msgs:
+        a.add(msg)
+    for msg in reversed(msgs):
+        b.add(msg)
+    assert a.nodes()[1] == b.nodes()[1] != 0
+
+    a.remove(msgs[3])
+    assert a.nodes()[1] != b.nodes()[1]
+    a.add(msgs[3])
+    assert a.nodes()[1] == b.nodes()[1]
+
+
+def test_read_status_and_tombstones_change_the_hash():
+    tree = MerkleTree()
+    msg = make_msg("m1")
+    tree.add(msg)
+    unread = tree.nodes()[1]
+    msg.status = "read"
+    tree.mark_read(msg)
+    assert tree.nodes()[1] != unread
+
+    tree.remove(msg)
+    assert tree.nodes()[1] == 0
+    tree.add_tombstone("m1")
+    assert tree.nodes()[1] != 0
+    # clear forgets the messages only
+    tree.add(make_msg("m2"))
+    tree.clear()
+    assert tree.bucket(bucket_of("m1")) == ([], ["m1"])
+    tree.remove_tombstone("m1")
+    assert tree.nodes()[1] == 0
+
+
+def test_differing_buckets_fetches_only_differing_subtrees():
+    local, remote = MerkleTree(), MerkleTree()
+    for i in range(500):
+        local.add(make_msg(f"m{i}"))
+        remote.add(make_msg(f"m{i}"))
+    remote.add(make_msg("extra"))
+    local.add_tombstone("gone")
+
+    fetched = []
+
+    def fetch(node_ids):
+        fetched.extend(node_ids)
+        return [remote.nodes()[i] for i in node_ids]
+
+    diff = differing_buckets(local.nodes(), fetch, local.buckets)
+    assert sorted(diff) == sorted({bucket_of("extra"), bucket_of("gone")})
+    # root, then 16 descendants per differing node for each of the three steps down
+    assert len(fetched) <= 1 + 2 * (16 + 16 + 4)
+    assert differing_buckets(remote.nodes(), lambda ids: [remote.nodes()[i] for i in ids], remote.buckets) == []
+
+
+class FakePeer(sync_pb2_grpc.AntiEntropyServicer):
+    """A replica with its own store, served the way AntiEntropyService does"""
+    def __init__(self, msgs, dead):
+        self.tree = MerkleTree()
+        self.msgs = {}
+        for msg in msgs:
+            self.add(msg)
+        for msg_id in dead:
+            self.tree.add_tombstone(msg_id)
+        self.buckets_asked = []
+
+    def add(self, msg):
+        self.msgs[msg.id] = msg
+        self.tree.add(msg)
+
+    def GetTreeNodes(self, request, context):
+        return TreeNodes(hashes=self.tree.hashes(request.nodes))
+
+    def GetBuckets(self, request, context):
+        self.buckets_asked.extend(request.ids)
+        for bucket in request.ids:
+            ids, dead = self.tree.bucket(bucket)
+            yield from iter_chunks([self.msgs[i] for i in ids], SyncClient([])._convert_message)
+            yield DataPackage(deleted_ids=dead)
+
+
+@pytest.fixture
+def node(server_state):
+    servers = []
+
+    def serve(peer):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        sync_pb2_grpc.add_AntiEntropyServicer_to_server(peer, server)
+        # any free port, a fixed one may be taken by an outgoing connection
+        port = server.add_insecure_port("[::]:0")
+        server.start()
+        servers.append(server)
+        return sync_pb2_grpc.AntiEntropyStub(grpc.insecure_channel(f"localhost:{port}"))
+
+    yield serve
+    for server in servers:
+        server.stop(0)
+
+
+def test_sync_with_peer_repairs_divergence(node):
+    for msg in (make_msg("m1"), make_msg("m3"), make_msg("m4")):
+        handler.message_store[msg.id] = msg
+    handler.rebuild_indexes()
+    shared = [make_msg(f"s{i}") for i in range(200)]
+    for msg in shared:
+        handler.message_store[msg.id] = msg
+        handler.index_add(msg)
+
+    peer = FakePeer(
+        [make_msg("m1", status="read"), make_msg("m2")] + [make_msg(f"s{i}") for i in range(200)],
+        dead=["m3"],
+    )
+    stub = node(peer)
+    diff, repaired = sync_with_peer(stub)
+
+    assert diff == len({bucket_of(i) for i in ("m1", "m2", "m3", "m4")})
+    assert set(peer.buckets_asked) == {bucket_of(i) for i in ("m1", "m2", "m3", "m4")}
+    assert repaired == 3
+    assert handler.message_store["m1"].status == "read"
+    assert "m2" in handler.message_store
+    assert "m3" not in handler.message_store and "m3" in handler.tombstones
+    # only the peer lacks m4, it pulls it in its own round
+    assert "m4" in handler.message_store
+    assert handler.check_unread_counters() == []
+
+    # a tombstone keeps the message from coming back
+    handler.message_store.pop("m4")
+    handler.index_remove(make_msg("m4"))
+    handler.add_tombstones(["m4"])
+    peer.add(make_msg("m4"))
+    peer.tree.add_tombstone("m4")
+    sync_with_peer(stub)
+    assert "m4" not in handler.message_store
+
+
+def test_service_serves_local_tree(node):
+    for i in range(10):
+        msg = make_msg(f"m{i}")
+        handler.message_store[msg.id] = msg
+        handler.index_add(msg)
+    handler.add_tombstones(["gone"])
+    service = AntiEntropyService()
+
+    reply = service.GetTreeNodes(TreeNodesRequest(buckets=handler.merkle_tree.buckets, nodes=[1]), None)
+    assert int.from_bytes(reply.hashes[0], 'big') == handler.merkle_tree.nodes()[1]
+
+    chunks = list(service.GetBuckets(BucketsRequest(buckets=handler.merkle_tree.buckets, ids=[bucket_of("m1"), bucket_of("gone")]), None))
+    assert "m1" in {m.id for c in chunks for m in c.messages}
+    assert "gone" in {i for c in chunks for i in c.deleted_ids}
+
+
+def test_delete_account_restores_the_root(node):
+    kept = Chatmsg("carol", "dave", "x", msg_id="x", timestamp=1.0)
+    handler.message_store[kept.id] = kept
+    handler.message_ids(kept.recipient, kept.sender).append(kept.id)
+    handler.index_add(kept)
+    root = handler.merkle_tree.nodes()[1]
+    tombstones = MerkleTree()
+
+    for msg in (make_msg("m1"), Chatmsg("bob", "carol", "y", msg_id="y", timestamp=1.0)):
+        handler.message_store[msg.id] = msg
+        handler.message_ids(msg.recipient, msg.sender).append(msg.id)
+        handler.index_add(msg)
+        tombstones.add_tombstone(msg.id)
+    handler.delete_account("bob", SyncClient([]))
+
+    assert list(handler.message_store) == ["x"]
+    # the tree holds kept and the tombstones of the deleted messages
+    assert handler.merkle_tree.nodes()[1] == root ^ tombstones.nodes()[1]
+
+
+@pytest.mark.parametrize("ext", ["json", "binlog"])
+def test_deletion_time_survives_a_restart(node, ext):
+    handler.log_format[0] = "binary" if ext == "binlog" else "json"
+    try:
+        for msg_id in ("m1", "m2"):
+            msg = make_msg(msg_id)
+            handler.message_store[msg.id] = msg
+            handler.message_ids(msg.recipient, msg.sender).append(msg.id)
+            handler.index_add(msg)
+        handler.delete_message("alice", "m1", SyncClient([]))
+        handler.take_snapshot()
+        handler.delete_message("alice", "m2", SyncClient([]))
+        deleted_at = dict(handler.tombstones)
+
+        tombstones = {}
+        load_from_file({}, defaultdict(lambda: defaultdict(deque)), handler.log_filename(),
+                       snapshot=snapshot_filename(handler.log_filename()), tombstones=tombstones)
+        assert tombstones == deleted_at
+    finally:
+        handler.log_format[0] = "json"
+
+
+def test_repair_skips_expired_tombstones(node):
+    now = time.time()
+    old = now - handler.tombstone_ttl_s[0] - 60
+    assert repair(DataPackage(deleted_ids=["old", "recent"], deleted_at=[old, now - 60])) == 1
+    assert "old" not in handler.tombstones
+    assert handler.tombstones["recent"] == now - 60
+
+    # served with the time of deletion
+    chunks = list(AntiEntropyService().GetBuckets(BucketsRequest(buckets=handler.merkle_tree.buckets, ids=[bucket_of("recent")]), None))
+    assert [(list(c.deleted_ids), list(c.deleted_at)) for c in chunks if c.deleted_ids] == [(["recent"], [now - 60])]
@@ -0,0 +1,146 @@
+import asyncio
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+from common.protocol import Protocol
+from common.utils import send_data, recv_data, recv_request
+from server.async_server import create_async_server, StreamSocket
+from server.grpc_client import SyncClient
+
+
+async def cancel_all(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.fixture
+def async_server(server_state):
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=4)
+    server = loop.run_until_complete(create_async_server('127.0.0.1', 0, SyncClient([]), executor))
+    port = server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield port
+    loop.call_soon_threadsafe(server.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    # let the per-client coroutines run their cleanup before closing the loop
+    loop.run_until_complete(cancel_all(asyncio.all_tasks(loop)))
+    loop.close()
+    executor.shutdown(wait=False)
+
+
+def connect(port):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+    return sock
+
+
+def test_login_phase_one_new_user(async_server):
+    sock = connect(async_server)
+    try:
+        send_data(sock, Protocol.REQ_LOGIN_1, "alice")
+        resp_type, resp = recv_data(sock)
+        assert resp_type == Protocol.RESP_USER_NOT_EXISTING
+        assert resp is None
+    finally:
+        sock.close()
+
+
+def test_many_idle_connections_are_served(async_server):
+    socks = [connect(async_server) for _ in range(50)]
+    try:
+        # an idle connection must not prevent others from being served
+        send_data(socks[-1], Protocol.REQ_LOGIN_1, "bob")
+        resp_type, _ = recv_data(socks[-1])
+        assert resp_type == Protocol.RESP_USER_NOT_EXISTING
+    finally:
+        for s in socks:
+            s.close()
+
+
+def test_requests_on_one_connection_are_ordered(async_server):
+    sock = connect(async_server)
+    try:
+        send_data(sock, Protocol.REQ_LOGIN_1, "carol")
+        send_data(sock, Protocol.REQ_LIST_USERS, None)
+        assert recv_data(sock)[0] == Protocol.RESP_USER_NOT_EXISTING
+        resp_type, resp = recv_data(sock)
+        assert resp_type == Protocol.RESP_LIST_USERS
+        assert "carol" in resp
+    finally:
+        sock.close()
+
+
+def test_login_phase_two_creates_account(async_server):
+    sock = connect(async_server)
+    try:
+        send_data(sock, Protocol.REQ_LOGIN_1, "dave")
+        assert recv_data(sock)[0] == Protocol.RESP_USER_NOT_EXISTING
+        send_data(sock, Protocol.REQ_LOGIN_2, "pw")
+        resp_type, resp = recv_data(sock)
+        assert resp_type == Protocol.RESP_LOGIN_SUCCESS
+        assert "dave" in resp
+    finally:
+        sock.close()
+
+
+def test_pipelined_requests_are_matched_by_id(async_server):
+    sock = connect(async_server)
+    try:
+        send_data(sock, Protocol.REQ_LOGIN_1, "erin", request_id=1)
+        # the reads may be answered in any order, each response carries its request's id
+        for request_id in range(2, 6):
+            send_data(sock, Protocol.REQ_LIST_USERS, None, request_id=request_id)
+        send_data(sock, Protocol.REQ_LOGIN_1, "frank", request_id=6)
+        responses = {}
+        for _ in range(6):
+            resp_type, resp, request_id = recv_request(sock)
+            responses[request_id] = (resp_type, resp)
+        assert responses[1][0] == Protocol.RESP_USER_NOT_EXISTING
+        assert all("erin" in responses[i][1] for i in range(2, 6))
+        assert responses[6][0] == Protocol.RESP_USER_NOT_EXISTING
+    finally:
+        sock.close()
+
+
+class FakeLoop:
+    def call_soon_threadsafe(self, callback, *args):
+        callback(*args)
+
+
+class FakeTransport:
+    def __init__(self):
+        self.buffered = 0
+        self.aborted = False
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def is_closing(self):
+        return self.aborted
+
+    def abort(self):
+        self.aborted = True
+
+
+class FakeWriter:
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    def write(self, data):
+        self.transport.buffered += len(data)
+
+
+def test_stalled_client_is_dropped_instead_of_buffering_pushes():
+    writer = FakeWriter()
+    sock = StreamSocket(FakeLoop(), writer, max_pending=100)
+    assert sock.push(b"x" * 60)
+    assert not writer.transport.aborted
+    assert sock.push(b"x" * 60)
+    assert writer.transport.aborted
+    assert writer.transport.buffered == 60
+    assert not sock.push(b"x")
@@ -0,0 +1,74 @@
+import time
+import pytest
+
+from conftest import FakeSocket
+from common.protocol import Protocol
+from common.utils import hash_pwd, check_pwd
+from server.auth_executor import AuthExecutor, ServerBusy
+from server.grpc_client import SyncClient
+from server.stats_reporter import format_stats
+
+
+@pytest.fixture(scope="module")
+def executor():
+    executor = AuthExecutor(workers=1, max_pending=2)
+    yield executor
+    executor.shutdown()
+
+
+def test_hash_and_check_run_in_workers(executor):
+    hashed = executor.hash_pwd("secret").result(timeout=30)
+    assert check_pwd("secret", hashed)
+    assert executor.check_pwd("secret", hashed).result(timeout=30) is True
+    assert executor.check_pwd("wrong", hashed).result(timeout=30) is False
+
+    stats = executor.stats()
+    assert stats["completed"] >= 3
+    assert stats["pending"] == 0
+    assert stats["avg_hash_ms"] > 0
+    # the line the stats reporter prints
+    assert "pending=0" in format_stats(stats) and "avg_hash_ms=" in format_stats(stats)
+
+
+def test_admission_control(executor):
+    first = executor.submit(time.sleep, 0.5)
+    second = executor.submit(time.sleep, 0.1)
+    with pytest.raises(ServerBusy):
+        executor.submit(time.sleep, 0)
+    assert executor.stats()["rejected"] == 1
+    first.result(timeout=30)
+    second.result(timeout=30)
+    # the second one waited for the only worker
+    assert executor.stats()["max_queue_wait_ms"] >= 100
+    # room again once they are done
+    assert executor.submit(time.sleep, 0).result(timeout=30) is None
+
+
+@pytest.fixture
+def login_state(server_state):
+    server_state.connected_clients["addr"] = "alice"
+    return server_state
+
+
+def test_login_uses_auth_executor(login_state, executor):
+    login_state.auth_executor[0] = executor
+    login_state.user_accounts["alice"] = None
+    sock = FakeSocket()
+    login_state.handle_request(sock, "addr", Protocol.REQ_LOGIN_2, "pw", SyncClient([]))
+    assert sock.response()[0] == Protocol.RESP_LOGIN_SUCCESS
+    assert check_pwd("pw", login_state.user_accounts["alice"])
+
+    login_state.handle_request(sock, "addr", Protocol.REQ_LOGIN_2, "bad", None)
+    assert sock.response()[0] == Protocol.RESP_LOGIN_FAILED
+
+
+def test_login_when_busy(login_state):
+    class Busy:
+        def check_pwd(self, password, hashed_password):
+            raise ServerBusy()
+
+    login_state.auth_executor[0] = Busy()
+    login_state.user_accounts["alice"] = hash_pwd("pw")
+    sock = FakeSocket()
+    login_state.handle_request(sock, "addr", Protocol.REQ_LOGIN_2, "pw", None)
+    assert sock.response() == (Protocol.RESP_SERVER_BUSY, None)
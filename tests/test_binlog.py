@@ -0,0 +1,128 @@
+from collections import defaultdict, deque
+import os
+import uuid
+import pytest
+
+from common.binlog import encode_entry, decode_payload, FRAME_HEADER
+from common.log_writer import LogWriter
+from common.message import Chatmsg
+from common.utils import save_to_file, load_from_file, snapshot_filename
+from server.compaction import compact_files
+from server.convert_log import convert_log
+
+
+def load(filename, snapshot=None):
+    message_store = {}
+    load_from_file(message_store, defaultdict(lambda: defaultdict(deque)), filename, snapshot=snapshot)
+    return message_store
+
+
+def write_history(filename):
+    uid = str(uuid.uuid4())
+    save_to_file(Chatmsg("alice", "bob", "héllo 👋", msg_id=uid, timestamp=1.5), filename, mode='append')
+    save_to_file(Chatmsg("bob", "alice", "custom id", msg_id="m2", timestamp=2.5, status="delivered"), filename, mode='append')
+    save_to_file(Chatmsg("bob", "alice", "gone", msg_id="m3", timestamp=3.5), filename, mode='append')
+    save_to_file([uid], filename, mode='read')
+    save_to_file(["m3"], filename, mode='delete')
+    return uid
+
+
+def test_message_record_roundtrip():
+    msg = Chatmsg("alice", "bob", "hi", msg_id=str(uuid.uuid4()), timestamp=12.25)
+    record = encode_entry(msg.to_dict())
+    decoded = decode_payload(record[FRAME_HEADER.size:])
+    assert decoded.to_dict() == msg.to_dict()
+
+
+def test_uuid_ids_are_stored_in_16_bytes():
+    msg_id = str(uuid.uuid4())
+    with_uuid = encode_entry({"operation": "read", "ids": [msg_id]})
+    with_str = encode_entry({"operation": "read", "ids": ["x" * 36]})
+    assert len(with_str) - len(with_uuid) == 36 + 2 - 16
+    # non canonical spellings keep their exact text
+    upper = msg_id.upper()
+    decoded = decode_payload(encode_entry({"operation": "delete", "ids": [upper]})[FRAME_HEADER.size:])
+    assert decoded == {"operation": "delete", "ids": [upper]}
+
+
+def test_delete_record_keeps_deletion_times():
+    entry = {"operation": "delete", "ids": [str(uuid.uuid4()), "m2"], "deleted_at": [10.5, 11.25]}
+    assert decode_payload(encode_entry(entry)[FRAME_HEADER.size:]) == entry
+
+
+def test_binary_log_replay_matches_json(tmp_path):
+    json_log = str(tmp_path / "node.json")
+    bin_log = str(tmp_path / "node.binlog")
+    write_history(json_log)
+    uid = write_history(bin_log)
+
+    store = load(bin_log)
+    assert set(store) == {uid, "m2"}
+    assert store[uid].status == "read"
+    assert store[uid].content == "héllo 👋"
+    assert store["m2"].status == "delivered"
+    assert os.path.getsize(bin_log) < os.path.getsize(json_log)
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    bin_log = str(tmp_path / "node.binlog")
+    uid = write_history(bin_log)
+    save_to_file(Chatmsg("carol", "bob", "half written", msg_id="m9"), bin_log, mode='append')
+    with open(bin_log, 'r+b') as f:
+        f.truncate(os.path.getsize(bin_log) - 3)
+
+    assert set(load(bin_log)) == {uid, "m2"}
+
+
+def test_corrupted_record_is_detected(tmp_path):
+    bin_log = str(tmp_path / "node.binlog")
+    save_to_file(Chatmsg("alice", "bob", "one", msg_id="m1"), bin_log, mode='append')
+    save_to_file(Chatmsg("alice", "bob", "two", msg_id="m2"), bin_log, mode='append')
+    with open(bin_log, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'?')
+
+    assert set(load(bin_log)) == {"m1"}
+
+
+def test_corruption_before_the_tail_raises(tmp_path):
+    bin_log = str(tmp_path / "node.binlog")
+    save_to_file(Chatmsg("alice", "bob", "one", msg_id="m1"), bin_log, mode='append')
+    size = os.path.getsize(bin_log)
+    save_to_file(Chatmsg("alice", "bob", "two", msg_id="m2"), bin_log, mode='append')
+    with open(bin_log, 'r+b') as f:
+        f.seek(size - 1)
+        f.write(b'?')
+
+    with pytest.raises(ValueError, match="Corrupted record"):
+        load(bin_log)
+
+
+def test_convert_both_ways(tmp_path):
+    json_log = str(tmp_path / "node.json")
+    uid = write_history(json_log)
+
+    bin_log = str(tmp_path / "node.binlog")
+    assert convert_log(json_log, bin_log) == 5
+    back = str(tmp_path / "back.json")
+    assert convert_log(bin_log, back) == 5
+
+    with open(json_log, encoding='utf-8') as a, open(back, encoding='utf-8') as b:
+        assert a.read() == b.read()
+    assert set(load(bin_log)) == {uid, "m2"}
+
+
+def test_log_writer_and_compaction_in_binary(tmp_path):
+    bin_log = str(tmp_path / "node.binlog")
+    writer = LogWriter(bin_log, policy="os")
+    try:
+        writer.append(Chatmsg("alice", "bob", "one", msg_id="m1"), 'append')
+        writer.append(Chatmsg("alice", "bob", "two", msg_id="m2"), 'append')
+        writer.append(["m1"], 'delete')
+        writer.flush()
+    finally:
+        writer.close()
+
+    assert compact_files(bin_log) == 1
+    assert snapshot_filename(bin_log).endswith(".snapshot.binlog")
+    assert set(load(bin_log, snapshot=snapshot_filename(bin_log))) == {"m2"}
@@ -0,0 +1,176 @@
+from collections import defaultdict, deque
+from concurrent import futures
+import grpc
+import pytest
+
+from common.message import Chatmsg
+from common.utils import load_from_file, save_snapshot, save_to_file
+from generated import sync_pb2_grpc
+from generated.sync_pb2 import DataPackage
+from server import handler
+from server.change_log import ChangeLog
+from server.grpc_client import SyncClient, merge_packages
+from server.grpc_sync import SyncService
+
+PORT = 50553
+
+
+def make_msg(msg_id, timestamp=1.0):
+    return Chatmsg("alice", "bob", msg_id, msg_id=msg_id, timestamp=timestamp)
+
+
+def record_changes(client):
+    """m0..m4 sent, m1 read, m2 deleted: seq 1..7"""
+    for i in range(5):
+        client.incremental_sync(client.create_data_package(new_msgs=[make_msg(f"m{i}", i + 1.0)]))
+    client.incremental_sync(client.create_data_package(read_ids=["m1"]))
+    client.incremental_sync(client.create_data_package(deleted_ids=["m2"]))
+
+
+def test_record_assigns_sequence_numbers(tmp_path):
+    log = ChangeLog(str(tmp_path / "n1.changes.json"), "n1")
+    package = DataPackage(deleted_ids=["x"])
+    assert log.record(package) == 1
+    assert log.record(DataPackage(read_ids=["y"])) == 2
+    assert (package.origin, package.epoch, package.from_seq, package.to_seq) == ("n1", log.epoch, 1, 1)
+    assert log.position() == (log.epoch, 2)
+    log.close()
+
+
+def test_reload_keeps_epoch_and_sequence(tmp_path):
+    filename = str(tmp_path / "n1.changes.json")
+    log = ChangeLog(filename, "n1")
+    record_changes(SyncClient([], change_log=log))
+    epoch = log.epoch
+    log.close()
+
+    log = ChangeLog(filename, "n1")
+    assert log.position() == (epoch, 7)
+    [chunk] = log.since(epoch, 5)
+    assert (chunk.from_seq, chunk.to_seq) == (6, 7)
+    assert list(chunk.read_ids) == ["m1"]
+    assert list(chunk.deleted_ids) == ["m2"]
+    log.close()
+
+
+def test_unclean_shutdown_draws_a_new_epoch(tmp_path):
+    filename = str(tmp_path / "n1.changes.json")
+    log = ChangeLog(filename, "n1")
+    record_changes(SyncClient([], change_log=log))
+    epoch = log.epoch
+    # a crash: the writer stops without the closed record
+    log._writer.close()
+
+    log = ChangeLog(filename, "n1")
+    assert log.epoch != epoch and log.position()[1] == 0
+    assert log.since(epoch, 5) is None
+    log.close()
+    reopened = ChangeLog(filename, "n1")
+    assert reopened.epoch == log.epoch
+    reopened.close()
+
+
+def test_since_unknown_changes(tmp_path):
+    log = ChangeLog(str(tmp_path / "n1.changes.json"), "n1", retain=3)
+    record_changes(SyncClient([], change_log=log))
+    assert log.since("other epoch", 5) is None
+    # trimmed
+    assert log.since(log.epoch, 2) is None
+    # ahead of us, our log lost its tail
+    assert log.since(log.epoch, 9) is None
+    assert log.since(log.epoch, 7) == []
+    assert [c.to_seq for c in log.since(log.epoch, 4, chunk_size=2)] == [6, 7]
+    log.close()
+
+
+def test_compact_trims_file(tmp_path):
+    filename = str(tmp_path / "n1.changes.json")
+    log = ChangeLog(filename, "n1", retain=2)
+    record_changes(SyncClient([], change_log=log))
+    log.compact()
+    log.close()
+    with open(filename) as f:
+        assert len(f.readlines()) == 4  # epoch + 2 changes + closed
+    log = ChangeLog(filename, "n1")
+    assert log.position()[1] == 7
+    log.close()
+
+
+def test_merge_marks_gaps():
+    a = DataPackage(origin="n1", epoch="e", from_seq=1, to_seq=1)
+    b = DataPackage(origin="n1", epoch="e", from_seq=2, to_seq=2)
+    c = DataPackage(origin="n1", epoch="e", from_seq=4, to_seq=4)
+    assert (merge_packages([a, b]).from_seq, merge_packages([a, b]).to_seq) == (1, 2)
+    assert (merge_packages([a, b, c]).from_seq, merge_packages([a, b, c]).to_seq) == (0, 4)
+
+
+def test_advance_watermark():
+    handler.watermarks.clear()
+    try:
+        assert handler.advance_watermark(DataPackage(origin="n1", epoch="e", from_seq=1, to_seq=3))["seq"] == 3
+        # gap
+        assert handler.advance_watermark(DataPackage(origin="n1", epoch="e", from_seq=5, to_seq=5)) is None
+        # retried package overlapping what was applied
+        assert handler.advance_watermark(DataPackage(origin="n1", epoch="e", from_seq=2, to_seq=4))["seq"] == 4
+        assert handler.advance_watermark(DataPackage(origin="n1", epoch="e", from_seq=3, to_seq=4)) is None
+        # new change log of the origin
+        assert handler.advance_watermark(DataPackage(origin="n1", epoch="f", from_seq=2, to_seq=2)) is None
+        assert handler.advance_watermark(DataPackage(origin="n1", epoch="f", from_seq=1, to_seq=1))["seq"] == 1
+        assert handler.watermarks == {"n1": ("f", 1)}
+    finally:
+        handler.watermarks.clear()
+
+
+@pytest.mark.parametrize("ext", ["json", "binlog"])
+def test_watermarks_survive_log_and_snapshot(tmp_path, ext):
+    log = str(tmp_path / f"node.{ext}")
+    snapshot = str(tmp_path / f"node.snapshot.{ext}")
+    save_snapshot({"m1": make_msg("m1")}, snapshot, {"n1": ("e", 3)})
+    save_to_file([{"operation": "watermark", "origin": "n2", "epoch": "g", "seq": 9}], log, mode='entries')
+
+    watermarks = {}
+    message_store = {}
+    load_from_file(message_store, defaultdict(lambda: defaultdict(deque)), log, snapshot=snapshot, watermarks=watermarks)
+    assert watermarks == {"n1": ("e", 3), "n2": ("g", 9)}
+    assert list(message_store) == ["m1"]
+
+
+@pytest.fixture
+def origin(server_state):
+    """A node serving its change log over gRPC"""
+    server_state.node_name[0] = "n1"
+    server_state.change_log[0] = ChangeLog("n1.changes.json", "n1")
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    sync_pb2_grpc.add_DataSyncServicer_to_server(SyncService(), server)
+    server.add_insecure_port(f"[::]:{PORT}")
+    server.start()
+    yield server_state
+    server.stop(0)
+    server_state.change_log[0].close()
+    server_state.change_log[0] = None
+
+
+def test_catch_up_fetches_only_the_delta(origin):
+    record_changes(SyncClient([], change_log=origin.change_log[0]))
+    epoch = origin.change_log[0].epoch
+
+    local = {f"m{i}": make_msg(f"m{i}", i + 1.0) for i in range(4)}
+    watermarks = {"n1": (epoch, 4)}
+    SyncClient([f"localhost:{PORT}"]).catch_up(local, watermarks)
+
+    assert sorted(local) == ["m0", "m1", "m3", "m4"]
+    assert local["m1"].status == "read"
+    assert watermarks == {"n1": (epoch, 7)}
+
+
+def test_catch_up_without_watermark_fetches_full_data(origin):
+    record_changes(SyncClient([], change_log=origin.change_log[0]))
+    for i in (0, 3):
+        origin.message_store[f"m{i}"] = make_msg(f"m{i}", i + 1.0)
+
+    local = {}
+    watermarks = {"n1": ("stale epoch", 100)}
+    SyncClient([f"localhost:{PORT}"]).catch_up(local, watermarks)
+
+    assert sorted(local) == ["m0", "m3"]
+    assert watermarks == {"n1": (origin.change_log[0].epoch, 7)}
@@ -0,0 +1,190 @@
+import json
+import tracemalloc
+import uuid
+
+import pytest
+
+from common.message import Chatmsg
+from server.cold_store import ColdStore
+from server.content_segments import ContentRef, ContentSegments
+from server.grpc_client import SyncClient
+from server.message_store import MessageStore
+
+MESSAGES = 20000
+
+
+def make_msg(msg_id, timestamp=1.0, status="unread", content=None):
+    return Chatmsg("alice", "bob", content or f"hello {msg_id}", msg_id=msg_id, timestamp=timestamp, status=status)
+
+
+def test_round_trip():
+    store = ColdStore()
+    msgs = [make_msg("m1"), make_msg("m2", status="archived", content="héllo ✉️"), make_msg("m3", status="read")]
+    for msg in msgs:
+        store.add(msg)
+    for msg in msgs:
+        copy = store.get(msg.id)
+        assert (copy.id, copy.timestamp, copy.sender, copy.recipient, copy.content, copy.status) == \
+               (msg.id, msg.timestamp, msg.sender, msg.recipient, msg.content, msg.status)
+    assert store.get("missing") is None
+    assert [msg.id for msg in store.messages()] == ["m1", "m2", "m3"]
+
+
+def test_copies_decode_their_content_when_read():
+    store = ColdStore()
+    store.add(make_msg("m1", content="héllo"))
+    [copy] = store.messages()
+    assert isinstance(copy._content, ContentRef)
+    store.clear()
+    assert copy.content == "héllo"
+    # a thawed message keeps no reference to the buffer
+    store.add(make_msg("m2"))
+    assert isinstance(store.pop("m2")._content, str)
+
+
+def test_discard_and_compact():
+    store = ColdStore()
+    for i in range(10):
+        store.add(make_msg(f"m{i}"))
+    size = store.nbytes()
+    for i in range(4):
+        assert store.discard(f"m{i}")
+    assert not store.discard("m0")
+    assert len(store) == 6 and "m0" not in store
+    # fewer than half of the rows are removed
+    assert not store.compact()
+    store.discard("m4")
+    assert store.compact()
+    assert store.nbytes() < size
+    assert [msg.content for msg in store.messages()] == [f"hello m{i}" for i in range(5, 10)]
+
+
+def test_view_is_unaffected_by_later_changes(tmp_path):
+    for store in (ColdStore(), ColdStore(ContentSegments(str(tmp_path / "segments")))):
+        for i in range(4):
+            store.add(make_msg(f"m{i}", status="archived" if i == 3 else "unread"))
+        store.discard("m0")
+        view = store.view()
+        store.discard("m1")
+        store.mark_read("m2")
+        store.compact(min_deleted=0)
+        store.add(make_msg("m4"))
+        assert len(view) == 3
+        assert [(msg.id, msg.content, msg.status) for msg in view] == \
+               [("m1", "hello m1", "unread"), ("m2", "hello m2", "unread"), ("m3", "hello m3", "archived")]
+        store.clear()
+        assert [msg.id for msg in view] == ["m1", "m2", "m3"]
+
+
+def test_set_status():
+    store = ColdStore()
+    store.add(make_msg("m1"))
+    assert store.set_status("m1", "archived") == "unread"
+    assert store.set_status("m1", "read") == "archived"
+    assert store.get("m1").status == "read"
+    assert store.mark_read("m1") is None
+    assert store.set_status("missing", "read") is None
+
+
+def test_freeze_and_thaw():
+    store = MessageStore()
+    for i in range(6):
+        store[f"m{i}"] = make_msg(f"m{i}", timestamp=1.0 + i)
+    assert store.freeze(cutoff=5.0) == 4
+    assert store.stats()["cold"] == 4 and len(store) == 6
+    assert "m1" in store and sorted(store) == [f"m{i}" for i in range(6)]
+
+    # peek hands out a copy and leaves the message cold
+    assert store.peek("m1").content == "hello m1"
+    assert "m1" in store.cold
+    # reading it with [] brings it back, changes stick
+    store["m1"].status = "read"
+    assert "m1" not in store.cold and store.peek("m1").status == "read"
+
+    assert store.mark_read("m2").id == "m2"
+    assert store.mark_read("m2") is None
+    assert "m2" in store.cold and store.peek("m2").status == "read"
+
+    assert store.pop("m3").id == "m3"
+    assert store.pop("m3", None) is None
+    with pytest.raises(KeyError):
+        del store["m3"]
+    assert sorted(msg.id for msg in store.values()) == ["m0", "m1", "m2", "m4", "m5"]
+
+
+def test_segments(tmp_path):
+    segments = ContentSegments(str(tmp_path / "segments"), segment_size=64)
+    store = ColdStore(segments)
+    msgs = [make_msg(f"m{i}", content=f"héllo {i} " * 3) for i in range(10)] + [make_msg("big", content="x" * 100)]
+    for msg in msgs:
+        store.add(msg)
+    # a content never spans two segments, a larger one gets a segment of its own
+    assert len(list((tmp_path / "segments").glob("*.seg"))) > 2
+    assert [msg.content for msg in store.messages()] == [msg.content for msg in msgs]
+
+    copy = store.get("m1")
+    assert isinstance(copy._content, ContentRef) and copy == msgs[1]
+    # a thawed message does not keep its segment mapped
+    assert store.pop("m2")._content.__class__ is str
+    # the row of m2 is only flagged until compact()
+    assert store.nbytes() == 11 * 29
+
+    store.clear()
+    assert not list((tmp_path / "segments").glob("*.seg"))
+    assert copy.content == msgs[1].content
+
+
+def test_stale_segments_are_removed(tmp_path):
+    directory = str(tmp_path / "segments")
+    ColdStore(ContentSegments(directory)).add(make_msg("m1"))
+    store = ColdStore(ContentSegments(directory))
+    assert not list((tmp_path / "segments").glob("*.seg"))
+    store.add(make_msg("m2"))
+    assert store.get("m2").content == "hello m2"
+
+
+def test_handler_over_frozen_messages(server_state):
+    sync_client = SyncClient([])
+    for i in range(5):
+        server_state.send_message("alice", "bob", f"hi {i}", sync_client)
+    server_state.message_store.freeze(cutoff=float("inf"))
+    assert server_state.message_store.stats()["hot"] == 0
+
+    page = server_state.list_messages_page("bob", "alice", limit=3)
+    assert [msg.content for msg in page["messages"]] == ["hi 2", "hi 3", "hi 4"] and page["has_more"]
+    assert len(server_state.list_messages("alice", "bob")) == 5
+
+    server_state.read_messages("alice", "bob", sync_client)
+    assert {msg.status for msg in server_state.message_store.values()} == {"read"}
+    assert server_state.message_store.stats()["hot"] == 0
+    assert server_state.check_unread_counters() == []
+
+
+def bytes_per_message(lines, cutoff, segments=None):
+    """Memory held by a MessageStore loaded from JSON lines once the messages older than cutoff are frozen, per message"""
+    tracemalloc.start()
+    store = MessageStore()
+    if segments:
+        store.cold = ColdStore(ContentSegments(segments))
+    for line in lines:
+        msg = Chatmsg.from_dict(json.loads(line))
+        store[msg.id] = msg
+    store.freeze(cutoff)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(store)
+
+
+def test_memory_per_message(tmp_path):
+    users = [f"user{i}" for i in range(100)]
+    lines = [
+        json.dumps({"id": str(uuid.uuid4()), "timestamp": 1.0 + i, "sender": users[i % 100],
+                    "recipient": users[i * 7 % 100], "content": f"hello there {'x' * (i % 200)}", "status": "unread"})
+        for i in range(MESSAGES)
+    ]
+    hot = bytes_per_message(lines, cutoff=0.0)
+    cold = bytes_per_message(lines, cutoff=float("inf"))
+    mapped = bytes_per_message(lines, cutoff=float("inf"), segments=str(tmp_path / "segments"))
+    print(f"\nbytes per message: {hot:.0f} hot, {cold:.0f} cold, {mapped:.0f} cold with content segments")
+    assert cold < 0.85 * hot
+    assert mapped < cold - 100
@@ -0,0 +1,134 @@
+import json
+from collections import defaultdict, deque
+import os
+import threading
+import pytest
+
+from common.message import Chatmsg
+from common.utils import save_to_file, load_from_file, save_snapshot, snapshot_filename, previous_log_filename
+from server.compaction import compact_files, run_compactor
+
+
+def load(log_filename):
+    message_store = {}
+    load_from_file(message_store, defaultdict(lambda: defaultdict(deque)), log_filename,
+                   snapshot=snapshot_filename(log_filename))
+    return message_store
+
+
+@pytest.fixture
+def log_filename(tmp_path):
+    filename = str(tmp_path / "node1.json")
+    save_to_file(Chatmsg("alice", "bob", "one", msg_id="m1", timestamp=1.0), filename, mode='append')
+    save_to_file(Chatmsg("bob", "alice", "two", msg_id="m2", timestamp=2.0), filename, mode='append')
+    save_to_file(["m1"], filename, mode='read')
+    save_to_file(["m2"], filename, mode='delete')
+    save_to_file(Chatmsg("alice", "bob", "three", msg_id="m3", timestamp=3.0), filename, mode='append')
+    return filename
+
+
+def test_snapshot_filename():
+    assert snapshot_filename("node1.json") == "node1.snapshot.json"
+    assert snapshot_filename(os.path.join("data", "node2.json")) == os.path.join("data", "node2.snapshot.json")
+
+
+def test_compact_files_folds_log_into_snapshot(log_filename):
+    before = load(log_filename)
+    assert compact_files(log_filename) == 2
+
+    # the log is empty, the snapshot holds the live messages and the tombstones
+    assert os.path.getsize(log_filename) == 0
+    with open(snapshot_filename(log_filename), encoding='utf-8') as f:
+        lines = f.readlines()
+    assert len(lines) == 3
+    tombstones = json.loads(lines[-1])
+    assert (tombstones["operation"], tombstones["ids"]) == ("delete", ["m2"])
+    assert len(tombstones["deleted_at"]) == 1
+
+    after = load(log_filename)
+    assert set(after) == set(before) == {"m1", "m3"}
+    assert after["m1"].status == "read"
+
+
+def test_records_after_snapshot_are_replayed(log_filename):
+    compact_files(log_filename)
+    save_to_file(["m3"], log_filename, mode='read')
+    save_to_file(["m1"], log_filename, mode='delete')
+
+    store = load(log_filename)
+    assert set(store) == {"m3"}
+    assert store["m3"].status == "read"
+
+
+def test_replaying_covered_log_over_snapshot_is_harmless(log_filename):
+    # crash between writing the snapshot and truncating the log
+    state = load(log_filename)
+    save_snapshot(state, snapshot_filename(log_filename))
+
+    store = load(log_filename)
+    assert set(store) == {"m1", "m3"}
+    assert store["m1"].status == "read"
+
+
+def test_compacting_twice_is_stable(log_filename):
+    compact_files(log_filename)
+    compact_files(log_filename)
+    assert set(load(log_filename)) == {"m1", "m3"}
+
+
+def test_snapshot_is_written_after_the_stripes_are_released(server_state):
+    server_state.message_store["m1"] = Chatmsg("alice", "bob", "one", msg_id="m1", timestamp=1.0)
+    server_state.persist(server_state.message_store["m1"], 'append')
+    with server_state.snapshot_lock:
+        with server_state.lock:
+            state = server_state.capture_snapshot()
+        # the node keeps serving while the snapshot is written, to the new log
+        server_state.message_store["m2"] = Chatmsg("bob", "alice", "two", msg_id="m2", timestamp=2.0)
+        server_state.persist(server_state.message_store["m2"], 'append')
+        # a crash now replays the records that were cut over
+        assert set(load("test_node.json")) == {"m1", "m2"}
+        server_state.write_snapshot(state)
+
+    assert not os.path.exists(previous_log_filename("test_node.json"))
+    assert set(load(snapshot_filename("test_node.json"))) == {"m1"}
+    assert set(load("test_node.json")) == {"m1", "m2"}
+
+
+def test_compactor_survives_a_failed_snapshot():
+    calls = []
+    done = threading.Event()
+
+    def take_snapshot():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("dictionary changed size during iteration")
+        done.set()
+        threading.Event().wait()  # park the compactor thread
+
+    class Writer:
+        appended = 0
+
+    threading.Thread(target=run_compactor, args=(take_snapshot, Writer(), 0.01, 0), daemon=True).start()
+    assert done.wait(5)
+
+
+def test_deletes_without_a_stripe_do_not_break_tombstone_expiry(server_state):
+    # a long scan, the writer thread gets scheduled in the middle of it
+    server_state.add_tombstones([f"old-{i}" for i in range(200000)], [1e12] * 200000)
+    stop = threading.Event()
+
+    def delete_remote_ids():
+        # ids stored on another node: hold_messages finds no stripe for them
+        i = 0
+        while not stop.is_set():
+            server_state.add_tombstones([f"remote-{i}"])
+            i += 1
+
+    thread = threading.Thread(target=delete_remote_ids)
+    thread.start()
+    try:
+        for _ in range(5):
+            server_state.expire_tombstones(3600)
+    finally:
+        stop.set()
+        thread.join()
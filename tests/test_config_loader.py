@@ -1,5 +1,6 @@
 import pytest
 import json
+import os
 from server.config_loader import ServerConfig
 
 # ---------- Fixtures ----------
@@ -112,3 +113,57 @@ def test_invalid_json_format(tmp_path):
 def test_file_does_not_exist():
     with pytest.raises(FileNotFoundError):
         ServerConfig("nonexistent_file.json")
+
+# ---------- Storage Settings ----------
+
+def test_storage_defaults(valid_config):
+    cfg = ServerConfig(valid_config)
+    storage = cfg.get_storage_config()
+    assert storage["fsync_policy"] == "interval"
+    assert storage["fsync_interval_ms"] == 50
+
+def test_storage_overrides(tmp_path):
+    config_data = {"cluster": "test", "nodes": [], "storage": {"fsync_policy": "always"}}
+    path = tmp_path / "storage.json"
+    with open(path, "w") as f:
+        json.dump(config_data, f)
+
+    storage = ServerConfig(str(path)).get_storage_config()
+    assert storage["fsync_policy"] == "always"
+    assert storage["fsync_interval_ms"] == 50
+
+def test_invalid_fsync_policy_raises(tmp_path):
+    config_data = {"cluster": "test", "nodes": [], "storage": {"fsync_policy": "never"}}
+    path = tmp_path / "bad_storage.json"
+    with open(path, "w") as f:
+        json.dump(config_data, f)
+
+    with pytest.raises(ValueError, match="Invalid fsync_policy"):
+        ServerConfig(str(path)).get_storage_config()
+
+# ---------- Auth Settings ----------
+
+def test_auth_defaults_and_overrides(tmp_path):
+    config_data = {"cluster": "test", "nodes": [], "auth": {"max_pending": 8}}
+    path = tmp_path / "auth.json"
+    with open(path, "w") as f:
+        json.dump(config_data, f)
+
+    auth = ServerConfig(str(path)).get_auth_config()
+    assert auth == {"workers": 2, "max_pending": 8}
+
+# ---------- Session Settings ----------
+
+def test_placeholder_session_secret_raises(tmp_path):
+    config_data = {"cluster": "test", "nodes": [], "session": {"secret": "replace-with-a-long-random-cluster-secret"}}
+    path = tmp_path / "session.json"
+    with open(path, "w") as f:
+        json.dump(config_data, f)
+
+    with pytest.raises(ValueError, match="session.secret"):
+        ServerConfig(str(path)).get_session_config()
+
+
+def test_shipped_config_has_no_session_secret():
+    shipped = os.path.join(os.path.dirname(__file__), "..", "cluster_config.json")
+    assert ServerConfig(shipped).get_session_config()["secret"] is None
@@ -0,0 +1,134 @@
+from collections import defaultdict, deque
+import pytest
+
+from common.message import Chatmsg
+from common.utils import save_to_file, load_from_file
+from server.conversation_index import ConversationIndex, conversation_key
+
+
+@pytest.fixture
+def index():
+    return ConversationIndex()
+
+
+def make_msg(sender, recipient, msg_id, timestamp):
+    return Chatmsg(sender, recipient, f"{msg_id} body", msg_id=msg_id, timestamp=timestamp)
+
+
+def test_key_is_unordered():
+    assert conversation_key("alice", "bob") == conversation_key("bob", "alice")
+
+
+def test_get_returns_both_directions_in_time_order(index):
+    index.add(make_msg("alice", "bob", "m2", 2.0))
+    index.add(make_msg("bob", "alice", "m1", 1.0))
+    index.add(make_msg("alice", "bob", "m3", 3.0))
+    index.add(make_msg("alice", "carol", "x1", 1.5))
+
+    assert index.get("alice", "bob") == ["m1", "m2", "m3"]
+    assert index.get("bob", "alice") == ["m1", "m2", "m3"]
+    assert index.get("alice", "carol") == ["x1"]
+    assert index.get("bob", "carol") == []
+
+
+def test_add_is_idempotent(index):
+    msg = make_msg("alice", "bob", "m1", 1.0)
+    index.add(msg)
+    index.add(msg)
+    assert index.get("alice", "bob") == ["m1"]
+
+
+def test_remove(index):
+    m1 = make_msg("alice", "bob", "m1", 1.0)
+    m2 = make_msg("bob", "alice", "m2", 2.0)
+    index.add(m1)
+    index.add(m2)
+
+    index.remove(m1)
+    assert index.get("alice", "bob") == ["m2"]
+    index.remove(m2)
+    assert index.get("alice", "bob") == []
+    # removing an unknown message is a no-op
+    index.remove(m2)
+
+
+def test_remove_user_drops_all_conversations(index):
+    index.add(make_msg("alice", "bob", "m1", 1.0))
+    index.add(make_msg("carol", "alice", "m2", 2.0))
+    index.add(make_msg("bob", "carol", "m3", 3.0))
+
+    index.remove_user("alice")
+    assert index.get("alice", "bob") == []
+    assert index.get("alice", "carol") == []
+    assert index.get("bob", "carol") == ["m3"]
+
+
+def test_load_from_file_populates_index(tmp_path, index):
+    filename = str(tmp_path / "node.json")
+    save_to_file(make_msg("alice", "bob", "m2", 2.0), filename, mode='append')
+    save_to_file(make_msg("bob", "alice", "m1", 1.0), filename, mode='append')
+    save_to_file(make_msg("alice", "bob", "m3", 3.0), filename, mode='append')
+    save_to_file(["m2"], filename, mode='delete')
+
+    message_store = {}
+    messages = defaultdict(lambda: defaultdict(deque))
+    load_from_file(message_store, messages, filename, indexes=(index,))
+
+    assert index.get("alice", "bob") == ["m1", "m3"]
+
+
+@pytest.fixture
+def long_conversation(index):
+    # message m<i> has timestamp i + 1
+    for i in range(10):
+        sender, recipient = ("alice", "bob") if i % 2 == 0 else ("bob", "alice")
+        index.add(make_msg(sender, recipient, f"m{i}", float(i + 1)))
+    return index
+
+
+def test_page_latest_first(long_conversation):
+    ids, has_more = long_conversation.page("alice", "bob", 3)
+    assert ids == ["m7", "m8", "m9"]
+    assert has_more
+
+
+def test_page_before_cursor(long_conversation):
+    ids, has_more = long_conversation.page("bob", "alice", 3, before=8.0)
+    assert ids == ["m4", "m5", "m6"]
+    assert has_more
+
+    ids, has_more = long_conversation.page("bob", "alice", 5, before=4.0)
+    assert ids == ["m0", "m1", "m2"]
+    assert not has_more
+
+
+def test_page_after_cursor(long_conversation):
+    ids, has_more = long_conversation.page("alice", "bob", 3, after=3.0)
+    assert ids == ["m3", "m4", "m5"]
+    assert has_more
+
+    ids, has_more = long_conversation.page("alice", "bob", 3, after=8.0)
+    assert ids == ["m8", "m9"]
+    assert not has_more
+
+
+def test_page_between_cursors(long_conversation):
+    ids, has_more = long_conversation.page("alice", "bob", 2, before=7.0, after=2.0)
+    assert ids == ["m4", "m5"]
+    assert has_more
+
+
+def test_page_cursor_id_breaks_timestamp_ties(index):
+    for msg_id in ("a", "b", "c"):
+        index.add(make_msg("alice", "bob", msg_id, 5.0))
+    ids, has_more = index.page("alice", "bob", 1)
+    assert ids == ["c"]
+    ids, _ = index.page("alice", "bob", 1, before=5.0, before_id="c")
+    assert ids == ["b"]
+    ids, has_more = index.page("alice", "bob", 5, before=5.0, before_id="b")
+    assert ids == ["a"]
+    assert not has_more
+
+
+def test_page_of_unknown_conversation(index):
+    assert index.page("alice", "nobody", 10) == ([], False)
@@ -0,0 +1,144 @@
+import socket
+import struct
+import threading
+import pytest
+
+from common.frame_reader import FrameReader
+from common.message import Chatmsg
+from common.protocol import Protocol
+from common.utils import recv_data, recv_request, send_data
+from server import handler
+
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def frame(msg_type, obj):
+    payload = b"" if obj is None else Protocol.encode_obj(obj)
+    return struct.pack("!QI", msg_type, len(payload)) + payload
+
+
+def test_several_frames_in_one_read(pair):
+    a, b = pair
+    a.sendall(frame(1, "alice") + frame(9, None) + frame(3, ["bob", "hi ✅"]))
+    reader = FrameReader(b)
+    assert reader.read_frame() == (1, "alice")
+    assert reader.read_frame() == (9, None)
+    assert reader.read_frame() == (3, ["bob", "hi ✅"])
+
+
+def test_frames_split_across_reads(pair):
+    a, b = pair
+    data = frame(3, ["bob", "x" * 100]) + frame(1, "carol")
+
+    def trickle():
+        for i in range(len(data)):
+            a.sendall(data[i:i + 1])
+
+    t = threading.Thread(target=trickle)
+    t.start()
+    # a buffer smaller than a frame forces both compaction and growth
+    reader = FrameReader(b, buffer_size=16)
+    assert reader.read_frame() == (3, ["bob", "x" * 100])
+    assert reader.read_frame() == (1, "carol")
+    t.join()
+
+
+def test_large_frame_grows_buffer(pair):
+    a, b = pair
+    msg = Chatmsg("alice", "bob", "y" * 200000, msg_id="m1", timestamp=1.0)
+    t = threading.Thread(target=send_data, args=(a, 5, [msg]))
+    t.start()
+    msg_type, [decoded] = FrameReader(b, buffer_size=1024).read_frame()
+    t.join()
+    assert msg_type == 5
+    assert decoded.content == msg.content
+
+
+def test_closed_connection(pair):
+    a, b = pair
+    a.sendall(frame(1, "alice")[:-2])
+    a.close()
+    assert FrameReader(b).read_frame() == (None, None)
+
+
+def test_oversized_frame_is_rejected(pair):
+    a, b = pair
+    a.sendall(struct.pack("!QI", 1, 1024))
+    with pytest.raises(ValueError):
+        FrameReader(b, max_frame_size=100).read_frame()
+
+
+def test_recv_data_rejects_oversized_frame(pair):
+    a, b = pair
+    # a header claiming 4 GiB, nothing may be allocated for it
+    a.sendall(struct.pack("!QI", 1, 0xFFFFFFFF))
+    with pytest.raises(ValueError, match="exceeds limit"):
+        recv_data(b)
+
+
+def test_recv_data_reads_one_frame(pair):
+    a, b = pair
+    a.sendall(frame(1, "alice") + frame(2, "pw"))
+    assert recv_data(b) == (1, "alice")
+    assert recv_data(b) == (2, "pw")
+
+
+def test_decode_from_memoryview():
+    data = Protocol.encode_obj({"friend": "bob", "limit": 50, "before": 1.5})
+    assert Protocol.decode_obj(memoryview(bytearray(data)))[0] == {"friend": "bob", "limit": 50, "before": 1.5}
+
+
+def test_hello_negotiates_compact_messages(pair):
+    a, b = pair
+    handler.connected_clients["addr"] = "alice"
+    handler.message_store["m1"] = Chatmsg("bob", "alice", "hi", msg_id="m1", timestamp=1.0)
+    handler.index_add(handler.message_store["m1"])
+    try:
+        handler.handle_request(b, "addr", Protocol.REQ_HELLO, [Protocol.FEATURE_COMPACT_CHATMSG, "unknown"], None)
+        assert recv_data(a) == (Protocol.RESP_HELLO, [Protocol.FEATURE_COMPACT_CHATMSG])
+        handler.handle_request(b, "addr", Protocol.REQ_LIST_MESSAGES, "bob", None)
+        header = a.recv(12, socket.MSG_PEEK)
+        payload = a.recv(12 + struct.unpack("!QI", header)[1])[12:]
+        assert payload[5] == 0x06
+        assert Protocol.decode_obj(payload)[0][0].content == "hi"
+    finally:
+        handler.handle_disconnect(b, "addr")
+        assert "addr" not in handler.client_features
+        handler.message_store.clear()
+        for index in handler.indexes:
+            index.clear()
+        handler.connected_clients.clear()
+
+
+def test_request_ids_are_read_and_echoed(pair):
+    a, b = pair
+    send_data(a, 1, "alice", request_id=7)
+    send_data(a, 9, None)
+    send_data(a, 3, ["bob", "hi"], request_id=2 ** 32 - 1)
+    reader = FrameReader(b, buffer_size=16)
+    assert reader.read_request() == (1, "alice", 7)
+    assert reader.read_request() == (9, None, None)
+    assert reader.read_request() == (3, ["bob", "hi"], 2 ** 32 - 1)
+
+    send_data(b, Protocol.RESP_LIST_USERS, {"bob": 0}, request_id=7)
+    assert recv_request(a) == (Protocol.RESP_LIST_USERS, {"bob": 0}, 7)
+
+
+def test_handler_replies_with_the_request_id(pair):
+    a, b = pair
+    handler.connected_clients["addr"] = "alice"
+    try:
+        handler.handle_request(b, "addr", Protocol.REQ_HELLO, list(Protocol.FEATURES), None, request_id=1)
+        msg_type, features, request_id = recv_request(a)
+        assert request_id == 1 and Protocol.FEATURE_REQUEST_IDS in features
+        handler.handle_request(b, "addr", Protocol.REQ_LIST_USERS, None, None, request_id=2)
+        assert recv_request(a)[::2] == (Protocol.RESP_LIST_USERS, 2)
+    finally:
+        handler.handle_disconnect(b, "addr")
+        handler.connected_clients.clear()
@@ -0,0 +1,88 @@
+from concurrent import futures
+import grpc
+import pytest
+
+from common.message import Chatmsg
+from common.utils import snapshot_filename
+from generated import sync_pb2, sync_pb2_grpc
+from server.grpc_client import SyncClient, iter_chunks
+from server.grpc_sync import SyncService
+
+PORT = 50552
+
+
+@pytest.fixture
+def node(server_state):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    sync_pb2_grpc.add_DataSyncServicer_to_server(SyncService(), server)
+    server.add_insecure_port(f"[::]:{PORT}")
+    server.start()
+    yield server_state
+    server.stop(0)
+
+
+def make_msgs(count, content="hi"):
+    return [Chatmsg("alice", "bob", content, msg_id=f"m{i}", timestamp=float(i + 1)) for i in range(count)]
+
+
+def test_iter_chunks_bounds_count_and_size():
+    convert = SyncClient([])._convert_message
+    chunks = list(iter_chunks(make_msgs(25), convert, chunk_size=10))
+    assert [len(c.messages) for c in chunks] == [10, 10, 5]
+
+    chunks = list(iter_chunks(make_msgs(10, content="x" * 1000), convert, chunk_size=100, chunk_bytes=3000))
+    assert all(len(c.messages) <= 3 for c in chunks)
+    assert sum(len(c.messages) for c in chunks) == 10
+
+    # 1000 characters of 3 bytes each in UTF-8
+    chunks = list(iter_chunks(make_msgs(10, content="€" * 1000), convert, chunk_size=100, chunk_bytes=9000))
+    assert all(len(c.messages) <= 3 and c.ByteSize() < 9000 + 3100 for c in chunks)
+
+
+def test_stream_full_data_sends_chunks(node):
+    for msg in make_msgs(25):
+        node.message_store[msg.id] = msg
+    stub = sync_pb2_grpc.DataSyncStub(grpc.insecure_channel(f"localhost:{PORT}"))
+
+    chunks = list(stub.StreamFullData(sync_pb2.FullDataRequest(chunk_size=10)))
+    assert [len(c.messages) for c in chunks] == [10, 10, 5]
+    assert {m.id for c in chunks for m in c.messages} == set(node.message_store)
+
+
+def test_stream_full_data_builds_cold_messages_per_chunk(node):
+    for msg in make_msgs(25):
+        node.message_store[msg.id] = msg
+    node.message_store.freeze(cutoff=float("inf"))
+    chunks = SyncService().StreamFullData(sync_pb2.FullDataRequest(chunk_size=10), None)
+    first = next(chunks)
+
+    # the store is taken when the stream starts, later changes do not show in the next chunks
+    del node.message_store["m24"]
+    node.message_store["new"] = Chatmsg("alice", "bob", "new", msg_id="new")
+    ids = {m.id for c in [first, *chunks] for m in c.messages}
+    assert ids == {f"m{i}" for i in range(25)}
+
+
+def test_sync_on_startup_applies_streamed_chunks(node):
+    for msg in make_msgs(25):
+        node.message_store[msg.id] = msg
+    client = SyncClient([f"localhost:{PORT}"], chunk_size=7)
+
+    local = {"m3": Chatmsg("alice", "bob", "stale", msg_id="m3", timestamp=0.5)}
+    client.sync_on_startup(local)
+    assert set(local) == set(node.message_store)
+    # newer remote copies win
+    assert local["m3"].content == "hi"
+
+
+def test_stream_full_sync_replaces_store(node):
+    node.message_store["old"] = Chatmsg("carol", "bob", "old", msg_id="old", timestamp=1.0)
+    client = SyncClient([f"localhost:{PORT}"], chunk_size=4)
+
+    client.stream_full_sync(make_msgs(10))
+    assert sorted(node.message_store) == sorted(f"m{i}" for i in range(10))
+    assert node.unread_counts.get("bob", "alice") == 10
+    assert node.conversations.get("alice", "bob") == [f"m{i}" for i in range(10)]
+    # the new dataset is the snapshot
+    with open(snapshot_filename("test_node.json")) as f:
+        assert len(f.readlines()) == 10
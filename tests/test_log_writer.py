@@ -0,0 +1,115 @@
+from collections import defaultdict, deque
+import errno
+import threading
+import pytest
+
+from common.log_writer import LogWriter
+from common.message import Chatmsg
+from common.utils import load_from_file
+from server.stats_reporter import format_stats
+
+
+def load(filename):
+    message_store = {}
+    load_from_file(message_store, defaultdict(lambda: defaultdict(deque)), filename)
+    return message_store
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "node.json")
+
+
+@pytest.mark.parametrize("policy", ["always", "interval", "os"])
+def test_appends_are_replayable(log_path, policy):
+    writer = LogWriter(log_path, policy=policy, interval_ms=5)
+    try:
+        writer.append(Chatmsg("alice", "bob", "one", msg_id="m1"), 'append')
+        writer.append(Chatmsg("bob", "alice", "two", msg_id="m2"), 'append')
+        writer.append(["m1"], 'read')
+        writer.append(["m2"], 'delete')
+        writer.flush()
+    finally:
+        writer.close()
+
+    store = load(log_path)
+    assert set(store) == {"m1"}
+    assert store["m1"].status == "read"
+
+
+def test_always_policy_wait_returns_after_commit(log_path):
+    writer = LogWriter(log_path, policy="always")
+    try:
+        ticket = writer.append(Chatmsg("alice", "bob", "one", msg_id="m1"), 'append')
+        writer.wait(ticket)
+        # visible to a reader without any further flush
+        assert "m1" in load(log_path)
+    finally:
+        writer.close()
+
+
+def test_concurrent_appends_are_grouped(log_path):
+    writer = LogWriter(log_path, policy="interval", interval_ms=20)
+
+    def worker(n):
+        for i in range(50):
+            writer.append(Chatmsg("alice", "bob", "x", msg_id=f"t{n}-{i}"), 'append')
+
+    try:
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        writer.flush()
+        stats = writer.stats()
+    finally:
+        writer.close()
+
+    assert stats["records"] == 400
+    # 400 records must have been written in far fewer batches
+    assert stats["batches"] < 400
+    assert stats["max_batch_size"] > 1
+    # records wait for the next round of the interval policy
+    assert stats["max_queue_wait_ms"] > 0
+    assert len(load(log_path)) == 400
+
+
+def test_stats_line_leaves_out_the_recent_batches():
+    stats = {"policy": "os", "batches": 2, "avg_flush_ms": 1.5, "recent_batches": [(1, 1.5, 0.0)]}
+    assert format_stats(stats) == "policy=os batches=2 avg_flush_ms=1.5"
+
+
+def test_rewrite_replaces_log(log_path):
+    writer = LogWriter(log_path, policy="os")
+    try:
+        writer.append(Chatmsg("alice", "bob", "old", msg_id="m1"), 'append')
+        writer.rewrite({"m2": Chatmsg("bob", "alice", "new", msg_id="m2")})
+        writer.append(Chatmsg("alice", "bob", "after", msg_id="m3"), 'append')
+        writer.flush()
+    finally:
+        writer.close()
+
+    assert set(load(log_path)) == {"m2", "m3"}
+
+
+def test_invalid_policy(log_path):
+    with pytest.raises(ValueError, match="Invalid fsync policy"):
+        LogWriter(log_path, policy="sometimes")
+
+
+def test_write_error_reaches_the_callers(log_path, monkeypatch):
+    def fsync(fd):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr("common.log_writer.os.fsync", fsync)
+    writer = LogWriter(log_path, policy="always")
+    ticket = writer.append(Chatmsg("alice", "bob", "one", msg_id="m1"), 'append')
+    with pytest.raises(OSError):
+        writer.wait(ticket)
+    with pytest.raises(OSError):
+        writer.flush()
+    with pytest.raises(OSError):
+        writer.append(Chatmsg("alice", "bob", "two", msg_id="m2"), 'append')
+    with pytest.raises(OSError):
+        writer.close()
@@ -0,0 +1,70 @@
+import json
+import tracemalloc
+import uuid
+
+from common.message import Chatmsg
+
+MESSAGES = 20000
+
+
+class PlainChatmsg:
+    """The previous layout of Chatmsg: a __dict__ per message, strings kept as decoded"""
+    def __init__(self, sender, recipient, content, msg_id=None, timestamp=None, status="unread"):
+        self.id = msg_id
+        self.timestamp = timestamp
+        self.sender = sender
+        self.recipient = recipient
+        self.content = content
+        self.status = status
+
+
+def test_dict_round_trip():
+    msg = Chatmsg("alice", "bob", "hi", msg_id="m1", timestamp=1.5, status="read")
+    data = msg.to_dict()
+    assert data == {"id": "m1", "timestamp": 1.5, "sender": "alice", "recipient": "bob", "content": "hi", "status": "read"}
+    copy = Chatmsg.from_dict(json.loads(json.dumps(data)))
+    assert copy == msg
+    assert (copy.id, copy.timestamp) == ("m1", 1.5)
+
+
+def test_statuses():
+    msg = Chatmsg("alice", "bob", "hi")
+    assert msg.status == "unread"
+    msg.status = "read"
+    assert msg.status == "read"
+    # statuses without a code are kept as they are
+    msg.status = "archived"
+    assert msg.status == "archived"
+
+
+def test_usernames_are_shared():
+    a = Chatmsg.from_dict(json.loads('{"id": "1", "timestamp": 1, "sender": "alice", "recipient": "bob", "content": "", "status": "unread"}'))
+    b = Chatmsg.from_dict(json.loads('{"id": "2", "timestamp": 1, "sender": "alice", "recipient": "bob", "content": "", "status": "unread"}'))
+    assert a.sender is b.sender and a.recipient is b.recipient
+    assert not hasattr(a, "__dict__")
+
+
+def bytes_per_message(cls, lines):
+    """Memory held by a message store loaded from JSON lines, per message (id key and content included)"""
+    tracemalloc.start()
+    store = {}
+    for line in lines:
+        data = json.loads(line)
+        store[data["id"]] = cls(data["sender"], data["recipient"], data["content"],
+                                msg_id=data["id"], timestamp=data["timestamp"], status=data["status"])
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(store)
+
+
+def test_memory_per_message():
+    users = [f"user{i}" for i in range(100)]
+    lines = [
+        json.dumps({"id": str(uuid.uuid4()), "timestamp": 1.0 + i, "sender": users[i % 100],
+                    "recipient": users[i * 7 % 100], "content": "hello there", "status": "unread"})
+        for i in range(MESSAGES)
+    ]
+    before = bytes_per_message(PlainChatmsg, lines)
+    after = bytes_per_message(Chatmsg, lines)
+    print(f"\nbytes per message: {before:.0f} with a __dict__, {after:.0f} slotted")
+    assert after < 0.7 * before
@@ -0,0 +1,109 @@
+from concurrent import futures
+from unittest.mock import ANY
+import grpc
+import pytest
+
+from conftest import FakeSocket
+from common.protocol import Protocol
+from generated import sync_pb2_grpc
+from server import handler
+from server.grpc_client import SyncClient
+from server.grpc_sync import PresenceService
+from server.presence_gossip import exchange_presence
+from server.presence_index import PresenceIndex
+
+
+def test_local_sessions_are_counted():
+    presence = PresenceIndex()
+    presence.login("bob", "a1")
+    presence.login("bob", "a2")
+    presence.logout("a1")
+    assert presence.is_online("bob")
+    assert presence.local_usernames() == ["bob"]
+    # another login on the same connection replaces the session
+    presence.login("carol", "a2")
+    assert not presence.is_online("bob")
+    presence.logout("a2")
+    assert not presence.is_online("carol")
+
+
+def test_peer_reports_replace_and_expire():
+    presence = PresenceIndex(ttl_s=10)
+    presence.update("node2", ["bob", "carol"], now=100)
+    presence.update("node3", ["bob"], now=105)
+    assert presence.is_online("carol")
+
+    presence.update("node2", ["dave"], now=106)
+    assert not presence.is_online("carol")
+    assert presence.is_online("bob")  # still reported by node3
+
+    assert presence.expire(now=115.5) == ["node3"]
+    assert not presence.is_online("bob")
+    assert presence.is_online("dave")
+    assert presence.expire(now=117) == ["node2"]
+    assert not presence.is_online("dave")
+
+
+@pytest.fixture
+def presence_state(server_state):
+    server_state.node_name[0] = "node1"
+    server_state.user_accounts.update({"alice": "x", "bob": "x"})
+    servers = []
+
+    def serve():
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        sync_pb2_grpc.add_PresenceGossipServicer_to_server(PresenceService(), server)
+        port = server.add_insecure_port("[::]:0")
+        server.start()
+        servers.append(server)
+        return sync_pb2_grpc.PresenceGossipStub(grpc.insecure_channel(f"localhost:{port}"))
+
+    yield serve
+    for server in servers:
+        server.stop(None)
+
+
+def test_exchange_reports_both_ways(presence_state):
+    # the peer is played by this process' own service: it records "node1" and answers as "node1"
+    stub = presence_state()
+    handler.presence.login("alice", "a1")
+    exchange_presence(stub)
+    assert handler.presence.online_elsewhere("alice")
+
+
+def test_user_on_a_peer_keeps_messages_unread(presence_state):
+    handler.presence.update("node2", ["bob"])
+    handler.send_message("alice", "bob", "hi", SyncClient([]))
+    [msg] = handler.message_store.values()
+    assert msg.status == "unread"
+    assert not handler.push_registry.is_online("bob")
+
+
+def sent_to(recipient, features=(Protocol.FEATURE_SEND_RECEIPTS,)):
+    """The receipt alice gets for a message to recipient"""
+    sock = FakeSocket()
+    handler.client_features["alice_addr"] = set(features)
+    handler.connected_clients["alice_addr"] = "alice"
+    handler.handle_request(sock, "alice_addr", Protocol.REQ_SEND_MSG, [recipient, "hi"], SyncClient([]))
+    return sock.response() if sock.sent else None
+
+
+def test_receipt_tells_where_the_recipient_is(presence_state):
+    assert sent_to("bob") == (Protocol.RESP_MESSAGE_SENT, {"id": ANY, "delivery": Protocol.DELIVERY_STORED})
+
+    # logged in here without push: online, not delivered
+    handler.login_success(FakeSocket(), "bob_addr", "bob")
+    assert sent_to("bob")[1]["delivery"] == Protocol.DELIVERY_ONLINE
+    handler.handle_disconnect(FakeSocket(), "bob_addr")
+
+    handler.presence.update("node2", ["bob"])
+    assert sent_to("bob")[1]["delivery"] == Protocol.DELIVERY_ONLINE
+
+    handler.client_features["bob_addr"] = {Protocol.FEATURE_PUSH}
+    handler.login_success(FakeSocket(), "bob_addr", "bob")
+    _, receipt = sent_to("bob")
+    assert receipt["delivery"] == Protocol.DELIVERY_PUSHED
+    assert handler.message_store[receipt["id"]].status == "read"
+
+    # clients that did not ask for receipts get no reply
+    assert sent_to("bob", features=()) is None
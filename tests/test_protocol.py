@@ -52,3 +52,53 @@ def test_chat_msg(protocol):
     assert decoded_data.recipient == "bob"
     assert decoded_data.content == "test"
 
+
+def test_chat_msg_layout(protocol):
+    # Chatmsg is 0x05 followed by the dictionary of to_dict(), field by field
+    data = Chatmsg("eric", "bob", "test", msg_id="m1", timestamp=2.5, status="read")
+    assert protocol.encode_obj(data) == b'\x05' + protocol.encode_obj(data.to_dict())
+
+def test_nested_layout(protocol):
+    data = [1, {"k": [2.0, "x"]}]
+    expected = (
+        b'\x03\x00\x00\x00\x02'
+        + b'\x00' + (1).to_bytes(8, 'big')
+        + b'\x04\x00\x00\x00\x01'
+        + b'\x02\x00\x00\x00\x01k'
+        + b'\x03\x00\x00\x00\x02' + b'\x01@\x00\x00\x00\x00\x00\x00\x00' + b'\x02\x00\x00\x00\x01x'
+    )
+    assert protocol.encode_obj(data) == expected
+
+def test_deep_nesting_is_not_recursive(protocol):
+    data = []
+    for _ in range(5000):
+        data = [data]
+    encoded_data = protocol.encode_obj(data)
+    assert len(encoded_data) == 5001 * 5
+
+def test_encode_into_appends(protocol):
+    buf = bytearray(b'head')
+    assert protocol.encode_into("x", buf) is buf
+    assert bytes(buf) == b'head' + protocol.encode_obj("x")
+
+def test_unsupported_type(protocol):
+    with pytest.raises(TypeError):
+        protocol.encode_obj([b"raw bytes"])
+
+@pytest.mark.parametrize("msg", [
+    Chatmsg("eric", "bob", "héllo ✅"),  # uuid id, sent as 16 bytes
+    Chatmsg("eric", "bob", "", msg_id="m1", timestamp=2.5, status="read"),
+    Chatmsg("eric", "bob", "x", msg_id="m2", timestamp=3.0, status="archived"),
+])
+def test_compact_chat_msg(protocol, msg):
+    encoded_data = protocol.encode_obj([msg], compact=True)
+    assert encoded_data[5] == 0x06
+    [decoded_data], _ = protocol.decode_obj(memoryview(encoded_data))
+    assert decoded_data == msg
+    assert (decoded_data.id, decoded_data.timestamp) == (msg.id, msg.timestamp)
+
+def test_compact_chat_msg_is_smaller(protocol):
+    msgs = [Chatmsg("eric", "bob", "hi") for _ in range(100)]
+    assert len(protocol.encode_obj(msgs, compact=True)) < len(protocol.encode_obj(msgs)) / 2
+    # both forms decode
+    assert protocol.decode_obj(protocol.encode_obj(msgs))[0] == protocol.decode_obj(protocol.encode_obj(msgs, compact=True))[0]
@@ -0,0 +1,131 @@
+import socket
+import pytest
+
+from conftest import FakeSocket
+from common.message import Chatmsg
+from common.protocol import Protocol
+from common.session import issue_token
+from common.utils import recv_data
+from generated.sync_pb2 import DataPackage, MessageData
+from server.grpc_client import SyncClient
+from server.grpc_sync import SyncService
+from server.push_registry import PushRegistry, SerializedSocket
+
+SECRET = b"cluster secret"
+
+
+class SlowSocket(FakeSocket):
+    def push(self, data):
+        return False
+
+
+def test_registry_pushes_to_every_connection_of_the_recipient():
+    registry = PushRegistry()
+    phone, laptop, other = FakeSocket(), FakeSocket(), FakeSocket()
+    registry.register("bob", "a1", phone)
+    registry.register("bob", "a2", laptop, compact=True)
+    registry.register("carol", "a3", other)
+    msg = Chatmsg("alice", "bob", "hi", msg_id="m1", timestamp=1.0)
+
+    assert registry.push([msg]) == {"bob"}
+    for sock in (phone, laptop):
+        resp_type, [pushed] = recv_data(sock)
+        assert resp_type == Protocol.PUSH_NEW_MESSAGES
+        assert (pushed.id, pushed.content) == ("m1", "hi")
+    assert other.sent == b""
+
+    registry.unregister("a1")
+    registry.unregister("a2")
+    assert not registry.is_online("bob")
+    assert registry.push([msg]) == set()
+
+
+def test_connection_that_does_not_keep_up_is_dropped():
+    registry = PushRegistry()
+    registry.register("bob", "a1", SlowSocket())
+    assert registry.push([Chatmsg("alice", "bob", "hi")]) == set()
+    assert not registry.is_online("bob")
+
+
+def test_pushes_do_not_wait_for_a_stalled_client():
+    server, client = socket.socketpair()
+    client.settimeout(5)
+    sock = SerializedSocket(server, max_pending=4096)
+    try:
+        assert sock.push(b"x" * 100)
+        assert client.recv(100) == b"x" * 100
+        # the client stops reading, the kernel buffers fill up and then the queue
+        pushed = 0
+        while sock.push(b"y" * 1024):
+            pushed += 1
+            assert pushed < 100000
+        assert not sock.push(b"z")
+        # the connection was shut down, its reader gets the end of the stream
+        while client.recv(65536):
+            pass
+    finally:
+        sock.close()
+        client.close()
+
+
+@pytest.fixture
+def push_state(server_state, monkeypatch):
+    monkeypatch.setattr(server_state, "session_secret", [SECRET])
+    server_state.user_accounts.update({"alice": "x", "bob": "x"})
+    return server_state
+
+
+def login(state, sock, address, username, features=(Protocol.FEATURE_SESSION_TOKENS, Protocol.FEATURE_PUSH)):
+    state.handle_request(sock, address, Protocol.REQ_HELLO, list(features), None)
+    assert recv_data(sock)[0] == Protocol.RESP_HELLO
+    state.handle_request(sock, address, Protocol.REQ_RESUME_SESSION, issue_token(username, SECRET), None)
+    assert recv_data(sock)[0] == Protocol.RESP_LOGIN_SUCCESS
+    assert recv_data(sock)[0] == Protocol.RESP_SESSION_TOKEN
+
+
+def test_new_message_is_pushed_to_logged_in_recipient(push_state):
+    bob = FakeSocket()
+    login(push_state, bob, "bob_addr", "bob")
+    push_state.handle_request(FakeSocket(), "alice_addr", Protocol.REQ_LOGIN_1, "alice", None)
+    push_state.connected_clients["alice_addr"] = "alice"
+    push_state.handle_request(FakeSocket(), "alice_addr", Protocol.REQ_SEND_MSG, ["bob", "hi"], SyncClient([]))
+
+    resp_type, [msg] = recv_data(bob)
+    assert resp_type == Protocol.PUSH_NEW_MESSAGES
+    assert (msg.sender, msg.content, msg.status) == ("alice", "hi", "read")
+
+    # a connection that only claimed a name with REQ_LOGIN_1 gets nothing
+    eve = FakeSocket()
+    push_state.handle_request(eve, "eve_addr", Protocol.REQ_LOGIN_1, "alice", None)
+    recv_data(eve)
+    push_state.connected_clients["bob_addr"] = "bob"
+    push_state.handle_request(FakeSocket(), "bob_addr", Protocol.REQ_SEND_MSG, ["alice", "secret"], SyncClient([]))
+    assert eve.sent == b""
+    assert [m.status for m in push_state.message_store.values() if m.recipient == "alice"] == ["unread"]
+
+    push_state.handle_disconnect(bob, "bob_addr")
+    assert not push_state.push_registry.is_online("bob")
+
+
+def test_no_push_without_the_feature(push_state):
+    bob = FakeSocket()
+    login(push_state, bob, "bob_addr", "bob", features=[Protocol.FEATURE_SESSION_TOKENS])
+    assert not push_state.push_registry.is_online("bob")
+    push_state.connected_clients["alice_addr"] = "alice"
+    push_state.handle_request(FakeSocket(), "alice_addr", Protocol.REQ_SEND_MSG, ["bob", "hi"], SyncClient([]))
+    assert bob.sent == b""
+
+
+def test_replicated_message_is_pushed_once(push_state):
+    bob = FakeSocket()
+    login(push_state, bob, "bob_addr", "bob")
+    package = DataPackage(messages=[MessageData(
+        id="m1", sender="alice", recipient="bob", content="from node2", status="unread", timestamp=1.0
+    )])
+    SyncService().IncrementalSync(package, None)
+    resp_type, [msg] = recv_data(bob)
+    assert (resp_type, msg.id) == (Protocol.PUSH_NEW_MESSAGES, "m1")
+
+    # a re-sent copy of a known message is not pushed again
+    SyncService().IncrementalSync(package, None)
+    assert bob.sent == b""
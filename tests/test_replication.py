@@ -0,0 +1,206 @@
+import threading
+import time
+import grpc
+import pytest
+
+from common.message import Chatmsg
+from server.grpc_client import PeerSender, SyncClient, merge_packages
+
+
+class FakeStub:
+    """Records the packages it receives, can be made slow or failing"""
+    def __init__(self, delay=0.0, failures=0):
+        self.delay = delay
+        self.failures = failures
+        self.received = []
+        self.timeouts = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def IncrementalSync(self, data_package, timeout=None):
+        self.timeouts.append(timeout)
+        self.release.wait()
+        time.sleep(self.delay)
+        if self.failures > 0:
+            self.failures -= 1
+            raise grpc.RpcError("peer unavailable")
+        self.received.append(data_package)
+
+
+@pytest.fixture
+def make_sender():
+    senders = []
+
+    def make(stub, **kwargs):
+        sender = PeerSender(stub, "fake:0", **kwargs)
+        senders.append(sender)
+        return sender
+
+    yield make
+    for sender in senders:
+        sender.stop()
+
+
+def test_enqueue_does_not_wait_for_slow_peer(make_sender):
+    stub = FakeStub(delay=0.2)
+    sender = make_sender(stub, rpc_timeout=1.5, batch_max=1)
+
+    start = time.perf_counter()
+    for i in range(5):
+        sender.enqueue(i)
+    assert time.perf_counter() - start < 0.1
+
+    assert sender.flush(timeout=5)
+    assert stub.received == [0, 1, 2, 3, 4]
+    assert stub.timeouts[0] == 1.5
+
+
+def test_failed_sends_are_retried_in_order(make_sender):
+    stub = FakeStub(failures=3)
+    sender = make_sender(stub, backoff=0.01, backoff_max=0.05, batch_max=1)
+    sender.enqueue("a")
+    sender.enqueue("b")
+
+    assert sender.flush(timeout=5)
+    assert stub.received == ["a", "b"]
+    stats = sender.stats()
+    assert stats["failures"] == 3
+    assert stats["sent"] == 2
+
+
+def test_full_queue_drops_oldest(make_sender):
+    stub = FakeStub()
+    stub.release.clear()  # hold the first RPC so the queue fills up
+    sender = make_sender(stub, queue_size=3, batch_max=1)
+
+    sender.enqueue(0)
+    deadline = time.time() + 5
+    while not stub.timeouts and time.time() < deadline:  # wait until package 0 is in flight
+        time.sleep(0.001)
+    for i in range(1, 6):
+        sender.enqueue(i)
+    stub.release.set()
+
+    assert sender.flush(timeout=5)
+    assert sender.stats()["dropped"] == 2
+    # the newest packages are kept
+    assert stub.received == [0, 3, 4, 5]
+
+
+def make_package(msg_id=None, deleted_ids=(), read_ids=()):
+    new_msgs = [Chatmsg("alice", "bob", msg_id, msg_id=msg_id, timestamp=1.0)] if msg_id else []
+    return SyncClient([]).create_data_package(new_msgs, list(deleted_ids), list(read_ids))
+
+
+def test_merge_packages_keeps_order():
+    merged = merge_packages([
+        make_package("m1"),
+        make_package("m2", read_ids=["m1"]),
+        make_package(deleted_ids=["m0"], read_ids=["m2"]),
+    ])
+    assert [m.id for m in merged.messages] == ["m1", "m2"]
+    assert list(merged.deleted_ids) == ["m0"]
+    assert list(merged.read_ids) == ["m1", "m2"]
+
+
+def test_queued_packages_are_coalesced(make_sender):
+    stub = FakeStub()
+    stub.release.clear()  # hold the first RPC so the rest queue up behind it
+    sender = make_sender(stub, batch_window=0.0)
+
+    sender.enqueue(make_package("m0"))
+    time.sleep(0.05)
+    for i in range(1, 20):
+        sender.enqueue(make_package(f"m{i}"))
+    stub.release.set()
+
+    assert sender.flush(timeout=5)
+    assert len(stub.received) == 2
+    assert [m.id for m in stub.received[1].messages] == [f"m{i}" for i in range(1, 20)]
+    stats = sender.stats()
+    assert stats["sent"] == 20
+    assert stats["rpcs"] == 2
+
+
+def test_batch_size_is_bounded(make_sender):
+    stub = FakeStub()
+    stub.release.clear()
+    sender = make_sender(stub, batch_window=0.0, batch_max=4)
+
+    sender.enqueue(make_package("m0"))
+    time.sleep(0.05)
+    for i in range(1, 9):
+        sender.enqueue(make_package(f"m{i}"))
+    stub.release.set()
+
+    assert sender.flush(timeout=5)
+    assert [len(p.messages) for p in stub.received] == [1, 4, 4]
+
+
+def test_failed_batch_is_resent_whole(make_sender):
+    stub = FakeStub(failures=2)
+    sender = make_sender(stub, backoff=0.01, backoff_max=0.05, batch_window=0.05)
+    for i in range(3):
+        sender.enqueue(make_package(f"m{i}"))
+
+    assert sender.flush(timeout=5)
+    assert len(stub.received) == 1
+    assert [m.id for m in stub.received[0].messages] == ["m0", "m1", "m2"]
+    assert sender.stats()["failures"] == 2
+
+
+def test_receiver_logs_a_package_with_one_write(tmp_path, monkeypatch):
+    from collections import defaultdict, deque
+    from common.utils import load_from_file
+    from server import grpc_sync, handler
+
+    monkeypatch.chdir(tmp_path)
+    handler.node_name[0] = "test_node"
+    writes = []
+    monkeypatch.setattr(grpc_sync, "persist", lambda data, mode: writes.append(mode) or handler.persist(data, mode))
+    try:
+        package = merge_packages([
+            make_package("m1"), make_package("m2"), make_package("m3"),
+            make_package(deleted_ids=["m2"]), make_package(read_ids=["m1"]),
+        ])
+        grpc_sync.SyncService().IncrementalSync(package, None)
+        assert writes == ["entries"]
+
+        message_store = {}
+        load_from_file(message_store, defaultdict(lambda: defaultdict(deque)), "test_node.json")
+        assert sorted(message_store) == ["m1", "m3"]
+        assert message_store["m1"].status == "read"
+        assert message_store["m3"].status == "unread"
+    finally:
+        handler.message_store.clear()
+        handler.messages.clear()
+        for index in handler.indexes:
+            index.clear()
+        handler.expire_tombstones(float("-inf"))  # drop them all
+
+
+def test_applying_a_package_again_changes_nothing(tmp_path, monkeypatch):
+    from server import grpc_sync, handler
+
+    monkeypatch.chdir(tmp_path)
+    handler.node_name[0] = "test_node"
+    writes = []
+    monkeypatch.setattr(grpc_sync, "persist", lambda data, mode: writes.append(data) or handler.persist(data, mode))
+    try:
+        package = make_package("x1")
+        grpc_sync.SyncService().IncrementalSync(package, None)
+        handler.read_messages("alice", "bob", SyncClient([]))
+        # the peer resends the package after a timeout
+        grpc_sync.SyncService().IncrementalSync(package, None)
+        assert list(handler.messages["bob"]["alice"]) == ["x1"]
+        assert handler.message_store["x1"].status == "read"
+        assert len(writes) == 1
+
+        grpc_sync.SyncService().IncrementalSync(make_package(deleted_ids=["x1"]), None)
+        assert list(handler.messages["bob"]["alice"]) == []
+    finally:
+        handler.message_store.clear()
+        handler.messages.clear()
+        for index in handler.indexes:
+            index.clear()
+        handler.expire_tombstones(float("-inf"))  # drop them all
@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import FakeSocket
+from common.protocol import Protocol
+from common.session import issue_token, verify_token
+from common.utils import hash_pwd, recv_data
+
+SECRET = b"cluster secret"
+
+
+def test_token_roundtrip():
+    token = issue_token("alice.smith", SECRET, ttl_s=60, now=1000)
+    assert verify_token(token, SECRET, now=1059) == "alice.smith"
+    # another node with the same secret accepts it
+    assert verify_token(token, b"cluster secret", now=1000) == "alice.smith"
+
+
+@pytest.mark.parametrize("token, secret, now", [
+    (issue_token("alice", SECRET, ttl_s=60, now=1000), SECRET, 1061),  # expired
+    (issue_token("alice", SECRET, ttl_s=60, now=1000), b"other", 1000),  # other cluster
+    ("garbage", SECRET, 0),
+    (None, SECRET, 0),
+])
+def test_invalid_tokens(token, secret, now):
+    assert verify_token(token, secret, now=now) is None
+
+
+def test_tampered_token():
+    name, expires, signature = issue_token("alice", SECRET, now=1000).split(".")
+    assert verify_token(f"{name}.{int(expires) + 3600}.{signature}", SECRET, now=1000) is None
+
+
+@pytest.fixture
+def session_state(server_state, monkeypatch):
+    monkeypatch.setattr(server_state, "session_secret", [SECRET])
+    server_state.user_accounts["alice"] = hash_pwd("pw")
+    return server_state
+
+
+def hello(handler, sock, address):
+    handler.handle_request(sock, address, Protocol.REQ_HELLO, [Protocol.FEATURE_SESSION_TOKENS], None)
+    assert recv_data(sock) == (Protocol.RESP_HELLO, [Protocol.FEATURE_SESSION_TOKENS])
+
+
+def test_login_issues_token_that_resumes_elsewhere(session_state):
+    sock = FakeSocket()
+    hello(session_state, sock, "addr1")
+    session_state.connected_clients["addr1"] = "alice"
+    session_state.handle_request(sock, "addr1", Protocol.REQ_LOGIN_2, "pw", None)
+    assert recv_data(sock)[0] == Protocol.RESP_LOGIN_SUCCESS
+    resp_type, token = recv_data(sock)
+    assert resp_type == Protocol.RESP_SESSION_TOKEN
+
+    # a new connection, e.g. to the next node after a failover
+    hello(session_state, sock, "addr2")
+    session_state.handle_request(sock, "addr2", Protocol.REQ_RESUME_SESSION, token, None)
+    assert recv_data(sock) == (Protocol.RESP_LOGIN_SUCCESS, ["alice"])
+    assert recv_data(sock)[0] == Protocol.RESP_SESSION_TOKEN
+    assert session_state.connected_clients["addr2"] == "alice"
+
+    session_state.handle_request(sock, "addr3", Protocol.REQ_RESUME_SESSION, token + "0", None)
+    assert recv_data(sock) == (Protocol.RESP_LOGIN_FAILED, None)
+    assert "addr3" not in session_state.connected_clients
+
+
+def test_no_token_without_the_feature(session_state):
+    sock = FakeSocket()
+    session_state.connected_clients["addr1"] = "alice"
+    session_state.handle_request(sock, "addr1", Protocol.REQ_LOGIN_2, "pw", None)
+    assert recv_data(sock)[0] == Protocol.RESP_LOGIN_SUCCESS
+    assert sock.sent == b""
+
+
+def test_deleted_account_cannot_resume(session_state):
+    sock = FakeSocket()
+    token = issue_token("alice", SECRET)
+    del session_state.user_accounts["alice"]
+    session_state.handle_request(sock, "addr1", Protocol.REQ_RESUME_SESSION, token, None)
+    assert recv_data(sock) == (Protocol.RESP_LOGIN_FAILED, None)
+    assert "addr1" not in session_state.connected_clients
@@ -0,0 +1,102 @@
+import threading
+import pytest
+
+from conftest import FakeSyncClient
+from generated.sync_pb2 import DataPackage, MessageData
+from server.grpc_sync import SyncService
+from server.merkle_tree import MerkleTree
+from server.striped_lock import StripedLock
+
+
+def keys_on_distinct_stripes(lock, n):
+    keys = {}
+    i = 0
+    while len(keys) < n:
+        keys.setdefault(lock.stripe(("user", i)), ("user", i))
+        i += 1
+    return list(keys.values())
+
+
+def test_keys_in_any_order_do_not_deadlock():
+    lock = StripedLock(stripes=4)
+    a, b, c = keys_on_distinct_stripes(lock, 3)
+
+    def worker(keys):
+        for _ in range(2000):
+            with lock.hold(keys):
+                pass
+
+    def hold_all():
+        for _ in range(200):
+            with lock:
+                pass
+
+    threads = [threading.Thread(target=worker, args=(keys,)) for keys in ([a, b], [b, a], [c, b, a], [a, c])]
+    threads.append(threading.Thread(target=hold_all))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+    assert not any(t.is_alive() for t in threads)
+
+
+def test_independent_keys_run_in_parallel():
+    lock = StripedLock(stripes=8)
+    a, b = keys_on_distinct_stripes(lock, 2)
+    got_b = threading.Event()
+    got_all = threading.Event()
+
+    def hold_b():
+        with lock.hold([b]):
+            got_b.set()
+
+    def hold_all():
+        with lock:
+            got_all.set()
+
+    with lock.hold([a]):
+        # another key is free, the whole lock is not
+        threading.Thread(target=hold_b).start()
+        assert got_b.wait(timeout=5)
+        threading.Thread(target=hold_all).start()
+        assert not got_all.wait(timeout=0.1)
+    assert got_all.wait(timeout=5)
+
+
+def test_concurrent_updates_keep_indexes_consistent(server_state):
+    sync_client = FakeSyncClient()
+    service = SyncService()
+    users = [f"u{i}" for i in range(6)]
+
+    def chat(sender, recipient):
+        for i in range(50):
+            server_state.send_message(sender, recipient, f"{i}", sync_client)
+            if i % 10 == 9:
+                server_state.read_messages(sender, recipient, sync_client)
+
+    def replicate(n):
+        for i in range(50):
+            msg_id = f"r{n}-{i}"
+            service.IncrementalSync(DataPackage(messages=[MessageData(
+                id=msg_id, sender=users[n], recipient=users[(n + 1) % len(users)],
+                content="x", status="unread", timestamp=1.0 + i,
+            )], deleted_ids=[f"r{n}-{i - 1}"] if i % 5 == 4 else []), None)
+
+    threads = [threading.Thread(target=chat, args=(s, r)) for s in users for r in users if s != r]
+    threads += [threading.Thread(target=replicate, args=(n,)) for n in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+    assert not any(t.is_alive() for t in threads)
+
+    assert len(server_state.message_store) == 30 * 50 + 3 * 40
+    assert server_state.check_unread_counters() == []
+    for msg in server_state.message_store.values():
+        assert msg.id in server_state.conversations.get(msg.sender, msg.recipient)
+    expected = MerkleTree()
+    for msg in server_state.message_store.values():
+        expected.add(msg)
+    for msg_id in server_state.tombstones:
+        expected.add_tombstone(msg_id)
+    assert server_state.merkle_tree.nodes()[1] == expected.nodes()[1]
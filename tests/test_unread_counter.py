@@ -0,0 +1,121 @@
+from collections import defaultdict, deque
+import pytest
+
+from conftest import FakeSyncClient
+from common.message import Chatmsg
+from common.utils import save_to_file, load_from_file
+from generated.sync_pb2 import DataPackage, MessageData
+from server.grpc_sync import SyncService
+from server.unread_counter import UnreadCounter
+
+
+@pytest.fixture
+def server_state(server_state):
+    server_state.user_accounts.update({"alice": "x", "bob": "x", "carol": "x"})
+    return server_state
+
+
+def test_counter_basic():
+    counter = UnreadCounter()
+    m1 = Chatmsg("alice", "bob", "hi", msg_id="m1")
+    m2 = Chatmsg("alice", "bob", "there", msg_id="m2")
+    m3 = Chatmsg("alice", "bob", "seen", msg_id="m3", status="read")
+    for m in (m1, m2, m3):
+        counter.add(m)
+    assert counter.get("bob", "alice") == 2
+    assert counter.get("alice", "bob") == 0
+
+    m1.status = "read"
+    counter.mark_read(m1)
+    counter.remove(m2)
+    assert counter.get("bob", "alice") == 0
+
+
+def test_verify_reports_mismatch():
+    counter = UnreadCounter()
+    store = {"m1": Chatmsg("alice", "bob", "hi", msg_id="m1")}
+    assert counter.verify(store) == [("bob", "alice", 1, 0)]
+    counter.add(store["m1"])
+    assert counter.verify(store) == []
+
+
+def test_send_read_delete_keep_counters_consistent(server_state):
+    sync_client = FakeSyncClient()
+    server_state.send_message("alice", "bob", "one", sync_client)
+    server_state.send_message("alice", "bob", "two", sync_client)
+    server_state.send_message("carol", "bob", "three", sync_client)
+    assert server_state.list_users("bob") == {"alice": 2, "bob": 0, "carol": 1}
+    assert server_state.check_unread_counters() == []
+
+    server_state.read_messages("alice", "bob", sync_client)
+    assert server_state.list_users("bob")["alice"] == 0
+
+    carol_msg = server_state.messages["bob"]["carol"][0]
+    server_state.delete_message("carol", carol_msg, sync_client)
+    assert server_state.list_users("bob")["carol"] == 0
+    assert server_state.check_unread_counters() == []
+
+
+def test_only_the_messages_read_now_are_replicated(server_state):
+    sync_client = FakeSyncClient()
+    server_state.send_message("alice", "bob", "one", sync_client)
+    server_state.read_messages("alice", "bob", sync_client)
+    server_state.send_message("alice", "bob", "two", sync_client)
+    second = server_state.messages["bob"]["alice"][1]
+    server_state.read_messages("alice", "bob", sync_client)
+    assert sync_client.packages[-1]["read_ids"] == [second]
+
+    # opening the chat again with nothing unread sends nothing
+    sent = len(sync_client.packages)
+    server_state.read_messages("alice", "bob", sync_client)
+    assert len(sync_client.packages) == sent
+
+
+def test_delete_account_drops_counters(server_state):
+    sync_client = FakeSyncClient()
+    server_state.send_message("alice", "bob", "one", sync_client)
+    server_state.send_message("bob", "carol", "two", sync_client)
+    server_state.delete_account("alice", sync_client)
+    assert server_state.unread_counts.get("bob", "alice") == 0
+    assert server_state.unread_counts.get("carol", "bob") == 1
+    assert server_state.check_unread_counters() == []
+
+
+def test_sync_apply_keeps_counters_consistent(server_state):
+    service = SyncService()
+    new_msgs = [
+        MessageData(id="m1", sender="alice", recipient="bob", content="a", status="unread", timestamp=1.0),
+        MessageData(id="m2", sender="alice", recipient="bob", content="b", status="unread", timestamp=2.0),
+    ]
+    service.IncrementalSync(DataPackage(messages=new_msgs), None)
+    assert server_state.list_users("bob")["alice"] == 2
+
+    service.IncrementalSync(DataPackage(read_ids=["m1"], deleted_ids=["m2"]), None)
+    assert server_state.list_users("bob")["alice"] == 0
+
+    # a copy re-sent after a timeout does not make a read message unread again
+    dup = MessageData(id="m1", sender="alice", recipient="bob", content="a", status="unread", timestamp=1.0)
+    service.IncrementalSync(DataPackage(messages=[dup]), None)
+    assert server_state.list_users("bob")["alice"] == 0
+
+    # a newer version of a message replaces its contribution
+    service.IncrementalSync(DataPackage(messages=[
+        MessageData(id="m3", sender="alice", recipient="bob", content="c", status="unread", timestamp=3.0),
+    ]), None)
+    newer = MessageData(id="m3", sender="alice", recipient="bob", content="c2", status="unread", timestamp=4.0)
+    service.IncrementalSync(DataPackage(messages=[newer]), None)
+    assert server_state.list_users("bob")["alice"] == 1
+    assert server_state.check_unread_counters() == []
+
+
+def test_log_replay_populates_counters(tmp_path):
+    filename = str(tmp_path / "node.json")
+    save_to_file(Chatmsg("alice", "bob", "one", msg_id="m1"), filename, mode='append')
+    save_to_file(Chatmsg("alice", "bob", "two", msg_id="m2"), filename, mode='append')
+    save_to_file(["m1"], filename, mode='read')
+
+    message_store = {}
+    counter = UnreadCounter()
+    load_from_file(message_store, defaultdict(lambda: defaultdict(deque)), filename, indexes=(counter,))
+    assert counter.get("bob", "alice") == 1
+    assert counter.verify(message_store) == []